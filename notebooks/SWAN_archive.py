@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Archive of SWAN point outputs in a Parquet dataset partitioned by run date
+and site, replacing the stacked results csv files
+
+Layout: <archive>/run_date=YYYY-MM-DD/site=<n>/<run>.parquet
+"""
+
+import os
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import SWAN_output
+
+RUN_FORMAT = "%Y%m%d_%H%M"
+PARTITIONING = ds.partitioning(pa.schema([('run_date', pa.string()), ('site', pa.int32())]),
+                               flavor = 'hive')
+
+
+def _partition_path(archive_path, run_date, site):
+    return os.path.join(archive_path, 'run_date='+run_date, 'site='+str(int(site)))
+
+
+def append_frame(archive_path, data, run):
+    """Append one run's point series to the archive
+
+
+    Rows are deduplicated on (run, site, time) and written to one file per
+    site named after the run, so re-appending a run replaces it.
+
+    Parameters
+    ----------
+    archive_path : string
+        Root directory of the Parquet dataset
+    data : DataFrame
+        Point series for the run, as returned by SWAN_output.point_series
+    run : string
+        Run name in the "%Y%m%d_%H%M" format used for the run directories
+
+    Returns
+    -------
+    files : list
+        Paths of the files written
+
+    """
+
+    run_time = dt.datetime.strptime(run, RUN_FORMAT)
+    run_date = run_time.strftime("%Y-%m-%d")
+
+    data = data.drop(columns = [c for c in data.columns if 'Time' in c])
+    data.index.name = 'time'
+    data = data.reset_index()
+    data = data.drop_duplicates(subset = ['site', 'time'], keep = 'last')
+    data['run'] = run
+    data['lead'] = ((data['time'] - pd.Timestamp(run_time)) / pd.Timedelta(hours = 1)).astype(np.float32)
+    if 'site_name' in data.columns:
+        data['site_name'] = data['site_name'].astype(str)
+
+    files = []
+    for site, group in data.groupby('site', sort = True):
+        path = _partition_path(archive_path, run_date, site)
+        os.makedirs(path, exist_ok = True)
+        fname = os.path.join(path, run+'.parquet')
+        table = pa.Table.from_pandas(group.drop(columns = ['site']).sort_values('time'),
+                                     preserve_index = False)
+        pq.write_table(table, fname+'.tmp')
+        os.replace(fname+'.tmp', fname)
+        files.append(fname)
+    return files
+
+
+def append_run(archive_path, tbl_path, input_path, run):
+    """Parse a SWAN table output with point_series and append it to the archive
+
+
+    Parameters
+    ----------
+    archive_path : string
+        Root directory of the Parquet dataset
+    tbl_path : string
+        path to the tbl output file generated by SWAN
+    input_path : string
+        path the to the input.txt file parsed into into SWAN used to generate the tbl file.
+    run : string
+        Run name in the "%Y%m%d_%H%M" format used for the run directories
+
+    Returns
+    -------
+    files : list
+        Paths of the files written
+
+    """
+
+    data = SWAN_output.point_series(tbl_path, input_path)
+    return append_frame(archive_path, data, run)
+
+
+def import_csv(archive_path, csv_path):
+    """Load a stacked results csv (e.g. data/SWAN_wb_results.csv) into the archive"""
+
+    data = pd.read_csv(csv_path, parse_dates = True, index_col = 0)
+    data = data.drop_duplicates()
+    files = []
+    for run, group in data.groupby('run'):
+        files.extend(append_frame(archive_path, group.drop(columns = ['run']), run))
+    return files
+
+
+def open_archive(archive_path):
+    """Open the archive as a pyarrow dataset, partition columns included"""
+
+    return ds.dataset(archive_path, format = 'parquet', partitioning = PARTITIONING)
+
+
+def query(archive_path, site = None, start = None, end = None, hours = None, columns = None):
+    """Read from the archive, reading only the partitions and row groups needed
+
+
+    Parameters
+    ----------
+    archive_path : string
+        Root directory of the Parquet dataset
+    site : int or string, optional
+        Site index, or site name as written in the points file. The default is all sites.
+    start : string or datetime, optional
+        First run date to include. The default is None.
+    end : string or datetime, optional
+        Last run date to include. The default is None.
+    hours : int, optional
+        Keep only the first hours of each run, e.g. 12. The default is all lead times.
+    columns : list, optional
+        Columns to read. The default is all columns.
+
+    Returns
+    -------
+    data : DataFrame
+        Point series indexed by 'Date/Time', sorted by run, site and time
+
+    """
+
+    dataset = open_archive(archive_path)
+    filt = None
+    def _and(expr):
+        return expr if filt is None else filt & expr
+
+    if site is not None:
+        if isinstance(site, str):
+            filt = _and(ds.field('site_name') == site)
+        else:
+            filt = _and(ds.field('site') == int(site))
+    if start is not None:
+        filt = _and(ds.field('run_date') >= pd.Timestamp(start).strftime("%Y-%m-%d"))
+    if end is not None:
+        filt = _and(ds.field('run_date') <= pd.Timestamp(end).strftime("%Y-%m-%d"))
+    if hours is not None:
+        filt = _and(ds.field('lead') < hours)
+
+    if columns is not None:
+        columns = list(dict.fromkeys(['time', 'run', 'site'] + list(columns)))
+    data = dataset.to_table(columns = columns, filter = filt).to_pandas()
+
+    data = data.drop(columns = ['run_date'], errors = 'ignore')
+    if 'site_name' in data.columns:
+        data['site_name'] = data['site_name'].astype('category')
+    data = data.sort_values(['run', 'site', 'time'])
+    data.index = pd.DatetimeIndex(data.pop('time'), name = 'Date/Time')
+    return data
+
+
+def first_hours(archive_path, site, hours = 12, start = None, end = None, columns = None):
+    """The first hours of every run for one site between run dates
+
+    Replaces the groupby('run') / iloc[:12] pattern used in the notebooks.
+    """
+
+    return query(archive_path, site = site, start = start, end = end,
+                 hours = hours, columns = columns)
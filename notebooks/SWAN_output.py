@@ -11,11 +11,144 @@ Python tools for reading SWAN outputs
 import pandas as pd
 import numpy as np
 
+import npz_cache
 
 
-def read_tbl_file(filepath):
+
+#SWAN table column names renamed on read, and the columns the original
+#read_fwf parser moved to the end of the frame
+TBL_RENAME = {'TPsmoo': 'Tp_smoothed'}
+TBL_TRAILING = ['Hswell', 'Tp_smoothed']
+
+
+def _read_numbers(text, ncols):
+    """
+    Whitespace separated numbers of a text block as a (rows, ncols) array
+
+    SWAN writes asterisks for values overflowing their field, these are read
+    as NaN; any other token that is not a number raises a ValueError, as
+    does a row of the wrong length, rather than truncating the table.
+    """
+    import io
+    import re
+
+    if not text.strip():
+        return np.empty((0, ncols), dtype = np.float64)
+    if b'*' in text:
+        text = re.sub(rb'\*+', b' nan ', text)
+    values = pd.read_csv(io.BytesIO(text), sep = r'\s+', header = None, dtype = np.float64).to_numpy()
+    #short rows are padded with NaN by the parser, so the tokens are counted too
+    raw = np.frombuffer(text, dtype = np.uint8)
+    blank = (raw == 32) | (raw == 10) | (raw == 13) | (raw == 9)
+    tokens = int(np.count_nonzero(blank[:-1] & ~blank[1:])) + int(not blank[0])
+    if values.shape[1] != ncols or tokens != values.size:
+        raise ValueError("rows of "+str(ncols)+" numbers expected")
+    return values
+
+
+def read_tbl_header(filepath):
+    """Read the header of a SWAN table file
+    
+
+    Parameters
+    ----------
+    filepath : string
+        Path to the SWAN.tbl file
+
+    Returns
+    -------
+    names : list
+        The column names as written by SWAN, e.g. ['Time', 'Hsig', ...]
+    time_label : string
+        The label of the time column as it appears in the header line
+    n_header : int
+        The number of header lines before the numeric body
+
+    """
+
+    names = None
+    time_label = None
+    n_header = 0
+    previous = None
+    with open(filepath, 'r') as f:
+        for line in f:
+            if not line.startswith('%'):
+                break
+            #the units line follows the column names line
+            if '[' in line and names is None and previous is not None:
+                names = previous[1:].split()
+                time_label = previous[:previous.index(names[0]) + len(names[0])]
+            previous = line.rstrip('\n')
+            n_header += 1
+    if names is None:
+        raise ValueError('No column header found in '+filepath+', was the table written with HEAD?')
+    return names, time_label, n_header
+
+def read_tbl_file(filepath, dtype = np.float64):
     """Read SWAN table file
     
+    The header is parsed for the column names and the numeric body is then
+    read in a single vectorised pass. Site numbers and timestamps are
+    recovered from the row order (SWAN writes every site for each timestep).
+
+    Parameters
+    ----------
+    filepath : string
+        Path to the SWAN.tbl file
+    dtype : numpy dtype, optional
+        dtype of the parameter columns, the time column is always float64.
+        The default is np.float64.
+
+    Returns
+    -------
+    data : DataFrame
+        A pandas dataframe of the data
+
+    """
+
+    names, time_label, n_header = read_tbl_header(filepath)
+    ncols = len(names)
+    with open(filepath, 'rb') as f:
+        for _ in range(n_header):
+            f.readline()
+        body = f.read()
+    try:
+        values = _read_numbers(body, ncols)
+    except ValueError as err:
+        raise ValueError('Table body of '+filepath+' does not match its '+str(ncols)+' header columns: '
+                         +str(err)) from err
+
+    time = values[:, 0]
+    sites = int(np.count_nonzero(time == time[0])) if len(time) else 1
+    site = np.arange(len(time)) % sites
+
+    #convert only the first row of each timestep, YYYYMMDD.HHMMSS
+    stamp = np.rint(time[::sites] * 1e6).astype(np.int64)
+    date, hms = np.divmod(stamp, 1000000)
+    stamp = pd.to_datetime(pd.DataFrame({'year': date // 10000,
+                                         'month': date // 100 % 100,
+                                         'day': date % 100,
+                                         'hour': hms // 10000,
+                                         'minute': hms // 100 % 100,
+                                         'second': hms % 100}))
+    index = pd.DatetimeIndex(np.repeat(stamp.values, sites)[:len(time)], name = 'Date/Time')
+
+    columns = {time_label: time}
+    for i, name in enumerate(names[1:], start = 1):
+        columns[TBL_RENAME.get(name, name)] = values[:, i].astype(dtype)
+    order = [c for c in columns if c not in TBL_TRAILING] + [c for c in TBL_TRAILING if c in columns]
+    data = pd.DataFrame({c: columns[c] for c in order}, index = index)
+    data['site'] = site
+
+    return data
+
+def read_tbl_file_fwf(filepath):
+    """Read SWAN table file with pandas.read_fwf
+
+    The original parser, kept for reference and benchmarking against
+    read_tbl_file. It relies on read_fwf merging the Hswell and TPsmoo
+    columns of the standard SWAN header.
+    
 
     Parameters
     ----------
@@ -52,9 +185,37 @@ def read_tbl_input(filepath):
     locs = pd.read_csv(filepath, sep = "$", header =None)
     return locs
 
+def read_locations(filepath):
+    """Parse the SWAN points input file into a table of site locations
+    
+
+    Parameters
+    ----------
+    filepath : string
+        path the to the input.txt file of "lon lat $ name" lines parsed into SWAN
+
+    Returns
+    -------
+    locations : DataFrame
+        One row per site, in SWAN output order, with float64 lon and lat
+        columns and a site_name column when the file names the points.
+
+    """
+
+    locs = read_tbl_input(filepath)
+    coords = locs[0].str.split(expand = True)
+    locations = pd.DataFrame({'lon': pd.to_numeric(coords[0]).astype(np.float64),
+                              'lat': pd.to_numeric(coords[1]).astype(np.float64)})
+    if len(locs.columns) > 1:
+        locations.insert(0, 'site_name', locs[1].astype(str).values)
+    locations.index.name = 'site'
+    return locations
+
 def point_series(tbl_path, input_path):
     """Reads in the tbl output file and input table.txt file to generate a point series
     
+    Site names are attached as a categorical column and lon/lat as float64,
+    each gathered from the locations table by the site index in one take.
 
     Parameters
     ----------
@@ -71,22 +232,314 @@ def point_series(tbl_path, input_path):
     """
 
     data = read_tbl_file(tbl_path)
-    locations = read_tbl_input(input_path)
-
-
-    no_sites = len(data.site.unique())
-    if len(locations.columns) > 1:
-        data['site_name'] = ""
-        data['lon'] = ""
-        data['lat'] = ""
-        for i in range(no_sites):
-            data.iloc[i::no_sites, -3] = str(locations[1].values[i])
-            data.iloc[i::no_sites, -2] = locations[0][i].split(' ')[0]
-            data.iloc[i::no_sites, -1] = locations[0][i].split(' ')[1]
-    else:
-        data['lon'] = ""
-        data['lat'] = ""
-        for i in range(no_sites):
-            data.iloc[i::no_sites, -2] = locations[0][i].split(' ')[0]
-            data.iloc[i::no_sites, -1] = locations[0][i].split(' ')[1]
+    locations = read_locations(input_path)
+
+    site = data['site'].values
+    if 'site_name' in locations.columns:
+        names = pd.Categorical(locations['site_name'])
+        data['site_name'] = names.take(site)
+    data['lon'] = locations['lon'].values.take(site)
+    data['lat'] = locations['lat'].values.take(site)
     return data
+
+
+#keywords opening a spectrum block of a SWAN spectral file
+SP2_BLOCKS = (b'FACTOR', b'ZERO', b'NODATA')
+
+
+def _sp2_values(f, count):
+    """Read the next count numbers of a header, one or more per line"""
+    values = []
+    while len(values) < count:
+        values.extend(float(v) for v in f.readline().split())
+    return values[:count]
+
+
+def read_sp2_header(f):
+    """Read the header of a SWAN 1-D/2-D spectral file from an open binary file
+
+
+    Parameters
+    ----------
+    f : file
+        SWAN .sp2 file opened in binary mode, positioned at the start
+
+    Returns
+    -------
+    header : dictionary
+        timed, lon, lat, freq, dir (nautical), quantity, exception, and
+        data, the byte offset of the first time or spectrum block
+
+    """
+
+    header = {'timed': False, 'cartesian': False}
+    while True:
+        pos = f.tell()
+        line = f.readline()
+        if not line:
+            raise ValueError("no spectra in the SWAN file")
+        words = line.split()
+        key = words[0] if words else b''
+        if key == b'TIME':
+            header['timed'] = True
+            f.readline()
+        elif key in (b'LONLAT', b'LOCATIONS'):
+            n = int(f.readline().split()[0])
+            coords = np.array(_sp2_values(f, 2 * n)).reshape(n, 2)
+            header['lon'], header['lat'] = coords[:, 0], coords[:, 1]
+            header['cartesian'] = key == b'LOCATIONS'
+        elif key in (b'AFREQ', b'RFREQ'):
+            n = int(f.readline().split()[0])
+            header['freq'] = np.array(_sp2_values(f, n))
+        elif key in (b'NDIR', b'CDIR'):
+            n = int(f.readline().split()[0])
+            dirs = np.array(_sp2_values(f, n))
+            #cartesian directions (going to, counterclockwise from east) to nautical
+            header['dir'] = (270. - dirs) % 360. if key == b'CDIR' else dirs
+        elif key == b'QUANT':
+            n = int(f.readline().split()[0])
+            if n != 1:
+                raise ValueError("only spectral files of one quantity are read")
+            header['quantity'] = f.readline().split()[0].decode()
+            f.readline()
+            header['exception'] = float(f.readline().split()[0])
+        elif key in SP2_BLOCKS or (header['timed'] and key[:8].isdigit() and b'.' in key):
+            header['data'] = pos
+            return header
+
+
+class Sp2File():
+    """
+    Index of the spectrum blocks of a SWAN .sp2 file
+
+    The file is walked by seeking: for a FACTOR block the length of its first
+    row gives the length of the whole fixed width matrix, so the integers are
+    skipped without being read. The blocks wanted are then read in one pass
+    and parsed in a single numpy call.
+    """
+
+    def __init__(self, path):
+        import os
+
+        self.path = path
+        self.size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            self.header = read_sp2_header(f)
+            self.nsite = len(self.header['lon'])
+            self.nfreq, self.ndir = len(self.header['freq']), len(self.header['dir'])
+            self.times, self.blocks = self._index(f)
+
+    def _skip_matrix(self, f, start):
+        """(start, stop) bytes of the integer matrix starting at start, leaving f at stop"""
+        first = f.readline()
+        stop = start + self.nfreq * len(first)
+        if stop > self.size:
+            raise EOFError(self.path)
+        f.seek(stop)
+        peek = f.readline().split()[:1]
+        if not peek or peek[0] in SP2_BLOCKS or peek[0][:8].isdigit() and b'.' in peek[0]:
+            f.seek(stop)
+            return start, stop
+        #rows not of fixed width, count the values instead
+        f.seek(start)
+        count = 0
+        while count < self.nfreq * self.ndir:
+            line = f.readline()
+            if not line:
+                raise EOFError(self.path)
+            count += len(line.split())
+        return start, f.tell()
+
+    def _index(self, f):
+        """Times, and for every (time, site) the block: (factor, start, stop), 0. ZERO, or None NODATA"""
+        f.seek(self.header['data'])
+        times, blocks = [], []
+        while True:
+            if self.header['timed']:
+                line = f.readline()
+                if not line.strip():
+                    break
+                times.append(line.split()[0].decode())
+            row = []
+            try:
+                for site in range(self.nsite):
+                    key = f.readline().split()[0]
+                    if key == b'FACTOR':
+                        factor = float(f.readline())
+                        row.append((factor,) + self._skip_matrix(f, f.tell()))
+                    elif key == b'ZERO':
+                        row.append(0.)
+                    else:
+                        row.append(None)
+            except (IndexError, ValueError, EOFError):
+                #file still being written, the last time is incomplete
+                times = times[:len(blocks)]
+                break
+            blocks.append(row)
+            if not self.header['timed']:
+                break
+        if not self.header['timed']:
+            #stationary run, one unnamed time
+            return pd.DatetimeIndex([pd.NaT] * len(blocks)), blocks
+        return pd.to_datetime(times, format = "%Y%m%d.%H%M%S"), blocks
+
+    def read(self, sites = None, times = None):
+        """
+        Variance densities of a subset of the file
+
+
+        Parameters
+        ----------
+        sites : list, optional
+            Site positions (0 based, in SWAN output order). The default is all.
+        times : list, optional
+            Times to read. The default is all.
+
+        Returns
+        -------
+        efth : Ndarray
+            (time, site, freq, dir) float32, NaN for NODATA and exception values
+
+        """
+        sites = np.arange(self.nsite) if sites is None else np.atleast_1d(sites)
+        rows = np.arange(len(self.blocks)) if times is None else self.times.get_indexer(pd.DatetimeIndex(times))
+        if (rows < 0).any():
+            raise KeyError("times not in "+self.path)
+        shape = (self.nfreq, self.ndir)
+        efth = np.full((len(rows), len(sites)) + shape, np.nan, dtype = np.float32)
+
+        chunks, targets, factors = [], [], []
+        with open(self.path, 'rb') as f:
+            for i, r in enumerate(rows):
+                for j, s in enumerate(sites):
+                    block = self.blocks[r][s]
+                    if block is None:
+                        continue
+                    if not isinstance(block, tuple):
+                        efth[i, j] = 0.
+                        continue
+                    factor, start, stop = block
+                    f.seek(start)
+                    chunks.append(f.read(stop - start))
+                    targets.append((i, j))
+                    factors.append(factor)
+        if chunks:
+            ints = self._parse(chunks).reshape((len(chunks),) + shape)
+            values = ints * np.array(factors, dtype = np.float32)[:, None, None]
+            values[ints == self.header['exception']] = np.nan
+            i, j = np.array(targets).T
+            efth[i, j] = values
+        return efth
+
+
+    def _parse(self, chunks):
+        """Integers of every block at once, decoding the fixed width columns when the rows allow"""
+        width = len(chunks[0]) // self.nfreq
+        text = b''.join(chunks)
+        if len(text) == width * self.nfreq * len(chunks) and b'.' not in text:
+            rows = np.frombuffer(text, dtype = np.uint8).reshape(-1, width)
+            eol = 2 if rows[0, -2] == 13 else 1
+            field = (width - eol) // self.ndir
+            cells = rows[:, :field * self.ndir].reshape(-1, self.ndir, field)
+            #right aligned integers of digits, blanks and signs only
+            if (field * self.ndir + eol == width and (rows[:, -1] == 10).all() and rows.max() <= 57
+                    and (cells[..., -1] >= 48).all()):
+                values = np.zeros(cells.shape[:2], dtype = np.int32)
+                for k in range(field):
+                    digit = cells[..., k].astype(np.int32)
+                    digit -= 48
+                    np.maximum(digit, 0, out = digit)
+                    values *= 10
+                    values += digit
+                if b'-' in text:
+                    values[(cells == 45).any(axis = -1)] *= -1
+                return values.ravel()
+        return _read_numbers(text, self.ndir).ravel()
+
+
+def read_sp2(path, sites = None, times = None, cache = None, cache_path = None):
+    """Read a SWAN 2-D spectral file (SPECout SPEC2D) into a wavespectra style Dataset
+    
+
+    Parameters
+    ----------
+    path : string
+        Path to the .sp2 file
+    sites : list, optional
+        Site numbers (1 based, in SWAN output order, as labelled by
+        wavespectra.read_swan). The default is all.
+    times : list, optional
+        Times to read. The default is all.
+    cache : bool, optional
+        Read from and write to a binary cache of the whole file, keyed on the
+        file's modification time and size. The default is npz_cache.CACHE.
+    cache_path : string, optional
+        Location of the .npz cache. The default is the file path + '.npz', or
+        a file in npz_cache.CACHE_DIR for a read only output directory.
+
+    Returns
+    -------
+    spec : Dataset
+        efth (time, site, freq, dir) float32 with lon and lat per site,
+        sites labelled 1 to n as by wavespectra.read_swan
+
+    """
+    import os
+    import xarray as xr
+
+    if sites is not None:
+        #positions in the file
+        sites = np.atleast_1d(sites).astype(int) - 1
+        if (sites < 0).any():
+            raise KeyError("site numbers start at 1")
+
+    cache = npz_cache.enabled(cache)
+    if cache_path is None:
+        cache_path = npz_cache.cache_path(path)
+    stat = os.stat(path)
+    key = np.array([stat.st_mtime_ns, stat.st_size], dtype = np.int64)
+
+    arrays = None
+    if cache and os.path.isfile(cache_path):
+        try:
+            with np.load(cache_path, allow_pickle = False) as cached:
+                if np.array_equal(cached['key'], key):
+                    arrays = {k: cached[k] for k in ['efth', 'time', 'lon', 'lat', 'freq', 'dir']}
+        except (OSError, ValueError, KeyError):
+            #corrupt or outdated cache, fall through and reparse
+            pass
+
+    if arrays is not None:
+        site_idx = np.arange(len(arrays['lon'])) if sites is None else np.atleast_1d(sites)
+        rows = np.arange(len(arrays['time'])) if times is None else \
+            pd.DatetimeIndex(arrays['time']).get_indexer(pd.DatetimeIndex(times))
+        if (rows < 0).any():
+            raise KeyError("times not in "+path)
+        efth = arrays['efth'][rows][:, site_idx]
+        stamps = arrays['time'][rows]
+    else:
+        sp2 = Sp2File(path)
+        efth = sp2.read(sites, times)
+        arrays = {'lon': sp2.header['lon'], 'lat': sp2.header['lat'],
+                  'freq': sp2.header['freq'], 'dir': sp2.header['dir']}
+        stamps = sp2.times.values if times is None else pd.DatetimeIndex(times).values
+        site_idx = np.arange(sp2.nsite) if sites is None else np.atleast_1d(sites)
+        if cache and sites is None and times is None:
+            tmp_path = cache_path + '.tmp'
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok = True)
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, key = key, efth = efth, time = stamps, **arrays)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                #unwritable cache location, the cache is an optimisation only
+                pass
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    return xr.Dataset({'efth': (('time', 'site', 'freq', 'dir'), efth),
+                       'lon': ('site', arrays['lon'][site_idx]),
+                       'lat': ('site', arrays['lat'][site_idx])},
+                      coords = {'time': stamps, 'site': site_idx + 1,
+                                'freq': arrays['freq'], 'dir': arrays['dir']})
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Local orchestration of SWAN runs.
+
+Run directories are queued in a small SQLite table, executed by a pool of
+worker processes (at most one per core) and their table outputs parsed with
+SWAN_output.point_series as soon as each run finishes, then appended to the
+SWAN_archive results store by the main process.
+
+SWAN writes INPUT, PRINT and errfile into its working directory, so every
+run is executed in its own run directory: the paths SWAN_config_params
+writes relative to the root are rewritten relative to the run directory in
+a copy of the .swn file, and the root's fort.14 is linked in for READgrid
+ADCirc. write_stub writes a stand in for testing without SWAN.
+"""
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import subprocess
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+#job states in the queue
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+#outputs of a run, relative to the run directory (see SWAN_config_params)
+TABLE_OUTPUT = 'results/gc_OutPtsIP.tbl'
+POINTS_INPUT = 'inputs/PointFiles/gc_OutPts.txt'
+
+#swanrun call, {name} is the run's .swn file without the extension
+SWAN_COMMAND = ['swanrun', '{name}'] if os.name == 'nt' else ['swanrun', '-input', '{name}']
+
+
+class JobQueue():
+    """
+    SQLite table of SWAN runs and their state
+
+    Only the orchestrating process writes to it, workers report back through
+    the pool, so a plain connection is enough.
+    """
+
+    def __init__(self, dbpath = 'swan_jobs.db'):
+        self.dbpath = dbpath
+        self.conn = sqlite3.connect(dbpath)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS swan_jobs (run TEXT PRIMARY KEY, state TEXT, "
+                          "attempts INTEGER DEFAULT 0, submitted TEXT, started TEXT, finished TEXT, "
+                          "returncode INTEGER, seconds REAL, rows INTEGER, error TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS swan_jobs_state ON swan_jobs (state)")
+        self.conn.commit()
+
+    def submit(self, runs, requeue = False):
+        """Queue runs, leaving already known runs alone unless requeue is True"""
+        now = dt.datetime.now().isoformat()
+        verb = "INSERT OR REPLACE" if requeue else "INSERT OR IGNORE"
+        self.conn.executemany(verb+" INTO swan_jobs (run, state, submitted) VALUES (?, ?, ?)",
+                              [(run, QUEUED, now) for run in runs])
+        self.conn.commit()
+
+    def recover(self):
+        """Requeue runs left running by an interrupted session"""
+        self.conn.execute("UPDATE swan_jobs SET state = ? WHERE state = ?", (QUEUED, RUNNING))
+        self.conn.commit()
+
+    def claim(self, n = 1):
+        """Mark up to n queued runs as running and return them, oldest first"""
+        runs = [r for r, in self.conn.execute("SELECT run FROM swan_jobs WHERE state = ? "
+                                              "ORDER BY submitted, run LIMIT ?", (QUEUED, n))]
+        now = dt.datetime.now().isoformat()
+        self.conn.executemany("UPDATE swan_jobs SET state = ?, started = ?, attempts = attempts + 1 "
+                              "WHERE run = ?", [(RUNNING, now, run) for run in runs])
+        self.conn.commit()
+        return runs
+
+    def finish(self, run, state, returncode = None, seconds = None, rows = None, error = None):
+        self.conn.execute("UPDATE swan_jobs SET state = ?, finished = ?, returncode = ?, seconds = ?, "
+                          "rows = ?, error = ? WHERE run = ?",
+                          (state, dt.datetime.now().isoformat(), returncode, seconds, rows, error, run))
+        self.conn.commit()
+
+    def retry_failed(self, max_attempts = 3):
+        """Requeue failed runs that have been attempted fewer than max_attempts times"""
+        cur = self.conn.execute("UPDATE swan_jobs SET state = ? WHERE state = ? AND attempts < ?",
+                                (QUEUED, FAILED, max_attempts))
+        self.conn.commit()
+        return cur.rowcount
+
+    def status(self):
+        """The queue as a dataframe indexed by run"""
+        import pandas as pd
+
+        return pd.read_sql_query("SELECT * FROM swan_jobs ORDER BY run", self.conn, index_col = 'run')
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM swan_jobs GROUP BY state"))
+
+    def close(self):
+        self.conn.close()
+
+
+def _prepare(root, run):
+    """The run directory and a copy of its .swn with paths relative to it, for running SWAN there"""
+    root = os.path.abspath(root)
+    path = os.path.join(root, run)
+    with open(os.path.join(path, 'swan_mod_'+run+'.swn')) as f:
+        text = f.read()
+    swn = os.path.join(path, 'swan_run_'+run+'.swn')
+    with open(swn, 'w') as f:
+        f.write(text.replace("'./"+run+"/", "'./"))
+    #READgrid ADCirc reads fort.14 from the working directory
+    mesh, local = os.path.join(root, 'fort.14'), os.path.join(path, 'fort.14')
+    if os.path.isfile(mesh) and not os.path.lexists(local):
+        try:
+            os.symlink(mesh, local)
+        except OSError:
+            shutil.copyfile(mesh, local)
+    return path, swn
+
+
+def _command(command, swn):
+    """Fill the {swn} / {name} placeholders of the command, or append the .swn file"""
+    if any('{' in arg for arg in command):
+        return [arg.format(swn = swn, name = os.path.splitext(swn)[0]) for arg in command]
+    return list(command) + [swn]
+
+
+def _execute(run, command, root, timeout, parse):
+    """Worker: run SWAN in one run directory and parse its table output"""
+    import SWAN_output
+
+    start = time.perf_counter()
+    try:
+        path, swn = _prepare(root, run)
+    except OSError as err:
+        return run, None, 0., None, "preparing "+run+": "+repr(err)
+    try:
+        proc = subprocess.run(_command(command, swn), cwd = path, capture_output = True,
+                              text = True, timeout = timeout)
+    except subprocess.TimeoutExpired:
+        return run, None, time.perf_counter() - start, None, "timed out after "+str(timeout)+" s"
+    seconds = time.perf_counter() - start
+    if proc.returncode != 0:
+        return run, proc.returncode, seconds, None, (proc.stderr or proc.stdout)[-2000:]
+    tbl = os.path.join(path, TABLE_OUTPUT)
+    if not os.path.isfile(tbl):
+        return run, proc.returncode, seconds, None, "no table output "+tbl
+    data = None
+    if parse:
+        try:
+            data = SWAN_output.point_series(tbl, os.path.join(path, POINTS_INPUT))
+        except Exception as err:
+            return run, proc.returncode, seconds, None, "parsing "+tbl+": "+repr(err)
+    return run, proc.returncode, seconds, data, None
+
+
+def run_jobs(runs = None, executable = SWAN_COMMAND, dbpath = 'swan_jobs.db', root = '.',
+             workers = None, archive_path = None, timeout = None, retries = 0, on_result = None):
+    """
+    Run queued SWAN runs concurrently, streaming the results into the archive
+
+
+    Parameters
+    ----------
+    runs : list, optional
+        Run directories ("%Y%m%d_%H%M") to queue before starting. The default
+        works through whatever is already queued.
+    executable : string or list, optional
+        Command running SWAN, from the run directory, on the absolute path of
+        a .swn file. Arguments may hold {swn} or {name} (the path without
+        .swn), otherwise the path is appended, e.g. [sys.executable, stub].
+        The default is SWAN_COMMAND.
+    dbpath : string, optional
+        SQLite job queue. The default is 'swan_jobs.db'.
+    root : string, optional
+        Directory holding the run directories. The default is '.'.
+    workers : int, optional
+        Concurrent runs, capped at the number of cores. The default is all cores.
+    archive_path : string, optional
+        SWAN_archive dataset the point series of each finished run are
+        appended to. The default is None, not archiving.
+    timeout : float, optional
+        Seconds before a run is killed and marked failed. The default is None.
+    retries : int, optional
+        Times a failed run is requeued. The default is 0.
+    on_result : function, optional
+        Called as on_result(run, data) with each finished run's point series.
+
+    Returns
+    -------
+    counts : dictionary
+        Number of jobs in each state when the queue is drained
+
+    """
+
+    cores = os.cpu_count() or 1
+    workers = cores if workers is None else max(1, min(int(workers), cores))
+    command = [executable] if isinstance(executable, str) else list(executable)
+    parse = archive_path is not None or on_result is not None
+
+    queue = JobQueue(dbpath)
+    queue.recover()
+    if runs is not None:
+        queue.submit(list(runs))
+
+    try:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            pending = set()
+            while True:
+                for run in queue.claim(workers - len(pending)):
+                    pending.add(pool.submit(_execute, run, command, root, timeout, parse))
+                if not pending:
+                    if retries and queue.retry_failed(retries + 1):
+                        continue
+                    break
+                #handle the first run to finish, then top the pool back up
+                future = next(as_completed(pending))
+                pending.discard(future)
+                run, returncode, seconds, data, error = future.result()
+                if error is None and data is not None:
+                    try:
+                        if archive_path is not None:
+                            import SWAN_archive
+
+                            SWAN_archive.append_frame(archive_path, data, run)
+                        if on_result is not None:
+                            on_result(run, data)
+                    except Exception as err:
+                        error = "storing results: "+repr(err)
+                queue.finish(run, FAILED if error else DONE, returncode, seconds,
+                             None if data is None else len(data), error)
+        return queue.counts()
+    finally:
+        queue.close()
+
+
+STUB_SWAN = '''import os, re, sys, time
+import numpy as np
+import pandas as pd
+
+#stand in for SWAN: writes the point table requested by a .swn file
+swn = sys.argv[1]
+text = open(swn).read()
+if 'FAIL' in os.environ.get('STUB_SWAN_MODE', '') or os.path.exists('STUB_FAIL'):
+    sys.exit('stub failure')
+if os.path.exists('STUB_FAIL_ONCE'):
+    os.remove('STUB_FAIL_ONCE')
+    sys.exit('stub failure')
+time.sleep(float(os.environ.get('STUB_SWAN_SLEEP', '0')))
+table = re.search(r"TABLE 'OutPts' HEAD '([^']+)'", text).group(1)
+points = re.search(r"POINTS 'OutPts' FILE '([^']+)'", text).group(1)
+start = re.search(r"OUTput (\\d{8}\\.\\d{6})", text).group(1)
+sites = sum(1 for line in open(points) if line.strip())
+times = pd.date_range(pd.to_datetime(start, format = '%Y%m%d.%H%M%S'), periods = 49, freq = 'h')
+names = ['Hsig', 'Hswell', 'TPsmoo', 'Tm02', 'Dir', 'PkDir', 'Watlev']
+rng = np.random.default_rng(abs(hash(swn)) % 2**32)
+os.makedirs(os.path.dirname(table), exist_ok = True)
+with open(table, 'w') as f:
+    f.write('%\\n%\\n% Run:01          Table:OutPts      SWAN version:41.31\\n%\\n')
+    f.write('%       Time'.ljust(20) + ''.join(n.ljust(14) for n in names) + '\\n')
+    f.write('%       [ ]'.ljust(20) + ''.join(u.ljust(14) for u in ['[m]']*7) + '\\n%\\n')
+    for t in times.strftime('%Y%m%d.%H%M%S'):
+        for s in range(sites):
+            f.write(' ' + t + ''.join('%14.4f' % v for v in rng.uniform(0.1, 4, 7)) + '\\n')
+'''
+
+
+def write_stub(path):
+    """
+    Write a stand in SWAN executable for testing the orchestration
+
+    The stub writes 49 hourly rows of random values for every output point
+    into the table named in the .swn file. STUB_SWAN_SLEEP delays it and
+    STUB_SWAN_MODE=FAIL makes it exit with an error, as does a STUB_FAIL
+    file in the run directory; a STUB_FAIL_ONCE file fails the first
+    attempt only.
+
+    Returns
+    -------
+    command : list
+        Command to pass as run_jobs(executable = ...)
+
+    """
+    with open(path, 'w') as f:
+        f.write(STUB_SWAN)
+    return [sys.executable, path]
@@ -11,19 +11,44 @@ A script for writing a SWAN run and input file
 
 import os
 import datetime as dt
+import functools
+from concurrent.futures import ProcessPoolExecutor
 
 ##for plottting
 import matplotlib.pyplot as plt
 
-##for reading the mesh
-import read_mesh
-from scipy.io import loadmat
 import numpy as np
 import pandas as pd
 
+#input file types found in a run's inputs directory
+INPUT_TYPES = ('.sp2', '.bnd', '.wnd', '.wlv')
+
+
+@functools.lru_cache(maxsize = None)
+def _static_section(name, *args):
+    """Sections that do not depend on the run directory, built once per process"""
+    return getattr(SWAN_config_params, '_'+name)(*args)
+
+
+@functools.lru_cache(maxsize = 256)
+def _grid_lines(path, mtime):
+    """The last INPgrid and READinp lines of a wind or water level file"""
+    inpgrid = readinp = None
+    with open(path, 'r') as fp:
+        for line in fp:
+            if 'INPgrid' in line:
+                inpgrid = line
+            if 'READinp' in line:
+                readinp = line
+    return inpgrid, readinp
+
+
 class SWAN_config_params():
     """
     A class object for the generation of SWAN run files
+
+    The inputs directory is listed once per instance and the run times are
+    parsed once; sections that do not depend on the run are cached.
     """
 
     def __init__(self, run, end, meshname = 'GC_NOAAWW3_03', timestep = 30, timestepunit = 'MIN',
@@ -58,6 +83,26 @@ class SWAN_config_params():
         self.dirTheta = dirTheta
         self.dirBins = 360/dirTheta
 
+        #run times, parsed once for every section
+        self.run_time = dt.datetime.strptime(run, "%Y%m%d_%H%M")
+        self.end_time = dt.datetime.strptime(end, "%Y%m%d%H%M")
+        self.run_stamp = self.run_time.strftime("%Y%m%d.%H%M%S")
+        self._inputs = None
+
+    @property
+    def inputs(self):
+        """Input files by type (INPUT_TYPES), from a single listing of inputPath"""
+        if self._inputs is None:
+            self._inputs = {ext: [] for ext in INPUT_TYPES}
+            for f in os.listdir(self.inputPath):
+                for ext in INPUT_TYPES:
+                    if ext in f:
+                        self._inputs[ext].append(f)
+        return self._inputs
+
+    def _grid_file(self, ext):
+        path = self.inputPath+"/"+self.inputs[ext][0]
+        return _grid_lines(path, os.stat(path).st_mtime_ns)
 
 
     def header(self):
@@ -75,12 +120,16 @@ class SWAN_config_params():
         Header2 = "PROJect "+"'Tweedv0.1' "+"'01' \n"
         Header3 = "\t 'Description: Operational Wave Model Tweed and Gold Coast' \n"
         Header4 = "\t \t 'Mesh: '\n"
-        Header5 = "\t \t \t 'Start: "+self.run+" End: "+dt.datetime.strptime(self.end, "%Y%m%d%H%M").strftime("%Y%m%d_%H%M")+ " timesteps: "+str(self.timestep)+self.timestepunit+"'"
+        Header5 = "\t \t \t 'Start: "+self.run+" End: "+self.end_time.strftime("%Y%m%d_%H%M")+ " timesteps: "+str(self.timestep)+self.timestepunit+"'"
         Header = Header + Header2+ Header3 +Header4+Header5
 
         return Header
 
     def setup(self):
+        return _static_section('setup')
+
+    @staticmethod
+    def _setup():
         setup = "$***************************************\n$ Model Setup\n$***************************************\n"
         setup2 = "SET 0. 90. 0.05 NAUTical \n"
         setup3 = "MODE NONSTATionary TWODimensional \n"
@@ -90,8 +139,12 @@ class SWAN_config_params():
         return setup
 
     def comp_mesh(self):
+        return _static_section('comp_mesh', self.dirBins, tuple(self.flim))
+
+    @staticmethod
+    def _comp_mesh(dirBins, flim):
         compMesh = "$***************************************\n$ Comp Mesh\n$***************************************\n"
-        compMesh2 = "CGRID UNSTRUCtured CIRcle "+str(int(self.dirBins))+" "+str(self.flim[0])+" "+str(self.flim[-1])+"\n"
+        compMesh2 = "CGRID UNSTRUCtured CIRcle "+str(int(dirBins))+" "+str(flim[0])+" "+str(flim[-1])+"\n"
         compMesh3 = "READgrid UNSTRUCtured ADCirc $ as a fort.14 file in local directory\n"
         compMesh = compMesh+compMesh2+compMesh3
         return compMesh
@@ -108,8 +161,7 @@ class SWAN_config_params():
         modforce2 = "BOUnd SHAPespec JONswap PEAK DSPR DEGRees  $ only relevant is parameteric (TPAR) data is used'\n"
         modforce3 = "$ Eastern boundary (SIDE 1) ([len] is measured in deg CCW from SE corner) \n"
         modforce4 = "BOUndspec SIDE 1 VARiable FILE & \n"
-        boundarys = [f for f in os.listdir(self.inputPath) if '.bnd' in f]
-        boundarys.reverse()
+        boundarys = self.inputs['.bnd'][::-1]
         along = 0.00
         modforce5 = ""
         for file in boundarys:
@@ -126,8 +178,7 @@ class SWAN_config_params():
         #modforce2 = "BOUnd SHAPespec JONswap PEAK DSPR DEGRees  $ only relevant is parameteric (TPAR) data is used'\n"
         modforce3 = "$ Eastern boundary (SIDE 1) ([len] is measured in deg CCW from SE corner) \n"
         modforce4 = "BOUndspec SIDE 1 VARiable FILE & \n"
-        boundarys = [f for f in os.listdir(self.inputPath) if '.sp2' in f]
-        boundarys.reverse()
+        boundarys = self.inputs['.sp2'][::-1]
         along = 0.00
         modforce5 = ""
         for file in boundarys:
@@ -147,14 +198,7 @@ class SWAN_config_params():
     def wind_force(self):
         windforce = "$***************************************\n $Wind Forcing\n$***************************************\n"
         windforce2= "$ Regular input grid corresponding to the grid of the adopted wind model \n"
-        windFile = [f for f in os.listdir(self.inputPath) if '.wnd' in f]
-        with open(self.inputPath+"/"+windFile[0], 'r') as fp:
-            for line in fp:
-                if 'INPgrid' in line:
-                    windforce3 = line
-                if 'READinp' in line:
-                    windforce4 = line
-        fp.close()
+        windforce3, windforce4 = self._grid_file('.wnd')
         windforce = windforce+windforce2+windforce3+windforce4
 
         return windforce
@@ -162,18 +206,15 @@ class SWAN_config_params():
     def water_level(self):
         waterlvl = "$***************************************\n $Water Level Variation\n$***************************************\n"
         waterlvl2 = "$ Regular input grid corresponding to 4 corners spanning the domain \n"
-        waterFile = [f for f in os.listdir(self.inputPath) if '.wlv' in f]
-        with open(self.inputPath+"/"+waterFile[0], 'r') as fp:
-            for line in fp:
-                if 'INPgrid' in line:
-                    waterlvl3 = line
-                if 'READinp' in line:
-                    waterlvl4 = line
-        fp.close()
+        waterlvl3, waterlvl4 = self._grid_file('.wlv')
         waterlvl = waterlvl+waterlvl2+waterlvl3+waterlvl4
         return waterlvl
 
     def model_physics(self):
+        return _static_section('model_physics')
+
+    @staticmethod
+    def _model_physics():
         modelphy = "$***************************************\n $Model Physics\n$***************************************\n"
         modelphy2 = "$ Model formulation and wave growth \n"
         modelphy3 = "GEN3 WESTHuysen  \n \n"
@@ -189,6 +230,10 @@ class SWAN_config_params():
         return modelphy
 
     def model_numerics(self):
+        return _static_section('model_numerics')
+
+    @staticmethod
+    def _model_numerics():
         modelnum = "\n$***************************************\n $Model Numerics\n$***************************************\n"
         modelnum += "NUMeric STOPC 0.001 0.005 0.001 99.9 STAT 150 $  % defaults 0.005 0.01 0.005 99.5 detailed 0.001 0.005 0.001 99.9\n"
         modelnum += "$ Ensure outputs match WB frequencies \n"
@@ -205,16 +250,16 @@ class SWAN_config_params():
         modelout3 = modelout3+modelout3a
         modelout4 = "$ Point Output - Integrated parameters \n"
         modelout5 = "TABLE 'OutPts' HEAD '"+self.results+"/gc_OutPtsIP.tbl' & \n"
-        modelout6 = "TIME HSign HSWELL TPS TM02 DIR PDIR WATLev OUTput "+dt.datetime.strptime(self.run, "%Y%m%d_%H%M").strftime("%Y%m%d.%H%M%S")+" "+str(self.outtime)+" "+self.outunit+"\n"
+        modelout6 = "TIME HSign HSWELL TPS TM02 DIR PDIR WATLev OUTput "+self.run_stamp+" "+str(self.outtime)+" "+self.outunit+"\n"
         modelout5c = "SPECout 'OutPts' SPEC2D ABSolute '"+self.results+"/spec_WB.sp2' & \n"
-        modelout6c = "OUTPUT "+dt.datetime.strptime(self.run, "%Y%m%d_%H%M").strftime("%Y%m%d.%H%M%S")+" "+str(self.outtime)+" "+self.outunit+"\n"
+        modelout6c = "OUTPUT "+self.run_stamp+" "+str(self.outtime)+" "+self.outunit+"\n"
         modelout5a = "TABLE '10mPts' HEAD '"+self.results+"/Out10mPts.tbl' & \n"
-        modelout6a = "TIME HSign HSWELL TPS TM02 DIR PDIR WATLev OUTput "+dt.datetime.strptime(self.run, "%Y%m%d_%H%M").strftime("%Y%m%d.%H%M%S")+" "+str(self.outtime)+" "+self.outunit+"\n"
+        modelout6a = "TIME HSign HSWELL TPS TM02 DIR PDIR WATLev OUTput "+self.run_stamp+" "+str(self.outtime)+" "+self.outunit+"\n"
         modelout5b = "SPECout '10mPts' SPEC2D ABSolute '"+self.results+"/spec10m.sp2' & \n"
-        modelout6b = "OUTPUT "+dt.datetime.strptime(self.run, "%Y%m%d_%H%M").strftime("%Y%m%d.%H%M%S")+" "+str(self.outtime)+" "+self.outunit+"\n"
+        modelout6b = "OUTPUT "+self.run_stamp+" "+str(self.outtime)+" "+self.outunit+"\n"
         modelout7 = "\n$ Wave parameters on grid \n"
         modelout8 = "BLOCK 'COMPGRID' NOHEAD '"+self.results+"/"+self.run+"_grid_WavePar.mat' & \n"
-        modelout9 = "HSign TPS TM02 DIR PDIR WATLev  OUTput "+dt.datetime.strptime(self.run, "%Y%m%d_%H%M").strftime("%Y%m%d.%H%M%S")+" "+str(self.outtime)+" "+self.outunit+"\n"
+        modelout9 = "HSign TPS TM02 DIR PDIR WATLev  OUTput "+self.run_stamp+" "+str(self.outtime)+" "+self.outunit+"\n"
         modelout = modelout+modelout2+modelout3+modelout4+modelout5+modelout6+modelout5c+modelout6c+modelout5a+modelout6a+modelout5b+modelout6b+modelout7+modelout8+modelout9
         return modelout
 
@@ -222,7 +267,7 @@ class SWAN_config_params():
         modelrun = "$***************************************\n $Excecute Model\n$***************************************\n"
         modelrun1 = "$ Run the model \n"
         #step model back 12 hours for warm up
-        start = dt.datetime.strptime(self.run, "%Y%m%d_%H%M") - dt.timedelta(hours = 12)
+        start = self.run_time - dt.timedelta(hours = 12)
 
         modelrunA = "COMPute STationary "+ start.strftime("%Y%m%d.%H%M%S")+" \n"
         modelrun2 = "COMPute NONSTationary "+(start + dt.timedelta(minutes = 30)).strftime("%Y%m%d.%H%M%S")+" "+str(self.timestep)+" "+self.timestepunit+" "+(start + dt.timedelta(hours = 48)).strftime("%Y%m%d.%H%M%S")
@@ -241,74 +286,166 @@ class SWAN_config_params():
             Returns a string of the .swn file generated.
 
         """
+        #f.write(self.bath_mesh()) No longer needed due to fort.14 mesh file
+        sections = [self.header(), self.setup(), self.comp_mesh(), "", self.model_forcing(),
+                    self.wind_force(), self.water_level(), self.model_physics(),
+                    self.model_numerics(), self.model_outputs(), self.model_execute()]
         with open(self.path+"/swan_mod_"+self.run+".swn", 'w') as f:
-            f.write(self.header())
-            f.write("\n")
-            f.write(self.setup())
-            f.write("\n")
-            f.write(self.comp_mesh())
-            f.write("\n")
-            #f.write(self.bath_mesh()) No longer needed due to fort.14 mesh file
-            f.write("\n")
-            f.write(self.model_forcing())
-            f.write("\n")
-            f.write(self.wind_force())
-            f.write("\n")
-            f.write(self.water_level())
-            f.write("\n")
-            f.write(self.model_physics())
-            f.write("\n")
-            f.write(self.model_numerics())
-            f.write("\n")
-            f.write(self.model_outputs())
-            f.write("\n")
-            f.write(self.model_execute())
-        f.close()
+            f.write("\n".join(sections))
         return self.path+"/swan_mod_"+self.run+".swn"
 
 
+def _build_run(run, end, kwargs):
+    return SWAN_config_params(run, end, **kwargs).build_file()
+
+
+def build_files(runs, ends, workers = None, **kwargs):
+    """
+    Write the .swn files of many run directories through a process pool
+
+    Parameters
+    ----------
+    runs : list
+        Run directory names ("%Y%m%d_%H%M"), relative to the working directory
+    ends : list or string
+        End time ("%Y%m%d%H%M") of each run, or one for every run
+    workers : int, optional
+        Number of processes. The default is os.cpu_count(); 1 runs serially.
+    **kwargs
+        Passed to SWAN_config_params, e.g. meshname or timestep
+
+    Returns
+    -------
+    files : list
+        Paths of the .swn files written, in runs order
+
+    """
+    runs = list(runs)
+    ends = [ends]*len(runs) if isinstance(ends, str) else list(ends)
+    if workers == 1 or len(runs) < 2:
+        return [_build_run(run, end, kwargs) for run, end in zip(runs, ends)]
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        return list(pool.map(_build_run, runs, ends, [kwargs]*len(runs),
+                             chunksize = max(1, len(runs) // (4 * (workers or os.cpu_count() or 1)))))
+
+
 # some useful methods
+import glob
+
 import wavespectra
 import pandas as pd
 import xarray as xr
 import numpy as np
 
 
-def waveParams(dap, station = False):
+def open_spectra(dap, station = False, chunks = None):
     """
-    Creates wave params dataframe
+    Open WW3 spectral NetCDF as a wavespectra dataset, lazily when chunked
+
+    Parameters
+    ----------
+    dap : string or list
+        Path or OPeNDAP url, a glob such as '../data/AUQD.spec.*.nc' or a list
+        of files. Several files (e.g. forecast cycles) are joined along time,
+        overlapping times keeping the later file.
+    station : optional
+        Site label or list of labels to select before anything is read. The
+        default is every site.
+    chunks : dictionary, optional
+        dask chunks, e.g. {'time': 24, 'station': 1}. The default reads a
+        single file eagerly and chunks multiple files by file.
+
+    Returns
+    -------
+    spec : Dataset
+        wavespectra dataset, dask backed when chunked
+
     """
-    
-    ds = xr.open_dataset(dap)
+    if isinstance(dap, str) and glob.has_magic(dap):
+        dap = sorted(glob.glob(dap))
+        if not dap:
+            raise FileNotFoundError("no spectral files match the pattern")
+    if isinstance(dap, (list, tuple)):
+        ds = xr.open_mfdataset(list(dap), combine = 'nested', concat_dim = 'time', chunks = chunks or {},
+                               data_vars = 'minimal', coords = 'minimal', compat = 'override',
+                               parallel = True)
+        #later cycles replace the overlapping times of earlier ones
+        times = ds.indexes['time']
+        keep = ~times.duplicated(keep = 'last')
+        if not keep.all() or not times.is_monotonic_increasing:
+            ds = ds.isel(time = np.flatnonzero(keep))
+            ds = ds.isel(time = np.argsort(ds['time'].values, kind = 'stable'))
+    else:
+        ds = xr.open_dataset(dap, chunks = chunks)
     spec = wavespectra.read_dataset(ds)
+    if station is not False:
+        spec = spec.sel(site = station)
+    return spec
 
+def waveParams(dap, station = False, chunks = None, params = ["hs", "tp", "dpm", "dspr"]):
+    """
+    Creates wave params dataframe
 
-    if station != False:
-        spec = spec.sel(site = station)
-        
-    stats = spec.spec.stats(["hs", "tp", "dpm", "dspr"]).to_dataframe()
+    With chunks, or for a list or glob of files, the stations are selected
+    before any data are read and the stats are computed by dask chunk by
+    chunk, so memory is bounded by the chunk size rather than the archive.
+
+    Parameters
+    ----------
+    dap : string or list
+        Path, OPeNDAP url, glob or list of WW3 spectral files, see open_spectra
+    station : optional
+        Site label (or list of labels). The default is False, every site.
+    chunks : dictionary, optional
+        dask chunks over time/station, e.g. {'time': 24}. The default is None.
+    params : list, optional
+        wavespectra stats. The default is ["hs", "tp", "dpm", "dspr"].
+
+    Returns
+    -------
+    stats : dataframe
+        indexed by time, with a site column when several sites are returned
+
+    """
+    
+    spec = open_spectra(dap, station, chunks)
+
+    stats = spec.spec.stats(list(params))
+    if chunks is not None or isinstance(dap, (list, tuple)) or glob.has_magic(dap):
+        stats = stats.compute()
+    stats = stats.to_dataframe()
     #stats['dpm'] = 180 -stats.dpm
         
-    if station == False:
+    if 'site' in stats.index.names:
         stats['site'] = stats.index.get_level_values('site')
         stats.index = stats.index.droplevel('site')
     
     spec.close()
     return stats
 
-def waveParams_SWAN(my_swan, period = 'PEAK'):
+def waveParams_SWAN(my_swan, period = 'PEAK', sites = None, times = None):
     """
     Creates wave params dataframe, from a SWAN spectrum file
-    """
-
-    spec = wavespectra.read_swan(my_swan)
-    
-    stats = spec.spec.stats(["hs", "tm01", "tp", "dpm", "dspr"]).to_dataframe()
-
 
-
-    stats.index = stats.index.droplevel('lat')
-    stats.index = stats.index.droplevel('lon')
+    The file is read natively (SWAN_output.read_sp2, with its binary cache)
+    and the parameters integrated over all spectra at once, with the
+    definitions of wavespectra. Indexed by time for a single site, by
+    (time, site) otherwise, with sites numbered from 1 as wavespectra did.
+    sites selects site numbers, the default is all.
+    """
+    import SWAN_output
+    import partitions
+
+    spec = SWAN_output.read_sp2(my_swan, sites = sites, times = times)
+    efth, freq, dirs = spec['efth'].values, spec['freq'].values, spec['dir'].values
+    params = partitions.spectral_params(efth, freq, dirs)
+    params.update(partitions.peak_params(efth, freq, dirs))
+
+    index = pd.MultiIndex.from_product([spec.indexes['time'], spec.indexes['site']], names = ['time', 'site'])
+    stats = pd.DataFrame({name: np.ravel(params[name]) for name in ["hs", "tm01", "tp", "dpm", "dspr"]},
+                         index = index)
+    if spec.sizes['site'] == 1:
+        stats.index = stats.index.droplevel('site')
     #stats['dpm'] = 180 -stats.dpm
     if period == "PEAK":
         stats = stats[["hs", "tp", "dpm", "dspr"]]
@@ -333,6 +470,176 @@ def createTPAR(df, fname = 'test'):
     np.savetxt(fname+".bnd", df[['time', 'hs','tp','dpm','dspr']].values, fmt='%1.6f %1.2f %1.2f %1.2f %1.1f', header= 'TPAR',comments='')
     return
 
+def _format_block(fmt, values):
+    """Format a 2-D array with a row format in a single % operation"""
+    values = np.asarray(values)
+    return (fmt * values.shape[0]) % tuple(values.ravel().tolist())
+
+def _swan_stamps(times):
+    """(date, time) integer columns of SWAN's YYYYMMDD.HHMMSS stamps, without strftime"""
+    times = pd.DatetimeIndex(times)
+    return np.column_stack([np.asarray(times.year*10000 + times.month*100 + times.day),
+                            np.asarray(times.hour*10000 + times.minute*100 + times.second)])
+
+def tpar_text(times, hs, tp, dpm, dspr):
+    """
+    TPAR file contents, formatted as createTPAR without a python loop over rows
+
+    Parameters
+    ----------
+    times : DatetimeIndex
+    hs, tp, dpm, dspr : Ndarray
+        Parameters at the times, dspr the two sided spread as from wavespectra
+
+    Returns
+    -------
+    text : string
+
+    """
+    stamps = _swan_stamps(times)
+    values = np.round(np.column_stack([hs, tp, dpm, dspr]).astype(float), 2)
+    #SWAN uses a one sided direction spread
+    values[:, 3] = np.round(values[:, 3]/2, 3)
+    rows = np.empty((len(stamps), 6), dtype = object)
+    rows[:, :2] = stamps
+    rows[:, 2:] = values
+    return "TPAR\n" + _format_block("%08d.%06d %1.2f %1.2f %1.2f %1.1f\n", rows)
+
+def sp2_text(times, freqs, dirs, efth, lon, lat, exception = -99.):
+    """
+    SWAN 2-D spectral file contents for one location
+
+    Parameters
+    ----------
+    times : DatetimeIndex
+    freqs : Ndarray
+        Absolute frequencies (Hz)
+    dirs : Ndarray
+        Nautical directions (degrees, coming from)
+    efth : Ndarray
+        (time, freq, dir) variance density in m2/Hz/degr
+    lon, lat : float
+        Location of the boundary point
+
+    Returns
+    -------
+    text : string
+
+    """
+    efth = np.asarray(efth, dtype = np.float64)
+    nfreq, ndir = len(freqs), len(dirs)
+    head = ["SWAN   1                                Swan standard spectral file, version",
+            "$   Data produced by SWAN_toolbox.write_boundaries",
+            "TIME                                    time-dependent data",
+            "     1                                  time coding option",
+            "LONLAT                                  locations in spherical coordinates",
+            "     1                                  number of locations",
+            "%12.6f %12.6f" % (lon, lat),
+            "AFREQ                                   absolute frequencies in Hz",
+            "%6d                                  number of frequencies" % nfreq]
+    head += ["%10.4f" % f for f in freqs]
+    head += ["NDIR                                    spectral nautical directions in degr",
+             "%6d                                  number of directions" % ndir]
+    head += ["%10.4f" % d for d in dirs]
+    head += ["QUANT",
+             "     1                                  number of quantities in table",
+             "VaDens                                  variance densities in m2/Hz/degr",
+             "m2/Hz/degr                              unit",
+             "%14.4E                          exception value" % exception]
+
+    #one scale factor per time, densities written as integers up to 99999
+    peak = np.nanmax(efth.reshape(len(efth), -1), axis = 1) if efth.size else np.zeros(0)
+    factor = np.where(peak > 0, peak / 99999., 0.)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        ints = np.rint(efth / factor[:, None, None])
+    row = "%6d" * ndir + "\n"
+    stamps = ["%08d.%06d" % tuple(t) for t in _swan_stamps(times).tolist()]
+    blocks = []
+    for i, stamp in enumerate(stamps):
+        if np.isnan(peak[i]):
+            blocks.append(stamp + "                         date and time\nNODATA\n")
+        elif factor[i] == 0:
+            blocks.append(stamp + "                         date and time\nZERO\n")
+        else:
+            blocks.append(stamp + "                         date and time\nFACTOR\n%18.8E\n" % factor[i]
+                          + _format_block(row, np.nan_to_num(ints[i], nan = 0).astype(np.int64).reshape(nfreq, ndir)))
+    return "\n".join(head) + "\n" + "".join(blocks)
+
+def boundary_stats(spec):
+    """
+    TPAR parameters of every boundary site in one xarray operation
+
+    Parameters
+    ----------
+    spec : Dataset
+        wavespectra dataset with (time, site, freq, dir) efth
+
+    Returns
+    -------
+    stats : Dataset
+        hs, tp, dpm and dspr over (time, site)
+
+    """
+    return spec.spec.stats(["hs", "tp", "dpm", "dspr"])
+
+def write_boundaries(dap, outdir, sites = None, prefix = 'bnd', tpar = True, sp2 = True):
+    """
+    Write the TPAR and .sp2 boundary files of many sites from one read
+
+
+    Parameters
+    ----------
+    dap : string
+        Path or OPeNDAP url of the spectral dataset (as waveParams)
+    outdir : string
+        Directory for the boundary files, e.g. a run's inputs directory
+    sites : list, optional
+        Sites to write, by position. The default is every site.
+    prefix : string, optional
+        Files are named <prefix>_<site index>. The default is 'bnd'.
+    tpar : bool, optional
+        Write <name>.bnd TPAR files. The default is True.
+    sp2 : bool, optional
+        Write <name>.sp2 2-D spectra files. The default is True.
+
+    Returns
+    -------
+    files : list
+        Paths written
+
+    """
+    ds = xr.open_dataset(dap)
+    spec = wavespectra.read_dataset(ds)
+    if sites is not None:
+        spec = spec.isel(site = list(sites))
+    #a single read of the subset, shared by the stats and the spectra
+    spec = spec.load()
+    ds.close()
+
+    times = spec.indexes['time']
+    efth = spec['efth'].transpose('site', 'time', 'freq', 'dir').values
+    freqs, dirs = spec['freq'].values, spec['dir'].values
+    lon, lat = spec['lon'].values, spec['lat'].values
+    site_ids = list(range(efth.shape[0])) if sites is None else list(sites)
+    if tpar:
+        stats = boundary_stats(spec).transpose('site', 'time')
+        params = [stats[k].values for k in ("hs", "tp", "dpm", "dspr")]
+
+    os.makedirs(outdir, exist_ok = True)
+    files = []
+    for i, site in enumerate(site_ids):
+        name = os.path.join(outdir, prefix+"_%02d" % site)
+        if tpar:
+            with open(name+".bnd", 'w') as f:
+                f.write(tpar_text(times, *[p[i] for p in params]))
+            files.append(name+".bnd")
+        if sp2:
+            with open(name+".sp2", 'w') as f:
+                f.write(sp2_text(times, freqs, dirs, efth[i], float(np.ravel(lon)[i]), float(np.ravel(lat)[i])))
+            files.append(name+".sp2")
+    spec.close()
+    return files
+
 
 ############# Useful Plotting Functions ###########################
 
@@ -449,50 +756,57 @@ def plotSite_PkDir(obs,model, name = "SiteName"):
 
     return f
 
-def plotContourMapAnimation(mesh, matList, timesteps = 12, param = 'Hsig'):
-    """
+def plotContourMapAnimation(mesh, matList, timesteps = 12, param = 'Hsig', frames_path = None,
+                            style = 'raster'):
     """
-    mesh = read_mesh.Mesh(mesh)
+    Animate a BLOCK output parameter over the mesh
+
+    The frames are stacked once into a memory mapped .npy file (see
+    mesh_render.stack_frames) and drawn on the mesh's cached Triangulation,
+    updating one figure in place. Use mesh_render.render_frames to write
+    the frames to disk in parallel instead.
+
+    Parameters
+    ----------
+    mesh : string
+        Path to the fort.14 mesh
+    matList : list
+        BLOCK output .mat files, in time order
+    timesteps : int, optional
+        Frames taken from each file. The default is 12.
+    param : string, optional
+        The default is 'Hsig'.
+    frames_path : string, optional
+        Where to stack the frames. The default is next to the first .mat file.
+    style : string, optional
+        'raster', 'tripcolor' or 'contourf', see mesh_render.FrameRenderer.
+        The default is 'raster'.
+
+    Returns
+    -------
+    ani : FuncAnimation
 
-    def read_mat(data, param):
-        """read the item from the matlab file
-        """
-        keys = [key for key,val in data.items() if param in key]
-        vals = [val[0] for key,val in data.items() if param in key]
-        #convert to dataframe for speed
-        data = pd.DataFrame(vals).T
-        data.columns = keys
-        #each column are the outputs at each node
-        return data
-
-    dataList = []
-    for i in matList:
-        dataList.append(read_mat(loadmat(i), param).iloc[:,:timesteps])
-    
+    """
+    import matplotlib.animation as animation
+    import mesh_render
 
-    data = pd.concat(dataList, axis = 1)
+    if frames_path is None:
+        frames_path = os.path.splitext(matList[0])[0]+'_'+param+'_frames.npy'
+    frames, labels = mesh_render.stack_frames(matList, frames_path, param, timesteps)
 
-    from matplotlib import cm
-    import matplotlib.animation as animation
+    lo, hi = mesh_render.frame_limits(frames)
+    if param == 'Hsig':
+        #Hsig from 0 to the whole metres of its maximum
+        vmin, vmax = 0, int(hi) if int(hi) > 0 else hi
+    else:
+        #e.g. Watlev goes negative
+        vmin, vmax = lo, hi
+    renderer = mesh_render.FrameRenderer(mesh, vmin, vmax, style = style,
+                                         label = 'Hsig (m)' if param == 'Hsig' else param)
 
-    fig, ax = plt.subplots(figsize = (10,8))
-    levels = np.linspace(0, int(data.max(axis = 1).max()), 100)
-    im = ax.tricontourf(mesh.x, mesh.y, mesh.elements, mesh.z, levels =levels,cmap=plt.cm.viridis)
-    ax.set_ylim((-28.4,-28.0))
     def animate(i):
-        ax.cla()
-        plt.cla()
-        z = data.iloc[:,i]
-        z = np.nan_to_num(z.values)
-        im = ax.tricontourf(mesh.x, mesh.y, mesh.elements, z, levels =levels,cmap=plt.cm.viridis)
-        title = ax.text(0.5,0.85, data.iloc[:,i].name, bbox={'facecolor':'w', 'alpha':0.5, 'pad':5},
-                    transform=ax.transAxes, ha="center")
-        ax.set_ylim((-28.4,-28.0))
-
-    cbar = plt.colorbar(im)
-    cbar.set_ticks(levels[::4])
-    cbar.set_label('Hsig (m)')
-    ani = animation.FuncAnimation(fig,animate, frames = range(len(data.columns)),interval=200,repeat=False, blit=False)
-    
+        return renderer.draw(frames[i], labels[i])
 
+    ani = animation.FuncAnimation(renderer.fig, animate, frames = range(len(labels)), interval=200,
+                                  repeat=False, blit=False)
     return ani
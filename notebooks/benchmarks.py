@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Timing comparisons of the vectorised readers and transforms against the
+original implementations, using synthetic data shaped like our outputs
+"""
+
+import os
+import time
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+def _best_of(func, repeat = 3):
+    """Best wall clock time in seconds of func over a number of repeats"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def write_synthetic_tbl(path, rows = 100000, sites = 50, start = '2021-06-24'):
+    """Write a synthetic SWAN table file in the layout SWAN writes with HEAD
+
+
+    Parameters
+    ----------
+    path : string
+        Output path of the .tbl file
+    rows : int, optional
+        Number of data rows. The default is 100000.
+    sites : int, optional
+        Number of output points per timestep. The default is 50.
+    start : string, optional
+        First timestep. The default is '2021-06-24'.
+
+    Returns
+    -------
+    path : string
+        Path of the file written
+
+    """
+
+    names = ['Hsig', 'Hswell', 'TPsmoo', 'Tm02', 'Dir', 'PkDir', 'Watlev']
+    units = ['[m]', '[m]', '[sec]', '[sec]', '[degr]', '[degr]', '[m]']
+    header = ['%', '%', '% Run:01          Table:OutPts      SWAN version:41.31', '%',
+              '%       Time'.ljust(20) + ''.join(n.ljust(14) for n in names),
+              '%       [ ]'.ljust(20) + ''.join(u.ljust(14) for u in units),
+              '%']
+
+    steps = int(np.ceil(rows / sites))
+    times = pd.date_range(start, periods = steps, freq = 'h').strftime('%Y%m%d.%H%M%S')
+    times = np.repeat(np.asarray(times, dtype = object), sites)[:rows]
+
+    rng = np.random.default_rng(0)
+    body = np.column_stack([rng.uniform(0.2, 4, rows), rng.uniform(0.1, 2, rows),
+                            rng.uniform(4, 16, rows), rng.uniform(3, 10, rows),
+                            rng.uniform(0, 360, rows), rng.uniform(0, 360, rows),
+                            rng.uniform(-1, 1, rows)])
+    fmt = '%14.5f%14.5f%14.4f%14.4f%14.3f%14.1f%14.2f'
+    with open(path, 'w') as f:
+        f.write('\n'.join(header) + '\n')
+        for t, line in zip(times, body):
+            f.write(' ' + t + fmt % tuple(line) + '\n')
+    return path
+
+
+def bench_read_tbl(rows = 100000, sites = 50, repeat = 3):
+    """Compare SWAN_output.read_tbl_file with the original read_fwf parser
+
+
+    Parameters
+    ----------
+    rows : int, optional
+        Rows in the synthetic table. The default is 100000.
+    sites : int, optional
+        Output points per timestep. The default is 50.
+    repeat : int, optional
+        Number of timed repeats, the best is reported. The default is 3.
+
+    Returns
+    -------
+    results : dictionary
+        Best timings in seconds and the speed up of the vectorised reader
+
+    """
+    import SWAN_output
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_synthetic_tbl(os.path.join(tmp, 'synthetic.tbl'), rows, sites)
+        fwf = _best_of(lambda: SWAN_output.read_tbl_file_fwf(path), repeat)
+        fast = _best_of(lambda: SWAN_output.read_tbl_file(path), repeat)
+
+    return {'read_tbl_file_fwf': fwf, 'read_tbl_file': fast, 'speed up': fwf / fast}
+
+
+def synthetic_obs(sites = 30, hours = 24 * 365, start = '2021-01-01'):
+    """Synthetic wave_obs frame (as toolBOX.get_waveDB_xday_obs) for a number of buoys"""
+
+    times = pd.date_range(start, periods = hours, freq = 'h')
+    rng = np.random.default_rng(0)
+    n = sites * hours
+    data = pd.DataFrame({'Site': np.repeat(['S%03d Mk4' % i for i in range(sites)], hours),
+                         'Hsig': rng.uniform(0.2, 4, n), 'Hmax': rng.uniform(0.4, 7, n),
+                         'Tz': rng.uniform(3, 10, n), 'Tp': rng.uniform(4, 16, n),
+                         'Direction': rng.uniform(0, 360, n)},
+                        index = pd.DatetimeIndex(np.tile(times, sites), name = 'DateTime'))
+    return data
+
+
+def _processObs_merge(df, siteList):
+    """The original per site mask and merge implementation of toolBOX.processObs"""
+    from functools import reduce
+    import toolBOX
+
+    dfList = []
+    for site in siteList:
+        sitedf = df[df['Site'] == site][['Hsig','Hmax','Tz','Tp','Direction']]
+        colNames = [col+('_'+site[:4]) for col in sitedf.columns]
+        sitedf.columns = colNames
+        sitedf['dir_sin'+site[:4]], sitedf['dir_cos'+site[:4]] = toolBOX.convDirection(sitedf[colNames[-1]])
+        dfList.append(sitedf)
+    data = reduce(lambda left, right: pd.merge(left, right, left_index = True, right_index = True), dfList)
+    return data[data.columns.drop(list(data.filter(regex='Direction')))]
+
+
+def _paramsDFList_merge(df):
+    """The original per site groupby and merge implementation of toolBOX.paramsDFList
+
+    Columns are named by site before merging, the original renamed them
+    afterwards and failed on duplicate suffixes with more than three sites.
+    """
+    from functools import reduce
+
+    frames = []
+    for param in ['Hsig', 'Tz', 'Direction']:
+        parts, names = [], []
+        for name, site in df.groupby('Site'):
+            parts.append(site.sort_index()[[param]].rename(columns = {param: name}))
+            names.append(name)
+        frame = reduce(lambda left, right: pd.merge(left, right, left_index = True, right_index = True), parts)
+        frame.columns = names
+        frames.append(frame)
+    return frames
+
+
+def bench_site_reshape(sites = 30, hours = 24 * 365, repeat = 3):
+    """Compare toolBOX.processObs and paramsDFList with the per site merge versions
+
+
+    Parameters
+    ----------
+    sites : int, optional
+        Number of synthetic buoys. The default is 30.
+    hours : int, optional
+        Hourly records per buoy. The default is a year.
+    repeat : int, optional
+        Number of timed repeats, the best is reported. The default is 3.
+
+    Returns
+    -------
+    results : dictionary
+        Best timings in seconds of each implementation
+
+    """
+    import toolBOX
+
+    data = synthetic_obs(sites, hours)
+    siteList = list(data['Site'].unique())
+    return {'processObs merge': _best_of(lambda: _processObs_merge(data, siteList), repeat),
+            'processObs': _best_of(lambda: toolBOX.processObs(data, siteList), repeat),
+            'paramsDFList merge': _best_of(lambda: _paramsDFList_merge(data), repeat),
+            'paramsDFList': _best_of(lambda: toolBOX.paramsDFList(data), repeat)}
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy reader for the SWAN BLOCK .mat outputs (e.g. <run>_grid_WavePar.mat).
+
+The MAT level 5 file is indexed by walking the element tags, recording the
+name, shape, type and file offset of every variable without reading any
+data. Variables named <param>_YYYYMMDD_HHMMSS are indexed by parameter and
+time. Uncompressed variables are memory mapped at their offset, compressed
+ones are inflated one variable at a time, so only the requested (parameter,
+time) slices are ever read.
+"""
+
+import re
+import zlib
+import struct
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+#MAT level 5 data types
+_MI_TYPES = {1: 'i1', 2: 'u1', 3: 'i2', 4: 'u2', 5: 'i4', 6: 'u4', 7: 'f4', 9: 'f8', 12: 'i8', 13: 'u8'}
+_MI_MATRIX, _MI_COMPRESSED = 14, 15
+
+_TIMED = re.compile(r'^(?P<param>.+)_(?P<time>\d{8}_\d{6})$')
+
+
+class _Variable():
+    __slots__ = ('name', 'shape', 'dtype', 'offset', 'compressed')
+
+    def __init__(self, name, shape, dtype, offset, compressed = None):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        #offset of the data in the file, or in the inflated element when compressed
+        self.offset = offset
+        self.compressed = compressed
+
+
+def _tag(buf, pos, endian):
+    """(type, nbytes, data offset, next element offset) of the element at pos"""
+    mtype, nbytes = struct.unpack_from(endian+'II', buf, pos)
+    if mtype >> 16:
+        #small data element packed in the tag
+        return mtype & 0xffff, mtype >> 16, pos + 4, pos + 8
+    return mtype, nbytes, pos + 8, pos + 8 + nbytes + (-nbytes % 8)
+
+
+def _parse_matrix(buf, pos, endian, base = 0):
+    """Name, shape, dtype and absolute offset of the real part of a miMATRIX element"""
+    #array flags
+    _, _, _, pos = _tag(buf, pos, endian)
+    mtype, nbytes, data, pos = _tag(buf, pos, endian)
+    shape = tuple(np.frombuffer(buf, endian+_MI_TYPES[mtype], nbytes // np.dtype(_MI_TYPES[mtype]).itemsize, data))
+    mtype, nbytes, data, pos = _tag(buf, pos, endian)
+    name = bytes(buf[data:data + nbytes]).decode('ascii')
+    mtype, nbytes, data, pos = _tag(buf, pos, endian)
+    dtype = np.dtype(endian+_MI_TYPES[mtype])
+    return name, tuple(int(n) for n in shape), dtype, base + data
+
+
+class BlockMat():
+    """
+    Index of one BLOCK .mat file
+
+    Attributes
+    ----------
+    variables : dictionary
+        name: variable record, for every variable in the file
+    index : dictionary
+        param: {time: name} for the timed variables
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.variables = {}
+        self.index = {}
+        with open(path, 'rb') as f:
+            header = f.read(128)
+            endian = '<' if header[126:128] == b'IM' else '>'
+            self.endian = endian
+            pos = 128
+            while True:
+                f.seek(pos)
+                tag = f.read(8)
+                if len(tag) < 8:
+                    break
+                mtype, nbytes = struct.unpack(endian+'II', tag)
+                #compressed elements are not padded
+                data, nxt = pos + 8, pos + 8 + nbytes + (-nbytes % 8 if mtype == _MI_MATRIX else 0)
+                if mtype == _MI_MATRIX:
+                    #the sub element headers are small, read them without the data
+                    head = f.read(min(nbytes, 256))
+                    name, shape, dtype, offset = _parse_matrix(head, 0, endian, base = data)
+                    var = _Variable(name, shape, dtype, offset)
+                elif mtype == _MI_COMPRESSED:
+                    stream = zlib.decompressobj()
+                    head = stream.decompress(f.read(min(nbytes, 4096)), 512)
+                    name, shape, dtype, offset = _parse_matrix(head, 8, endian)
+                    var = _Variable(name, shape, dtype, offset, compressed = (data, nbytes))
+                else:
+                    pos = nxt
+                    continue
+                self.variables[name] = var
+                match = _TIMED.match(name)
+                if match:
+                    self.index.setdefault(match.group('param'), {})[pd.Timestamp(
+                        pd.to_datetime(match.group('time'), format = "%Y%m%d_%H%M%S"))] = name
+                pos = nxt
+
+    @property
+    def params(self):
+        return list(self.index)
+
+    def times(self, param):
+        """Timestamps of a parameter, in file order"""
+        return pd.DatetimeIndex(list(self.index.get(param, {})))
+
+    def read(self, name):
+        """
+        One variable, memory mapped when uncompressed
+
+        Returns
+        -------
+        Ndarray
+            Flattened (column major) values, one per mesh node for BLOCK output
+
+        """
+        var = self.variables[name]
+        count = int(np.prod(var.shape))
+        if var.compressed is None:
+            return np.memmap(self.path, var.dtype, 'r', var.offset, (count,))
+        start, nbytes = var.compressed
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            raw = zlib.decompress(f.read(nbytes))
+        return np.frombuffer(raw, var.dtype, count, var.offset)
+
+    def frame(self, param, time):
+        return self.read(self.index[param][pd.Timestamp(time)])
+
+    def frames(self, param, times = None, dtype = np.float32):
+        """(time, node) array of a parameter, reading only the requested times"""
+        times = self.times(param) if times is None else pd.DatetimeIndex(times)
+        names = self.index[param]
+        out = np.empty((len(times), self._size(param)), dtype = dtype)
+        for i, t in enumerate(times):
+            out[i] = self.read(names[t])
+        return out
+
+    def _size(self, param):
+        name = next(iter(self.index[param].values()))
+        return int(np.prod(self.variables[name].shape))
+
+
+class _LazyFrames(BackendArray):
+    """Array like (time, node) view over the BLOCK files of a run, for xarray"""
+
+    def __init__(self, files, param, times, dtype):
+        self.files = files
+        self.param = param
+        self.dtype = np.dtype(dtype)
+        #for every time, the file holding it (latest file wins)
+        owner = {}
+        for f in files:
+            for t in f.times(param):
+                owner[t] = f
+        self.times = pd.DatetimeIndex(sorted(owner)) if times is None else pd.DatetimeIndex(times)
+        self.owner = [owner[t] for t in self.times]
+        #sized from a file holding the param, earlier files may have none
+        self.shape = (len(self.times), self.owner[0]._size(param) if len(self.times) else 0)
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC, self._getitem)
+
+    def _getitem(self, key):
+        rows, cols = key
+        idx = np.arange(self.shape[0])[rows]
+        out = np.empty((np.size(idx),) + np.empty(self.shape[1])[cols].shape, dtype = self.dtype)
+        for i, r in enumerate(np.atleast_1d(idx)):
+            out[i] = self.owner[r].frame(self.param, self.times[r])[cols]
+        return out[0] if np.ndim(idx) == 0 else out
+
+
+def open_block(paths, param = 'Hsig', times = None, dtype = np.float32):
+    """
+    A run's BLOCK outputs as a lazy (time, node) DataArray
+
+
+    Parameters
+    ----------
+    paths : string or list
+        BLOCK .mat file(s), e.g. the run's *_grid_WavePar.mat
+    param : string, optional
+        Parameter, e.g. 'Hsig', 'TPsmoo', 'Dir'. The default is 'Hsig'.
+    times : list, optional
+        Times to expose. The default is every time of the parameter.
+    dtype : numpy dtype, optional
+        The default is np.float32.
+
+    Returns
+    -------
+    data : DataArray
+        Lazily indexed; data are read from the files only for the
+        (time, node) slices that are selected and loaded
+
+    """
+    files = [BlockMat(p) for p in ([paths] if isinstance(paths, str) else paths)]
+    lazy = _LazyFrames(files, param, times, dtype)
+    variable = xr.Variable(('time', 'node'), indexing.LazilyIndexedArray(lazy))
+    return xr.DataArray(variable, coords = {'time': lazy.times}, name = param)
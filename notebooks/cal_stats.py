@@ -9,6 +9,8 @@ Calibration stats module for calibration of SWAN models compared with observatio
 import numpy as np
 from scipy import stats
 
+import circular
+
 def bias(s, o):
     """
     
@@ -54,6 +56,8 @@ def RMSE(s, o):
 
 def dirRMSE(s, o):
     """
+    Root mean squared error of directions, using the wrapped difference
+    so that 350 against 10 degrees is a 20 degree error
 
     Parameters
     ----------
@@ -70,7 +74,7 @@ def dirRMSE(s, o):
     """
     
 
-    return round((np.mean(np.absolute((180 - s) -  (180 - o))**2))** .5, 2)
+    return round(np.mean(circular.circ_diff(s, o)**2)** .5, 2)
 
 def SI(s, o):
     """
@@ -119,9 +123,9 @@ def cor_coef(s, o):
 
 def dir_ad(s, o):
     """
-    The mean absolute differrence of directional data"""
+    The mean absolute differrence of directional data, using the wrapped difference"""
     
-    return round(np.mean(np.absolute((180 - s) -  (180 - o))), 2)
+    return round(np.mean(np.absolute(circular.circ_diff(s, o))), 2)
 
 
 def NS(s, o):
@@ -227,6 +231,89 @@ def direction_to_euc(arr):
     return (arr_cos, arr_sin)
 
 
+def stat_moments(s, o, axis = -1):
+    """
+    Shared sufficient statistics of paired simulations and observations
+
+    NaNs in either array are skipped pairwise. Moments are accumulated about
+    the means, so the metrics derived from them are numerically stable.
+
+    Parameters
+    ----------
+    s : Ndarray
+        Simulation array, any shape broadcastable against o
+    o : Ndarray
+        observation array
+    axis : int, optional
+        Axis holding the samples (e.g. time). The default is -1.
+
+    Returns
+    -------
+    moments : dictionary
+        n, mean_s, mean_o, var_s, var_o, cov (population) and agree, the
+        mean of (|s - mean_o| + |o - mean_o|)**2, reduced over axis
+
+    """
+
+    s, o = np.broadcast_arrays(np.asarray(s, dtype = np.float64), np.asarray(o, dtype = np.float64))
+    valid = ~(np.isnan(s) | np.isnan(o))
+    n = valid.sum(axis = axis)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        s0 = np.where(valid, s, 0.)
+        o0 = np.where(valid, o, 0.)
+        mean_s = s0.sum(axis = axis) / n
+        mean_o = o0.sum(axis = axis) / n
+        cs = np.where(valid, s - np.expand_dims(mean_s, axis), 0.)
+        co = np.where(valid, o - np.expand_dims(mean_o, axis), 0.)
+        var_s = (cs * cs).sum(axis = axis) / n
+        var_o = (co * co).sum(axis = axis) / n
+        cov = (cs * co).sum(axis = axis) / n
+        agree = np.where(valid, (np.abs(s - np.expand_dims(mean_o, axis)) + np.abs(co)) ** 2, 0.).sum(axis = axis) / n
+    return {'n': n, 'mean_s': mean_s, 'mean_o': mean_o, 'var_s': var_s,
+            'var_o': var_o, 'cov': cov, 'agree': agree}
+
+def calc_stats(s, o, axis = -1):
+    """
+    The all_stats suite for many series at once, e.g. (models, sites, leads, time)
+
+    Every metric is derived from stat_moments, so the arrays are only
+    traversed a couple of times for the whole suite. Results are unrounded.
+
+    Parameters
+    ----------
+    s : Ndarray
+        Simulation array, any shape broadcastable against o
+    o : Ndarray
+        observation array
+    axis : int, optional
+        Axis holding the samples (e.g. time). The default is -1.
+
+    Returns
+    -------
+    mystats : dictionary
+        the full suite of calibration stats, each an array over the
+        remaining axes, plus the sample count 'n'
+
+    """
+
+    m = stat_moments(s, o, axis)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        bias = m['mean_s'] - m['mean_o']
+        var_d = m['var_s'] + m['var_o'] - 2 * m['cov']
+        mse = var_d + bias ** 2
+        r = m['cov'] / np.sqrt(m['var_s'] * m['var_o'])
+
+        mystats = {}
+        mystats['Bias'] = bias
+        mystats['Root Mean Squared Error'] = np.sqrt(mse)
+        mystats['Scatter Index'] = 100 * np.sqrt(var_d) / m['mean_o']
+        mystats['Coefficient of Determination'] = r ** 2
+        mystats['Coefficient of Efficiency'] = 1 - mse / m['var_o']
+        mystats['Correlation Coefficient'] = r
+        mystats['Index of Agreement'] = 1 - mse / m['agree']
+        mystats['n'] = m['n']
+    return mystats
+
 def all_stats(s, o):
     """
     
@@ -245,14 +332,11 @@ def all_stats(s, o):
 
     """
 
+    full = calc_stats(s, o)
     mystats = {}
-    mystats['Bias'] = bias(s,o)
-    mystats['Root Mean Squared Error'] = RMSE(s, o)
-    mystats['Scatter Index'] = SI(s, o)
-    mystats['Coefficient of Determination'] = r2(s,o)
-    mystats['Coefficient of Efficiency'] = NS(s, o)
-    mystats['Correlation Coefficient'] = cor_coef(s, o)
-    mystats['Index of Agreement'] = IofA(s, o)
+    for key, value in full.items():
+        if key != 'n':
+            mystats[key] = round(float(value), 1 if key == 'Scatter Index' else 2)
     return mystats
 
 def dir_all_stats(s, o):
@@ -269,15 +353,17 @@ def dir_all_stats(s, o):
     Returns
     -------
     mystats : dictionary
-        the full suite of calibration stats
+        the full suite of directional calibration stats, using circular
+        statistics (see circular.circ_stats) rather than linear r2 and NSE
 
     """
 
+    full = circular.circ_stats(s, o)
     mystats = {}
-    mystats['Root Mean Squared Error'] = dirRMSE(s, o)
-    mystats['Absolute Difference'] = dir_ad(s, o)
-    mystats['Coefficient of Determination'] = r2(s,o)
-    mystats['Coefficient of Efficiency'] = NS(s, o)
-    mystats['Correlation Coefficient'] = cor_coef(s, o)
-    mystats['Index of Agreement'] = IofA(s, o)
+    mystats['Root Mean Squared Error'] = round(float(full['Root Mean Squared Error']), 2)
+    mystats['Absolute Difference'] = round(float(full['Absolute Difference']), 2)
+    mystats['Bias'] = round(float(full['Bias']), 2)
+    mystats['Circular Correlation'] = round(float(full['Circular Correlation']), 2)
+    mystats['Coefficient of Determination'] = round(float(full['Circular Correlation'])**2, 2)
+    mystats['Vector RMSE'] = round(float(full['Vector RMSE']), 2)
     return mystats
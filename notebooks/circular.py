@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Circular statistics for verifying wave directions (degrees, nautical),
+e.g. the Dir MLP predictions or the SWAN Dir/PkDir columns.
+
+All functions work along an axis of N-d arrays (sites, lead times, ...) and
+skip NaN pairs.
+"""
+
+import numpy as np
+
+
+def wrap(d):
+    """Wrap angle differences (degrees) to [-180, 180)"""
+    return (np.asarray(d, dtype = np.float64) + 180.) % 360. - 180.
+
+
+def circ_diff(s, o):
+    """
+    Signed smallest difference s - o in degrees, so 350 vs 10 is -20
+
+    Parameters
+    ----------
+    s : Ndarray
+        Simulation array
+    o : Ndarray
+        observation array
+
+    Returns
+    -------
+    Ndarray
+        wrapped differences in [-180, 180)
+
+    """
+    return wrap(np.asarray(s, dtype = np.float64) - np.asarray(o, dtype = np.float64))
+
+
+def _nanmean(a, axis):
+    """Mean of the non NaN values, NaN (without a warning) where there are none"""
+    n = (~np.isnan(a)).sum(axis = axis)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return np.nansum(a, axis = axis) / n
+
+
+def _valid(s, o):
+    s, o = np.broadcast_arrays(np.asarray(s, dtype = np.float64), np.asarray(o, dtype = np.float64))
+    return s, o, ~(np.isnan(s) | np.isnan(o))
+
+
+def circ_mean(a, axis = -1):
+    """
+    Circular mean direction in [0, 360), NaNs skipped
+
+    Parameters
+    ----------
+    a : Ndarray
+        directions in degrees
+    axis : int, optional
+        Axis to average over. The default is -1.
+
+    Returns
+    -------
+    Ndarray
+        mean direction, NaN where there are no values
+
+    """
+    r = np.deg2rad(np.asarray(a, dtype = np.float64))
+    mean = np.rad2deg(np.arctan2(np.nansum(np.sin(r), axis = axis),
+                                 np.nansum(np.cos(r), axis = axis))) % 360.
+    return np.where((~np.isnan(r)).sum(axis = axis) > 0, mean, np.nan)
+
+
+def circ_corr(s, o, axis = -1):
+    """
+    Circular correlation coefficient (Jammalamadaka & SenGupta, 2001)
+
+    sum(sin(s - mean_s) sin(o - mean_o)) / sqrt(sum(sin^2(s - mean_s)) sum(sin^2(o - mean_o)))
+
+    Parameters
+    ----------
+    s : Ndarray
+        Simulation array
+    o : Ndarray
+        observation array
+    axis : int, optional
+        Axis holding the samples. The default is -1.
+
+    Returns
+    -------
+    Ndarray
+        correlation in [-1, 1]
+
+    """
+    s, o, valid = _valid(s, o)
+    s = np.where(valid, s, np.nan)
+    o = np.where(valid, o, np.nan)
+    ds = np.sin(np.deg2rad(s - np.expand_dims(circ_mean(s, axis), axis)))
+    do = np.sin(np.deg2rad(o - np.expand_dims(circ_mean(o, axis), axis)))
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return np.nansum(ds * do, axis = axis) / np.sqrt(np.nansum(ds * ds, axis = axis)
+                                                         * np.nansum(do * do, axis = axis))
+
+
+def vector_rmse(s, o, ws = None, wo = None, axis = -1):
+    """
+    Root mean squared length of the vector difference
+
+    With no magnitudes the directions are unit vectors (result in [0, 2]);
+    passing e.g. Hs as magnitudes gives a wave-vector RMSE in their units.
+
+    Parameters
+    ----------
+    s : Ndarray
+        Simulated directions (degrees)
+    o : Ndarray
+        observed directions (degrees)
+    ws, wo : Ndarray, optional
+        Magnitudes of the simulated and observed vectors. The default is 1.
+    axis : int, optional
+        Axis holding the samples. The default is -1.
+
+    Returns
+    -------
+    Ndarray
+        vector RMSE
+
+    """
+    s, o, valid = _valid(s, o)
+    ws = 1. if ws is None else np.asarray(ws, dtype = np.float64)
+    wo = 1. if wo is None else np.asarray(wo, dtype = np.float64)
+    rs, ro = np.deg2rad(s), np.deg2rad(o)
+    dx = ws * np.sin(rs) - wo * np.sin(ro)
+    dy = ws * np.cos(rs) - wo * np.cos(ro)
+    sq = np.where(valid & ~np.isnan(dx + dy), dx * dx + dy * dy, np.nan)
+    return np.sqrt(_nanmean(sq, axis))
+
+
+def circ_stats(s, o, axis = -1):
+    """
+    Direction verification suite along an axis
+
+    Parameters
+    ----------
+    s : Ndarray
+        Simulation array (degrees)
+    o : Ndarray
+        observation array (degrees)
+    axis : int, optional
+        Axis holding the samples. The default is -1.
+
+    Returns
+    -------
+    mystats : dictionary
+        Bias (circular mean of the wrapped error), Root Mean Squared Error
+        and Absolute Difference of the wrapped error, Circular Correlation,
+        Vector RMSE (unit vectors) and n, each an array over the other axes,
+        NaN where n is 0
+
+    """
+    s, o, valid = _valid(s, o)
+    d = np.where(valid, circ_diff(s, o), np.nan)
+    rd = np.deg2rad(d)
+    n = valid.sum(axis = axis)
+    mystats = {}
+    bias = np.rad2deg(np.arctan2(np.nansum(np.sin(rd), axis = axis), np.nansum(np.cos(rd), axis = axis)))
+    mystats['Bias'] = np.where(n > 0, bias, np.nan)
+    mystats['Root Mean Squared Error'] = np.sqrt(_nanmean(d * d, axis))
+    mystats['Absolute Difference'] = _nanmean(np.abs(d), axis)
+    mystats['Circular Correlation'] = circ_corr(s, o, axis)
+    mystats['Vector RMSE'] = vector_rmse(s, o, axis = axis)
+    mystats['n'] = n
+    return mystats
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative feature engineering for the straight to obs models, replacing
+the hand written prepstnData in the notebooks.
+
+A FeatureSpec declares the offshore sites, partitions (total, sea '_sa',
+swell '_sw'), passthrough parameters, direction columns and lags. Compiling
+it against the raw column order gives index arrays, so building features is
+a few 2-D array operations, the same for training and live inference.
+"""
+
+import numpy as np
+import pandas as pd
+
+import toolBOX
+
+#columns returned by prepstnData in the straight_to_obs notebooks
+PREPSTN_COLUMNS = ['hs_a', 'tp_a', 'tm02_a', 'dpm_cos', 'dpm_sin', 'dm_cos', 'dm_sin',
+                   'hs_sa_a', 'tm02_sa_a', 'dm_sa_cos', 'dm_sa_sin',
+                   'hs_sw_a', 'tm02_sw_a', 'dm_sw_cos', 'dm_sw_sin',
+                   'hs_b', 'hs_sa_b', 'hs_sw_b', 'dm_sin_b', 'dm_sa_sin_b', 'dm_sw_sin_b',
+                   'hs_c', 'hs_sa_c', 'hs_sw_c', 'dm_sin_c', 'dm_sa_sin_c', 'dm_sw_sin_c']
+
+
+class FeatureSpec():
+    """
+    Declaration of the model features built from offshore parameters
+
+    Raw columns are named <param><partition>_<site>, e.g. hs_sa_b. Direction
+    features are named <dir><partition>_sin/_cos with a _<site> suffix,
+    except for the primary site which is unsuffixed (dm_sa_sin, dm_sa_sin_b),
+    as in the notebooks.
+    """
+
+    def __init__(self, sites = ('a', 'b', 'c'),
+                 params = {'': ('hs', 'tm02', 'tp'), '_sa': ('hs', 'tm02'), '_sw': ('hs', 'tm02')},
+                 directions = {'': ('dpm', 'dm'), '_sa': ('dm',), '_sw': ('dm',)},
+                 lags = (('Hs_diff_lag12', 'hs_a', 'Hsig', 13),),
+                 hour = True, primary_site = 'a'):
+        """
+        Parameters
+        ----------
+        sites : tuple, optional
+            Offshore site suffixes. The default is ('a', 'b', 'c').
+        params : dictionary, optional
+            partition: parameters passed through unchanged.
+        directions : dictionary, optional
+            partition: direction parameters (degrees) encoded as sin/cos.
+        lags : tuple, optional
+            (name, column, minus column or None, shift) lagged differences,
+            the default is Hs_diff_lag12 = hs_a.shift(13) - Hsig.shift(13).
+        hour : bool, optional
+            Add the hour of day from the index. The default is True.
+        primary_site : string, optional
+            Site whose direction features are unsuffixed. The default is 'a'.
+
+        """
+        self.sites = tuple(sites)
+        self.params = {k: tuple(v) for k, v in params.items()}
+        self.directions = {k: tuple(v) for k, v in directions.items()}
+        self.lags = tuple(tuple(lag) for lag in lags)
+        self.hour = hour
+        self.primary_site = primary_site
+
+    def catalog(self):
+        """
+        Every feature the spec can produce, in declaration order
+
+        Returns
+        -------
+        catalog : dictionary
+            feature name: (kind, details) with kind 'copy', 'sin', 'cos', 'lag' or 'hour'
+
+        """
+        catalog = {}
+        for site in self.sites:
+            suffix = '' if site == self.primary_site else '_'+site
+            for part, names in self.params.items():
+                for name in names:
+                    column = name+part+'_'+site
+                    catalog[column] = ('copy', column)
+            for part, names in self.directions.items():
+                for name in names:
+                    column = name+part+'_'+site
+                    catalog[name+part+'_cos'+suffix] = ('cos', column)
+                    catalog[name+part+'_sin'+suffix] = ('sin', column)
+        for name, column, minus, shift in self.lags:
+            catalog[name] = ('lag', (column, minus, int(shift)))
+        if self.hour:
+            catalog['hour'] = ('hour', None)
+        return catalog
+
+    def compile(self, raw_columns, columns = None):
+        """
+        Compile the spec against a raw column order
+
+        Parameters
+        ----------
+        raw_columns : list
+            Column order of the raw arrays that will be transformed
+        columns : list, optional
+            Output features, e.g. inference.HS_COLUMNS. The default is every
+            feature of the spec.
+
+        Returns
+        -------
+        CompiledFeatures
+
+        """
+        return CompiledFeatures(self.catalog(), list(raw_columns), columns)
+
+
+class CompiledFeatures():
+    """Index arrays mapping a raw 2-D array to a feature matrix"""
+
+    def __init__(self, catalog, raw_columns, columns = None):
+        self.raw_columns = raw_columns
+        self.columns = list(catalog) if columns is None else list(columns)
+        raw = {c: i for i, c in enumerate(raw_columns)}
+
+        def _raw(column):
+            if column not in raw:
+                raise KeyError("raw column "+column+" is required but not in the input")
+            return raw[column]
+
+        copy_out, copy_in = [], []
+        trig_out, trig_in, trig_sin = [], [], []
+        lag_out, lag_in, lag_minus, lag_shift = [], [], [], []
+        self.hour_out = None
+        for pos, name in enumerate(self.columns):
+            if name not in catalog:
+                raise KeyError("feature "+name+" is not declared in the spec")
+            kind, detail = catalog[name]
+            if kind == 'copy':
+                copy_out.append(pos)
+                copy_in.append(_raw(detail))
+            elif kind in ('sin', 'cos'):
+                trig_out.append(pos)
+                trig_in.append(_raw(detail))
+                trig_sin.append(kind == 'sin')
+            elif kind == 'lag':
+                column, minus, shift = detail
+                lag_out.append(pos)
+                lag_in.append(_raw(column))
+                lag_minus.append(-1 if minus is None else _raw(minus))
+                lag_shift.append(shift)
+            else:
+                self.hour_out = pos
+
+        self.copy_out, self.copy_in = np.array(copy_out, int), np.array(copy_in, int)
+        self.trig_out, self.trig_in = np.array(trig_out, int), np.array(trig_in, int)
+        self.trig_sin = np.array(trig_sin, bool)
+        self.lags = list(zip(lag_out, lag_in, lag_minus, lag_shift))
+
+    def transform(self, values, index = None, dtype = np.float64):
+        """
+        Build the feature matrix
+
+        Parameters
+        ----------
+        values : Ndarray
+            (rows, raw columns) array in the compiled raw column order. Rows
+            are consecutive timesteps, lag features of the first rows are NaN.
+        index : DatetimeIndex, optional
+            Times of the rows, required for the hour feature.
+        dtype : numpy dtype, optional
+            Output dtype. The default is np.float64.
+
+        Returns
+        -------
+        features : Ndarray
+            (rows, features) array in self.columns order
+
+        """
+        values = np.asarray(values)
+        out = np.empty((values.shape[0], len(self.columns)), dtype = dtype)
+        if len(self.copy_out):
+            out[:, self.copy_out] = values[:, self.copy_in]
+        if len(self.trig_out):
+            sin, cos = toolBOX.convDirection(values[:, self.trig_in])
+            out[:, self.trig_out] = np.where(self.trig_sin, sin, cos)
+        for pos, col, minus, shift in self.lags:
+            out[:shift, pos] = np.nan
+            #a short forecast may not reach past the lag, the column stays NaN
+            n = max(values.shape[0] - shift, 0)
+            if n:
+                lagged = values[:n, col]
+                out[shift:, pos] = lagged if minus < 0 else lagged - values[:n, minus]
+        if self.hour_out is not None:
+            if index is None:
+                raise ValueError("the hour feature needs the row times")
+            out[:, self.hour_out] = pd.DatetimeIndex(index).hour
+        return out
+
+    def transform_frame(self, data, dtype = np.float64):
+        """Build the features of a dataframe holding the raw columns, as a dataframe"""
+        values = data[self.raw_columns].to_numpy(dtype = np.float64)
+        return pd.DataFrame(self.transform(values, data.index, dtype),
+                            index = data.index, columns = self.columns)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked, compressed Zarr store of the SWAN grid outputs, so animations,
+point extraction and verification slice one store instead of re-reading the
+<run>/results/<run>_grid_WavePar.mat files.
+
+Every run's BLOCK frames are appended along the time dimension, with the
+run and lead time of each frame as coordinates, so a time can appear once
+per run that covers it. The mesh topology (x, y, z, elements) is stored
+alongside. Frames are chunked as (TIME_CHUNK, NODE_CHUNK) blocks, a
+compromise that keeps both a map at one time and a series at one node to a
+handful of chunk reads. Runs are converted in time blocks of TIME_CHUNK
+frames, so memory stays bounded for large meshes, and the runs completed
+are recorded in the store attributes so conversion can be repeated as new
+runs land.
+
+The store is written in the Zarr v2 format, so it reads with zarr 2 (with
+an xarray release that still supports it, e.g. 2024.x) and zarr 3 (with a
+current xarray, the format is then passed explicitly).
+"""
+
+import os
+import re
+import json
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import block_mat
+
+RUN_FORMAT = "%Y%m%d_%H%M"
+GRID_OUTPUT = 'results/{run}_grid_WavePar.mat'
+
+#SWAN BLOCK variables of the grid output (HSign TPS TM02 DIR PDIR WATLev)
+VARIABLES = ('Hsig', 'TPsmoo', 'Tm02', 'Dir', 'PkDir', 'Watlev')
+
+TIME_CHUNK = 24
+NODE_CHUNK = 32768
+
+_RUN = re.compile(r'^\d{8}_\d{4}$')
+
+
+def _zarr3():
+    import zarr
+
+    return int(zarr.__version__.split('.')[0]) >= 3
+
+
+def _format():
+    """to_zarr keywords keeping the store in the v2 format on zarr 3"""
+    return {'zarr_format': 2} if _zarr3() else {}
+
+
+def _encoding(variables, chunks, clevel):
+    from numcodecs import Blosc
+
+    compressor = Blosc(cname = 'zstd', clevel = clevel, shuffle = Blosc.BITSHUFFLE)
+    #zarr 3 takes a list of compressors, zarr 2 a single one
+    key, compressor = ('compressors', (compressor,)) if _zarr3() else ('compressor', compressor)
+    encoding = {name: {'chunks': chunks, key: compressor, 'dtype': 'float32'} for name in variables}
+    encoding['time'] = {'units': 'minutes since 1970-01-01', 'dtype': 'int64', 'chunks': (4096,)}
+    encoding['run_time'] = {'units': 'minutes since 1970-01-01', 'dtype': 'int64', 'chunks': (4096,)}
+    encoding['lead'] = {'dtype': 'float32', 'chunks': (4096,)}
+    for name in ('x', 'y', 'z'):
+        encoding[name] = {'chunks': (chunks[1],), key: compressor}
+    encoding['elements'] = {'chunks': (2 * chunks[1], 3), key: compressor}
+    return encoding
+
+
+def _mesh_dataset(mesh):
+    return xr.Dataset({'x': ('node', np.asarray(mesh.x, dtype = np.float64)),
+                       'y': ('node', np.asarray(mesh.y, dtype = np.float64)),
+                       'z': ('node', np.asarray(mesh.z, dtype = np.float32)),
+                       'elements': (('element', 'vertex'), np.asarray(mesh.elements, dtype = np.int32))})
+
+
+def _block_dataset(block, run_time, times, variables):
+    data = {}
+    size = block._size(variables[0])
+    for name in variables:
+        names = block.index[name]
+        frames = np.full((len(times), size), np.nan, dtype = np.float32)
+        for i, t in enumerate(times):
+            if t in names:
+                frames[i] = block.read(names[t])
+        data[name] = (('time', 'node'), frames)
+    lead = (times - run_time) / pd.Timedelta(hours = 1)
+    return xr.Dataset(data, coords = {'time': ('time', times.values.astype('datetime64[ns]')),
+                                      'run_time': ('time', np.full(len(times), np.datetime64(run_time, 'ns'))),
+                                      'lead': ('time', np.asarray(lead, dtype = np.float32))})
+
+
+def _completed(store):
+    """Runs recorded in the store attributes, {run: [start, stop]} rows of the time dimension"""
+    import zarr
+
+    if not os.path.exists(store):
+        return {}
+    return json.loads(zarr.open_group(store, mode = 'r').attrs.get('runs', '{}'))
+
+
+def _truncate(store, length):
+    """Drop rows of the time dimension past length, left by an interrupted conversion"""
+    import zarr
+
+    group = zarr.open_group(store, mode = 'r+')
+    for name, array in group.arrays():
+        if array.attrs.get('_ARRAY_DIMENSIONS', [None])[0] == 'time' and array.shape[0] > length:
+            array.resize((length,) + array.shape[1:])
+    zarr.consolidate_metadata(store)
+
+
+def convert_run(mat_path, store, mesh, run, variables = VARIABLES, chunks = (TIME_CHUNK, NODE_CHUNK),
+                clevel = 3):
+    """
+    Append one run's BLOCK output to the grid store
+
+
+    Parameters
+    ----------
+    mat_path : string
+        The run's BLOCK .mat file
+    store : string
+        Zarr store directory, created with the mesh on the first run
+    mesh : Mesh or string
+        The mesh, or the path of its fort.14
+    run : string
+        Run name in RUN_FORMAT
+    variables : tuple, optional
+        BLOCK variables to store. The default is VARIABLES.
+    chunks : tuple, optional
+        (time, node) chunk shape. The default is (TIME_CHUNK, NODE_CHUNK).
+    clevel : int, optional
+        zstd compression level. The default is 3.
+
+    Returns
+    -------
+    written : int
+        Frames appended, 0 if the run was already in the store
+
+    """
+    import zarr
+    import read_mesh
+
+    runs = _completed(store)
+    if run in runs:
+        return 0
+    length = max([stop for start, stop in runs.values()], default = 0)
+
+    block = block_mat.BlockMat(mat_path)
+    variables = [name for name in variables if name in block.index]
+    if not variables:
+        raise KeyError("no grid variables in "+mat_path)
+    times = block.times(variables[0])
+    run_time = dt.datetime.strptime(run, RUN_FORMAT)
+
+    if not runs:
+        if not isinstance(mesh, read_mesh.Mesh):
+            mesh = read_mesh.Mesh(mesh)
+        if len(mesh.x) != block._size(variables[0]):
+            raise ValueError("mesh has %d nodes, the grid output %d" % (len(mesh.x), block._size(variables[0])))
+        first = xr.merge([_mesh_dataset(mesh), _block_dataset(block, run_time, times[:chunks[0]], variables)])
+        first.attrs['runs'] = json.dumps(runs)
+        first.to_zarr(store, mode = 'w', encoding = _encoding(variables, chunks, clevel), consolidated = True,
+                      **_format())
+        start = chunks[0]
+    else:
+        _truncate(store, length)
+        start = 0
+    for i in range(start, len(times), chunks[0]):
+        part = _block_dataset(block, run_time, times[i:i + chunks[0]], variables)
+        #appending replaces the group attributes, the completed runs are carried along
+        part.attrs['runs'] = json.dumps(runs)
+        part.to_zarr(store, append_dim = 'time', consolidated = True, **_format())
+
+    #recorded last, so an interrupted run is redone
+    runs[run] = [length, length + len(times)]
+    group = zarr.open_group(store, mode = 'r+')
+    group.attrs['runs'] = json.dumps(runs)
+    zarr.consolidate_metadata(store)
+    return len(times)
+
+
+def update_store(root, store, mesh, runs = None, **kwargs):
+    """
+    Convert every run directory under root not yet in the store
+
+
+    Parameters
+    ----------
+    root : string
+        Directory holding the run directories (named RUN_FORMAT) written by
+        SWAN_toolbox.SWAN_config_params
+    store : string
+        Zarr store directory
+    mesh : Mesh or string
+        The mesh, or the path of its fort.14
+    runs : list, optional
+        Runs to convert. The default is every run directory with a grid output.
+    **kwargs
+        Passed to convert_run, e.g. variables, chunks
+
+    Returns
+    -------
+    converted : dictionary
+        run: frames appended, for the runs converted by this call
+
+    """
+    import read_mesh
+
+    if runs is None:
+        runs = sorted(d for d in os.listdir(root) if _RUN.match(d))
+    done = _completed(store)
+    converted = {}
+    for run in runs:
+        path = os.path.join(root, run, GRID_OUTPUT.format(run = run))
+        if run in done or not os.path.exists(path):
+            continue
+        if not isinstance(mesh, read_mesh.Mesh):
+            mesh = read_mesh.Mesh(mesh)
+        converted[run] = convert_run(path, store, mesh, run, **kwargs)
+    return converted
+
+
+def open_store(store, run = None, latest = False):
+    """
+    Open the grid store lazily
+
+
+    Parameters
+    ----------
+    store : string
+        Zarr store directory
+    run : string, optional
+        Only this run's frames. The default is None, every run.
+    latest : bool, optional
+        One frame per time, from the most recent run covering it. The
+        default is False.
+
+    Returns
+    -------
+    data : Dataset
+        (time, node) variables with run_time and lead coordinates and the
+        mesh topology; selections read only the chunks they touch
+
+    """
+    ds = xr.open_zarr(store, consolidated = True)
+    runs = json.loads(ds.attrs.get('runs', '{}'))
+    #rows past the recorded runs are from an interrupted conversion
+    ds = ds.isel(time = slice(0, max([stop for start, stop in runs.values()], default = 0)))
+    if run is not None:
+        start, stop = runs[run]
+        ds = ds.isel(time = slice(start, stop))
+    elif latest:
+        frame = pd.DataFrame({'time': ds['time'].values, 'run_time': ds['run_time'].values})
+        keep = frame.sort_values(['time', 'run_time']).drop_duplicates('time', keep = 'last').index.values
+        ds = ds.isel(time = np.sort(keep)).sortby('time')
+    return ds
+
+
+def to_netcdf(store, path, run = None, latest = False, complevel = 4):
+    """Export (part of) the grid store to a compressed NetCDF4 file with the store's chunking"""
+    ds = open_store(store, run = run, latest = latest)
+    encoding = {}
+    for name, var in ds.variables.items():
+        if var.dims == ('time', 'node'):
+            chunks = var.encoding.get('chunks') or (TIME_CHUNK, NODE_CHUNK)
+            encoding[name] = {'zlib': True, 'complevel': complevel,
+                              'chunksizes': (min(chunks[0], ds.sizes['time']), min(chunks[1], ds.sizes['node']))}
+        #the zarr encodings do not apply to NetCDF
+        var.encoding = {}
+    ds.to_netcdf(path, encoding = encoding)
+    return path
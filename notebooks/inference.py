@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Batched inference for the saved wave models. Models and their scalers are
+loaded once and every model is run over the whole input in a single call,
+instead of the 12 row chunks used in the training notebooks.
+
+The MinMax scalers (norm_f, norm_l) are fitted in the training notebooks and
+saved next to the models with save_scalers; the models predict in scaled
+units, so from_files refuses to run without them unless told to.
+"""
+
+import os
+import time
+import pickle
+
+import numpy as np
+import pandas as pd
+
+#features the Tweed Heads Hs models were trained on (straight_to_obs_Hs)
+HS_COLUMNS = ['hs_a', 'hs_sa_a', 'hs_sw_a',
+              'dm_sin', 'dm_sa_sin', 'dm_sw_sin',
+              'hs_b', 'hs_sa_b', 'hs_sw_b', 'dm_sin_b', 'dm_sa_sin_b', 'dm_sw_sin_b',
+              'hs_c', 'hs_sa_c', 'hs_sw_c', 'Hs_diff_lag12', 'hour']
+
+#the repo's models directory, independent of the working directory
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models')
+
+#model files of the Hs models, named as in the notebook
+HS_MODELS = {'mlp': os.path.join(MODEL_DIR, 'twhds_mlpHs.sav'),
+             'mlp2': os.path.join(MODEL_DIR, 'twhds_mlpHs_ts.sav'),
+             'xbg': os.path.join(MODEL_DIR, 'twhds_xgbHs.sav')}
+
+#feature (norm_f) and label (norm_l) scalers of the Hs models
+HS_SCALERS = (os.path.join(MODEL_DIR, 'twhds_normfHs.sav'),
+              os.path.join(MODEL_DIR, 'twhds_normlHs.sav'))
+
+
+def load_model(path):
+    """Load a pickled model or scaler (.sav)"""
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_scalers(feature_scaler, label_scaler, paths = HS_SCALERS):
+    """
+    Save the fitted MinMax scalers of a model set next to its models
+
+    Parameters
+    ----------
+    feature_scaler : MinMaxScaler
+        Fitted feature scaler (norm_f)
+    label_scaler : MinMaxScaler
+        Fitted label scaler (norm_l)
+    paths : tuple, optional
+        (feature, label) scaler files. The default is HS_SCALERS.
+
+    """
+    for scaler, path in zip((feature_scaler, label_scaler), paths):
+        with open(path, 'wb') as f:
+            pickle.dump(scaler, f)
+
+
+class ForecastModels():
+    """
+    A set of regressors sharing one feature list and pair of MinMax scalers
+    """
+
+    def __init__(self, models, columns, feature_scaler = None, label_scaler = None, target = 'Hsig'):
+        """
+        Parameters
+        ----------
+        models : dictionary
+            name: fitted regressor with a predict method
+        columns : list
+            Feature columns, in training order
+        feature_scaler : scaler or string, optional
+            Fitted feature scaler (norm_f) or path to its pickle. The default is None.
+        label_scaler : scaler or string, optional
+            Fitted label scaler (norm_l) or path to its pickle. The default is None.
+        target : string or list, optional
+            Name of the predicted variable, or one name per output for
+            multi-output models, e.g. ['Dir_cos', 'Dir_sin']. The default is 'Hsig'.
+
+        """
+        self.models = dict(models)
+        self.columns = list(columns)
+        self.feature_scaler = load_model(feature_scaler) if isinstance(feature_scaler, str) else feature_scaler
+        self.label_scaler = load_model(label_scaler) if isinstance(label_scaler, str) else label_scaler
+        self.target = target
+        self.targets = [target] if isinstance(target, str) else list(target)
+        self.latency = {}
+
+    @classmethod
+    def from_files(cls, model_paths = HS_MODELS, columns = HS_COLUMNS, feature_scaler = HS_SCALERS[0],
+                   label_scaler = HS_SCALERS[1], target = 'Hsig'):
+        """
+        Load every model of a {name: path} mapping and its scalers once
+
+        Scaler paths that do not exist raise FileNotFoundError, pass None to
+        run the models on unscaled values.
+        """
+        for path in (feature_scaler, label_scaler):
+            if isinstance(path, str) and not os.path.isfile(path):
+                raise FileNotFoundError("scaler "+path+" not found, save the norm_f / norm_l fitted in the "
+                                        "training notebook with inference.save_scalers")
+        models = {name: load_model(path) for name, path in model_paths.items()}
+        return cls(models, columns, feature_scaler, label_scaler, target)
+
+    def features(self, data):
+        """
+        Scaled float32 feature matrix for a dataframe (or an array already in column order)
+        """
+        if isinstance(data, pd.DataFrame):
+            X = np.empty((len(data), len(self.columns)), dtype = np.float32)
+            for i, col in enumerate(self.columns):
+                X[:, i] = data[col].values
+        else:
+            X = np.asarray(data, dtype = np.float32)
+        if self.feature_scaler is not None:
+            X = np.asarray(self.feature_scaler.transform(X), dtype = np.float32)
+        return X
+
+    def predict_array(self, data):
+        """
+        Run every model over the input in one batch
+
+        Returns
+        -------
+        predictions : Ndarray
+            (models, rows, outputs) float32 array in self.models order, or
+            (models, rows) when there is a single target
+
+        """
+        X = self.features(data)
+        outputs = len(self.targets)
+        predictions = np.empty((len(self.models), X.shape[0], outputs), dtype = np.float32)
+        for k, (name, model) in enumerate(self.models.items()):
+            start = time.perf_counter()
+            y = np.asarray(model.predict(X), dtype = np.float64)
+            if y.size != X.shape[0] * outputs:
+                raise ValueError("model %s predicts %d values per row, expected %d for %s"
+                                 % (name, y.size // max(X.shape[0], 1), outputs, self.targets))
+            y = y.reshape(X.shape[0], outputs)
+            if self.label_scaler is not None:
+                y = self.label_scaler.inverse_transform(y)
+            predictions[k] = y
+            self.latency[name] = time.perf_counter() - start
+        return predictions[..., 0] if outputs == 1 else predictions
+
+    def predict(self, data, site_column = 'site'):
+        """
+        Predict with every model, returning one tidy frame
+
+        Parameters
+        ----------
+        data : dataframe
+            Features for a forecast horizon or hindcast, optionally for many
+            sites stacked with a site column
+        site_column : string, optional
+            Column carried through to the output when present. The default is 'site'.
+
+        Returns
+        -------
+        predictions : dataframe
+            One row per model and input row, with a model column and a
+            column per target, indexed as the input. Per model latency (seconds) is in self.latency.
+
+        """
+        values = self.predict_array(data).reshape(len(self.models), len(data), len(self.targets))
+        n = len(data)
+        names = list(self.models)
+        columns = {'model': pd.Categorical(np.repeat(names, n), categories = names)}
+        for j, label in enumerate(self.targets):
+            columns[label] = values[..., j].ravel()
+        predictions = pd.DataFrame(columns,
+                                   index = np.tile(data.index, len(names)) if len(names) else data.index[:0])
+        predictions.index.name = data.index.name
+        if site_column in data.columns:
+            predictions.insert(0, site_column, np.tile(data[site_column].values, len(names)))
+        return predictions
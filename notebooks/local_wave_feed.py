@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the QLD open data datastore_search endpoint, so the
+wave feed ingest (toolBOX.sync_latest_obs) can be run offline
+"""
+
+import json
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class LocalWaveFeed():
+    """
+    Serves wave records from memory in the CKAN datastore_search format
+
+    Supports the sort ('DateTime desc' or 'DateTime'), limit and offset
+    parameters and ETag / If-None-Match conditional requests.
+
+    Example
+    -------
+    with LocalWaveFeed(records) as feed:
+        toolBOX.sync_latest_obs('wave_obs.db', url = feed.url)
+    """
+
+    def __init__(self, records = None, host = '127.0.0.1', port = 0):
+        self.records = list(records or [])
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://"+host+":"+str(port)+"/api/3/action/datastore_search"
+
+    @property
+    def etag(self):
+        with self._lock:
+            body = json.dumps(self.records, sort_keys = True).encode()
+        return '"'+hashlib.md5(body).hexdigest()+'"'
+
+    def add_records(self, records):
+        """Publish new records, changing the feed's ETag"""
+        with self._lock:
+            self.records.extend(records)
+
+    def start(self):
+        self._thread = threading.Thread(target = self._server.serve_forever, daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _page(self, params):
+        with self._lock:
+            records = list(self.records)
+        sort = params.get('sort', [''])[0]
+        if sort.startswith('DateTime'):
+            records.sort(key = lambda r: r['DateTime'], reverse = sort.endswith('desc'))
+        offset = int(params.get('offset', ['0'])[0])
+        limit = int(params.get('limit', ['100'])[0])
+        fields = [{'id': k, 'type': 'text'} for k in (records[0] if records else {})]
+        return {'success': True,
+                'result': {'resource_id': params.get('resource_id', [''])[0],
+                           'fields': fields,
+                           'records': records[offset:offset + limit],
+                           'total': len(records)}}
+
+    def _handler(self):
+        feed = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = urlparse(self.path)
+                params = parse_qs(query.query)
+                feed.requests.append((query.path, params, dict(self.headers)))
+                etag = feed.etag
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                body = json.dumps(feed._page(params)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
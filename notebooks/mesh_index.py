@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Point queries on the unstructured mesh, for virtual stations extracted from
+the BLOCK outputs (*_grid_WavePar.mat) instead of adding points to
+gc_OutPts.txt and re-running SWAN.
+
+A KD-tree over the element centroids proposes candidate elements for each
+point and a vectorised barycentric test picks the one containing it. The
+node indices and weights of a set of points are computed once, after which
+extracting every timestep is a gather and a weighted sum.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+#parameters interpolated as unit vectors
+DIRECTIONS = ('Dir', 'PkDir')
+
+
+def _barycentric(x, y, tx, ty):
+    """Barycentric weights of points (x, y) in triangles with vertices (tx, ty)[..., 3]"""
+    det = (ty[..., 1] - ty[..., 2]) * (tx[..., 0] - tx[..., 2]) + (tx[..., 2] - tx[..., 1]) * (ty[..., 0] - ty[..., 2])
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        w0 = ((ty[..., 1] - ty[..., 2]) * (x - tx[..., 2]) + (tx[..., 2] - tx[..., 1]) * (y - ty[..., 2])) / det
+        w1 = ((ty[..., 2] - ty[..., 0]) * (x - tx[..., 2]) + (tx[..., 0] - tx[..., 2]) * (y - ty[..., 2])) / det
+    return np.stack([w0, w1, 1 - w0 - w1], axis = -1)
+
+
+class MeshIndex():
+    """
+    KD-tree and element locator over a mesh, built once per Mesh (Mesh.index)
+    """
+
+    def __init__(self, x, y, elements):
+        self.x = np.asarray(x, dtype = np.float64)
+        self.y = np.asarray(y, dtype = np.float64)
+        self.elements = np.asarray(elements)
+        self.node_tree = cKDTree(np.column_stack([self.x, self.y]))
+        self.centroid_tree = cKDTree(np.column_stack([self.x[self.elements].mean(axis = 1),
+                                                      self.y[self.elements].mean(axis = 1)]))
+
+    @classmethod
+    def from_mesh(cls, mesh):
+        return cls(mesh.x, mesh.y, mesh.elements)
+
+    def locate(self, px, py, k = (8, 64), tol = 1e-9):
+        """
+        Element containing each point
+
+        Parameters
+        ----------
+        px, py : Ndarray
+            Point coordinates
+        k : tuple, optional
+            Nearest element centroids tested per point, widening for the
+            points not yet found. The default is (8, 64).
+        tol : float, optional
+            Tolerance on the weights for points on edges. The default is 1e-9.
+
+        Returns
+        -------
+        element : Ndarray
+            Element index of each point, -1 outside the mesh
+        weights : Ndarray
+            (points, 3) barycentric weights of the element's nodes
+
+        """
+        px = np.atleast_1d(np.asarray(px, dtype = np.float64))
+        py = np.atleast_1d(np.asarray(py, dtype = np.float64))
+        element = np.full(len(px), -1)
+        weights = np.zeros((len(px), 3))
+        todo = np.arange(len(px))
+        for kk in k:
+            kk = min(kk, len(self.elements))
+            _, cand = self.centroid_tree.query(np.column_stack([px[todo], py[todo]]), k = kk)
+            cand = cand.reshape(len(todo), kk)
+            nodes = self.elements[cand]
+            w = _barycentric(px[todo, None], py[todo, None], self.x[nodes], self.y[nodes])
+            inside = (w >= -tol).all(axis = -1)
+            first = inside.argmax(axis = 1)
+            rows = np.arange(len(todo))
+            found = inside[rows, first]
+            element[todo[found]] = cand[rows, first][found]
+            weights[todo[found]] = w[rows, first][found]
+            todo = todo[~found]
+            if len(todo) == 0:
+                break
+        return element, weights
+
+    def weights(self, px, py, outside = 'nearest'):
+        """
+        Node indices and interpolation weights for a set of points
+
+        Parameters
+        ----------
+        px, py : Ndarray
+            Point coordinates
+        outside : string, optional
+            'nearest' takes the nearest node for points outside the mesh,
+            'nan' leaves them missing. The default is 'nearest'.
+
+        Returns
+        -------
+        PointWeights
+
+        """
+        element, weights = self.locate(px, py)
+        inside = element >= 0
+        nodes = self.elements[np.where(inside, element, 0)]
+        weights = np.where(inside[:, None], np.clip(weights, 0, 1), 0.)
+        if (~inside).any():
+            out = np.flatnonzero(~inside)
+            _, nearest = self.node_tree.query(np.column_stack([np.atleast_1d(px)[out], np.atleast_1d(py)[out]]))
+            nodes[out] = nearest[:, None]
+            weights[out] = [1., 0., 0.] if outside == 'nearest' else np.nan
+        weights = weights / weights.sum(axis = 1, keepdims = True)
+        return PointWeights(nodes, weights, inside)
+
+
+class PointWeights():
+    """Interpolation of node values to fixed points, for any number of timesteps"""
+
+    def __init__(self, nodes, weights, inside):
+        self.nodes = nodes
+        self.weights = weights
+        self.inside = inside
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def interpolate(self, values, direction = False):
+        """
+        Values at the points
+
+        Parameters
+        ----------
+        values : Ndarray
+            (..., node) node values, e.g. (time, node) frames or a memory map
+        direction : bool, optional
+            Interpolate degrees as unit vectors. The default is False.
+
+        Returns
+        -------
+        Ndarray
+            (..., points)
+
+        """
+        return self.interpolate_nodes(np.take(np.asarray(values), self.nodes, axis = -1), direction)
+
+    def interpolate_nodes(self, gathered, direction = False):
+        """As interpolate, from values already gathered at the nodes, (..., points, 3)"""
+        gathered = np.asarray(gathered, dtype = np.float64)
+        if direction:
+            rad = np.deg2rad(gathered)
+            s = (np.sin(rad) * self.weights).sum(axis = -1)
+            c = (np.cos(rad) * self.weights).sum(axis = -1)
+            return np.rad2deg(np.arctan2(s, c)) % 360.
+        return (gathered * self.weights).sum(axis = -1)
+
+
+def extract_points(mesh, matList, points, params = ('Hsig', 'TPsmoo', 'Dir'), outside = 'nearest'):
+    """
+    Time series at arbitrary points from BLOCK .mat outputs
+
+
+    Parameters
+    ----------
+    mesh : Mesh or string
+        The mesh, or the path of its fort.14
+    matList : list
+        BLOCK output .mat files (*_grid_WavePar.mat), in time order
+    points : DataFrame
+        lon and lat columns, e.g. SWAN_output.read_locations, indexed by site
+    params : tuple, optional
+        BLOCK variables to extract. The default is ('Hsig', 'TPsmoo', 'Dir').
+    outside : string, optional
+        See MeshIndex.weights. The default is 'nearest'.
+
+    Returns
+    -------
+    data : DataFrame
+        Indexed by 'Date/Time', with a site column and a column per param
+
+    """
+    import read_mesh
+    import block_mat
+
+    if not isinstance(mesh, read_mesh.Mesh):
+        mesh = read_mesh.Mesh(mesh)
+    pw = mesh.index.weights(points['lon'].values, points['lat'].values, outside)
+
+    series = {param: [] for param in params}
+    times = []
+    for path in matList:
+        block = block_mat.BlockMat(path)
+        stamps = block.times(params[0])
+        times.extend(stamps)
+        missing = np.full(pw.nodes.shape, np.nan)
+        for param in params:
+            names = block.index.get(param, {})
+            #only the nodes of the points are gathered from each memory mapped frame
+            frames = np.stack([block.read(names[t])[pw.nodes] if t in names else missing for t in stamps])
+            series[param].append(pw.interpolate_nodes(frames, param in DIRECTIONS))
+
+    index = pd.DatetimeIndex(times)
+    site = np.tile(np.asarray(points.index), len(index))
+    out = pd.DataFrame({'site': site}, index = pd.DatetimeIndex(np.repeat(index, len(pw)), name = 'Date/Time'))
+    for param in params:
+        out[param] = np.concatenate(series[param]).ravel()
+    return out
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Fast rendering of SWAN BLOCK outputs on the unstructured mesh.
+
+The frames of a parameter are stacked once from the .mat files into a
+(frame, node) float32 .npy file that is memory mapped, so no DataFrame is
+built. Each worker process draws the figure once on the mesh's cached
+Triangulation and then only updates the colour array and title of every
+frame it writes. The 'raster' style goes further: pixel to triangle
+barycentric weights are computed once, so a frame is a numpy gather and an
+image update, with no per triangle drawing.
+"""
+
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import read_mesh
+import block_mat
+
+
+def mat_frame_names(path, param = 'Hsig'):
+    """Names of a parameter's variables in a BLOCK .mat file, in file order, without reading data"""
+    return list(block_mat.BlockMat(path).index.get(param, {}).values())
+
+
+def stack_frames(matList, out_path, param = 'Hsig', timesteps = None, dtype = np.float32):
+    """
+    Stack the frames of a parameter from BLOCK .mat files into a .npy file
+
+
+    Parameters
+    ----------
+    matList : list
+        BLOCK output .mat files, in time order
+    out_path : string
+        .npy file to write, the frame labels are written next to it as .json
+    param : string, optional
+        Parameter prefix of the variables, e.g. 'Hsig'. The default is 'Hsig'.
+    timesteps : int, optional
+        Frames to take from each file. The default is all.
+    dtype : numpy dtype, optional
+        The default is np.float32.
+
+    Returns
+    -------
+    frames : memmap
+        (frame, node) array opened read only
+    labels : list
+        Variable name of every frame
+
+    """
+    files = [block_mat.BlockMat(path) for path in matList]
+    names = [list(f.index.get(param, {}).values())[:timesteps] for f in files]
+    labels = [name for file_names in names for name in file_names]
+    if not labels:
+        raise KeyError("no "+param+" variables in the .mat files")
+
+    #from the first file holding the parameter, earlier files may have none
+    size = next(f for f, file_names in zip(files, names) if file_names)._size(param)
+    frames = np.lib.format.open_memmap(out_path+'.tmp', mode = 'w+', dtype = dtype,
+                                       shape = (len(labels), size))
+    row = 0
+    for f, file_names in zip(files, names):
+        #only the variables needed are read from each file
+        for name in file_names:
+            frames[row] = f.read(name)
+            row += 1
+    frames.flush()
+    del frames
+    os.replace(out_path+'.tmp', out_path)
+    with open(out_path+'.json', 'w') as f:
+        json.dump(labels, f)
+    return open_frames(out_path)
+
+
+def open_frames(path):
+    """Memory map a stacked frames file and its labels"""
+    frames = np.load(path, mmap_mode = 'r')
+    with open(path+'.json') as f:
+        labels = json.load(f)
+    return frames, labels
+
+
+def frame_limits(frames, chunk = 64):
+    """Min and max over all frames, streaming chunks of the memory map"""
+    lo, hi = np.inf, -np.inf
+    for start in range(0, len(frames), chunk):
+        block = np.asarray(frames[start:start + chunk])
+        if np.isfinite(block).any():
+            lo = min(lo, float(np.nanmin(block)))
+            hi = max(hi, float(np.nanmax(block)))
+    return lo, hi
+
+
+def raster_weights(tri, xs, ys):
+    """
+    Linear interpolation weights from mesh nodes to a regular pixel grid
+
+    Parameters
+    ----------
+    tri : Triangulation
+        Mesh triangulation
+    xs, ys : Ndarray
+        Pixel centre coordinates along x and y
+
+    Returns
+    -------
+    nodes : Ndarray
+        (ny, nx, 3) node indices of the triangle holding each pixel
+    weights : Ndarray
+        (ny, nx, 3) barycentric weights, 0 outside the mesh
+    inside : Ndarray
+        (ny, nx) bool, pixels within the mesh
+
+    """
+    X, Y = np.meshgrid(xs, ys)
+    found = tri.get_trifinder()(X, Y)
+    inside = found >= 0
+    nodes = tri.triangles[np.where(inside, found, 0)]
+    x0, y0 = tri.x[nodes[..., 0]], tri.y[nodes[..., 0]]
+    x1, y1 = tri.x[nodes[..., 1]], tri.y[nodes[..., 1]]
+    x2, y2 = tri.x[nodes[..., 2]], tri.y[nodes[..., 2]]
+    det = (y1 - y2) * (x0 - x2) + (x2 - x1) * (y0 - y2)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        w0 = ((y1 - y2) * (X - x2) + (x2 - x1) * (Y - y2)) / det
+        w1 = ((y2 - y0) * (X - x2) + (x0 - x2) * (Y - y2)) / det
+    weights = np.stack([w0, w1, 1 - w0 - w1], axis = -1)
+    weights[~inside] = 0.
+    return nodes, weights.astype(np.float32), inside
+
+
+class FrameRenderer():
+    """
+    A figure drawn once on the mesh, updated in place for every frame
+
+    style 'raster' interpolates the nodes onto the figure's pixels with
+    weights computed once, 'tripcolor' (gouraud shaded) swaps the colour
+    array of the mesh, and 'contourf' recontours every frame on the reused
+    Triangulation and levels.
+    """
+
+    def __init__(self, mesh, vmin, vmax, style = 'raster', levels = 100, label = 'Hsig (m)',
+                 ylim = (-28.4, -28.0), xlim = None, figsize = (10, 8), dpi = 100, cmap = 'viridis'):
+        import matplotlib
+        import matplotlib.pyplot as plt
+
+        self.mesh = mesh if isinstance(mesh, read_mesh.Mesh) else read_mesh.Mesh(mesh)
+        self.tri = self.mesh.triangulation
+        self.style = style
+        self.levels = np.linspace(vmin, vmax, levels)
+        self.norm = matplotlib.colors.Normalize(vmin, vmax)
+        self.cmap = cmap
+        self.dpi = dpi
+        self.ylim, self.xlim = ylim, xlim
+
+        self.fig, self.ax = plt.subplots(figsize = figsize)
+        zero = np.zeros(len(self.mesh.x))
+        if style == 'raster':
+            self.xlim = xlim or (float(self.mesh.x.min()), float(self.mesh.x.max()))
+            self.ylim = ylim or (float(self.mesh.y.min()), float(self.mesh.y.max()))
+            #one pixel per screen pixel of the figure
+            nx, ny = int(figsize[0] * dpi), int(figsize[1] * dpi)
+            xs = np.linspace(self.xlim[0], self.xlim[1], nx)
+            ys = np.linspace(self.ylim[0], self.ylim[1], ny)
+            self.nodes, self.weights, self.inside = raster_weights(self.tri, xs, ys)
+            self.im = self.ax.imshow(np.ma.masked_all((ny, nx)), origin = 'lower', norm = self.norm,
+                                     cmap = cmap, extent = (*self.xlim, *self.ylim), aspect = 'auto',
+                                     interpolation = 'nearest')
+        elif style == 'tripcolor':
+            self.im = self.ax.tripcolor(self.tri, zero, shading = 'gouraud', norm = self.norm, cmap = cmap)
+        else:
+            self.im = self.ax.tricontourf(self.tri, zero, levels = self.levels, norm = self.norm, cmap = cmap)
+        cbar = self.fig.colorbar(matplotlib.cm.ScalarMappable(norm = self.norm, cmap = cmap), ax = self.ax)
+        cbar.set_ticks(self.levels[::max(1, len(self.levels) // 25)])
+        cbar.set_label(label)
+        self.title = self.ax.text(0.5, 0.85, '', bbox = {'facecolor': 'w', 'alpha': 0.5, 'pad': 5},
+                                  transform = self.ax.transAxes, ha = "center")
+        self._limits()
+
+    def _limits(self):
+        if self.ylim is not None:
+            self.ax.set_ylim(self.ylim)
+        if self.xlim is not None:
+            self.ax.set_xlim(self.xlim)
+
+    def draw(self, z, label = ''):
+        """Show one frame of node values"""
+        z = np.nan_to_num(np.asarray(z, dtype = np.float32))
+        if self.style == 'raster':
+            image = np.einsum('ijk,ijk->ij', z[self.nodes], self.weights)
+            self.im.set_data(np.ma.array(image, mask = ~self.inside))
+        elif self.style == 'tripcolor':
+            self.im.set_array(z)
+        else:
+            self.im.remove()
+            self.im = self.ax.tricontourf(self.tri, z, levels = self.levels, norm = self.norm,
+                                          cmap = self.cmap, extend = 'both')
+            self._limits()
+        self.title.set_text(label)
+        return self.im
+
+    def save(self, z, label, path):
+        self.draw(z, label)
+        #fast zlib level, frames are intermediate files
+        self.fig.savefig(path, dpi = self.dpi, pil_kwargs = {'compress_level': 1})
+        return path
+
+
+#per worker process state, set by _init_worker
+_WORKER = {}
+
+
+def _init_worker(mesh_path, frames_path, kwargs):
+    import matplotlib
+    matplotlib.use('Agg')
+
+    frames, labels = open_frames(frames_path)
+    _WORKER['frames'], _WORKER['labels'] = frames, labels
+    _WORKER['renderer'] = FrameRenderer(mesh_path, **kwargs)
+
+
+def _render_range(start, stop, out_dir, prefix):
+    renderer, frames, labels = _WORKER['renderer'], _WORKER['frames'], _WORKER['labels']
+    files = []
+    for i in range(start, stop):
+        files.append(renderer.save(frames[i], labels[i], os.path.join(out_dir, prefix+"_%04d.png" % i)))
+    return files
+
+
+def render_frames(mesh_path, frames_path, out_dir, workers = None, prefix = 'frame',
+                  vmin = None, vmax = None, **kwargs):
+    """
+    Write every frame of a stacked frames file to PNG through a process pool
+
+
+    Parameters
+    ----------
+    mesh_path : string
+        fort.14 mesh (its binary cache makes loading in each worker cheap)
+    frames_path : string
+        .npy file from stack_frames
+    out_dir : string
+        Directory for the PNG files
+    workers : int, optional
+        Processes, the default is os.cpu_count(); 1 renders in this process.
+    prefix : string, optional
+        Files are named <prefix>_<frame>.png. The default is 'frame'.
+    vmin, vmax : float, optional
+        Colour limits. The default is the range of all frames.
+    **kwargs
+        Passed to FrameRenderer, e.g. style, label, ylim, dpi
+
+    Returns
+    -------
+    files : list
+        PNG paths in frame order
+
+    """
+    frames, labels = open_frames(frames_path)
+    if vmin is None or vmax is None:
+        lo, hi = frame_limits(frames)
+        vmin = lo if vmin is None else vmin
+        vmax = hi if vmax is None else vmax
+    kwargs.update(vmin = vmin, vmax = vmax)
+    os.makedirs(out_dir, exist_ok = True)
+
+    n = len(frames)
+    workers = max(1, min(workers or os.cpu_count() or 1, n))
+    if workers == 1:
+        _init_worker(mesh_path, frames_path, kwargs)
+        return _render_range(0, n, out_dir, prefix)
+
+    #a few contiguous ranges per worker, so each reads its frames sequentially
+    bounds = np.linspace(0, n, workers * 4 + 1).astype(int)
+    with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker,
+                             initargs = (mesh_path, frames_path, kwargs)) as pool:
+        parts = pool.map(_render_range, bounds[:-1], bounds[1:], [out_dir] * (len(bounds) - 1),
+                         [prefix] * (len(bounds) - 1))
+        return [f for part in parts for f in part]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+NumPy forward pass for the saved sklearn MLPRegressor models.
+
+export_mlp writes the weights of a fitted MLPRegressor to a compact .npz,
+with the MinMax feature scaling folded into the first layer and the label
+scaling folded into the last. NumpyMLP then predicts in physical units with
+a few matmuls and no sklearn import.
+"""
+
+import numpy as np
+
+ACTIVATIONS = {'identity': lambda x: x,
+               'relu': lambda x: np.maximum(x, 0, out = x),
+               'tanh': lambda x: np.tanh(x, out = x),
+               'logistic': lambda x: np.divide(1, 1 + np.exp(-x))}
+
+
+def fold_scalers(coefs, intercepts, feature_scaler = None, label_scaler = None):
+    """
+    Fold MinMax scalers into the first and last layer weights
+
+    Scaled features are X * scale_ + min_, so the first layer becomes
+    X @ (scale_[:, None] * W0) + (min_ @ W0 + b0). The label is recovered
+    from the network output as (y - min_) / scale_, which is folded into
+    the output layer the same way.
+
+    Parameters
+    ----------
+    coefs : list
+        Layer weight matrices (MLPRegressor.coefs_)
+    intercepts : list
+        Layer bias vectors (MLPRegressor.intercepts_)
+    feature_scaler : MinMaxScaler, optional
+        Fitted feature scaler (norm_f). The default is None.
+    label_scaler : MinMaxScaler, optional
+        Fitted label scaler (norm_l). The default is None.
+
+    Returns
+    -------
+    coefs, intercepts : list, list
+        float64 copies of the weights with the scaling folded in
+
+    """
+    coefs = [np.array(w, dtype = np.float64) for w in coefs]
+    intercepts = [np.array(b, dtype = np.float64) for b in intercepts]
+    if feature_scaler is not None:
+        scale = np.asarray(feature_scaler.scale_, dtype = np.float64)
+        offset = np.asarray(feature_scaler.min_, dtype = np.float64)
+        intercepts[0] = offset @ coefs[0] + intercepts[0]
+        coefs[0] = scale[:, None] * coefs[0]
+    if label_scaler is not None:
+        scale = np.asarray(label_scaler.scale_, dtype = np.float64)
+        offset = np.asarray(label_scaler.min_, dtype = np.float64)
+        coefs[-1] = coefs[-1] / scale
+        intercepts[-1] = (intercepts[-1] - offset) / scale
+    return coefs, intercepts
+
+
+def export_mlp(model, path, feature_scaler = None, label_scaler = None):
+    """
+    Export a fitted MLPRegressor (and its scalers) to an .npz file
+
+    Parameters
+    ----------
+    model : MLPRegressor
+        Fitted model, e.g. loaded from models/twhds_mlpHs.sav
+    path : string
+        Output .npz path
+    feature_scaler : MinMaxScaler, optional
+        Fitted feature scaler folded into the first layer. The default is None.
+    label_scaler : MinMaxScaler, optional
+        Fitted label scaler folded into the last layer. The default is None.
+
+    Returns
+    -------
+    path : string
+        The path written
+
+    """
+    coefs, intercepts = fold_scalers(model.coefs_, model.intercepts_, feature_scaler, label_scaler)
+    arrays = {}
+    for i, (w, b) in enumerate(zip(coefs, intercepts)):
+        arrays['W'+str(i)] = w
+        arrays['b'+str(i)] = b
+    np.savez(path, activation = np.array(model.activation),
+             out_activation = np.array(model.out_activation_),
+             n_layers = np.array(len(coefs)), **arrays)
+    return path
+
+
+class NumpyMLP():
+    """
+    Fused MLP forward pass from exported weights
+
+    Has the predict signature of the sklearn regressors, so it can be used
+    in inference.ForecastModels (without scalers, as they are folded in).
+    """
+
+    def __init__(self, coefs, intercepts, activation = 'relu', out_activation = 'identity',
+                 dtype = np.float64):
+        self.coefs = [np.ascontiguousarray(w, dtype = dtype) for w in coefs]
+        self.intercepts = [np.ascontiguousarray(b, dtype = dtype) for b in intercepts]
+        self.activation = str(activation)
+        self.out_activation = str(out_activation)
+        self.dtype = dtype
+
+    @classmethod
+    def load(cls, path, dtype = np.float64):
+        """Load weights written by export_mlp"""
+        with np.load(path, allow_pickle = False) as f:
+            n = int(f['n_layers'])
+            coefs = [f['W'+str(i)] for i in range(n)]
+            intercepts = [f['b'+str(i)] for i in range(n)]
+            return cls(coefs, intercepts, str(f['activation']), str(f['out_activation']), dtype)
+
+    @classmethod
+    def from_sklearn(cls, model, feature_scaler = None, label_scaler = None, dtype = np.float64):
+        """Build directly from a fitted MLPRegressor, without writing a file"""
+        coefs, intercepts = fold_scalers(model.coefs_, model.intercepts_, feature_scaler, label_scaler)
+        return cls(coefs, intercepts, model.activation, model.out_activation_, dtype)
+
+    def predict(self, X):
+        """
+        Predict from unscaled features
+
+        Parameters
+        ----------
+        X : Ndarray
+            (rows, features) array, in training column order
+
+        Returns
+        -------
+        Ndarray
+            (rows,) predictions in label units
+
+        """
+        h = np.asarray(X, dtype = self.dtype)
+        hidden = ACTIVATIONS[self.activation]
+        last = len(self.coefs) - 1
+        for i, (w, b) in enumerate(zip(self.coefs, self.intercepts)):
+            h = h @ w
+            h += b
+            h = ACTIVATIONS[self.out_activation](h) if i == last else hidden(h)
+        return h[:, 0] if h.shape[1] == 1 else h
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Model registry replacing the raw pickle .sav files.
+
+Each model is stored in a native format (XGBoost UBJ booster, or NumPy
+weights for the MLPs) with a manifest holding its feature list, the MinMax
+scaler parameters and a version hash:
+
+    <registry>/<name>/<version>/manifest.json
+    <registry>/<name>/<version>/model.ubj | weights.npz
+    <registry>/<name>/CURRENT
+
+Loading is lazy and memoised per version, and the active version is
+switched by atomically replacing the CURRENT file.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import datetime as dt
+
+import numpy as np
+
+import mlp_numpy
+
+
+class ScalerParams():
+    """MinMax scaler parameters with the transform methods of sklearn's MinMaxScaler"""
+
+    def __init__(self, min_, scale_):
+        self.min_ = np.asarray(min_, dtype = np.float64)
+        self.scale_ = np.asarray(scale_, dtype = np.float64)
+
+    @classmethod
+    def from_scaler(cls, scaler):
+        return None if scaler is None else cls(scaler.min_, scaler.scale_)
+
+    def to_dict(self):
+        return {'min_': self.min_.tolist(), 'scale_': self.scale_.tolist()}
+
+    def transform(self, X):
+        return np.asarray(X, dtype = np.float64) * self.scale_ + self.min_
+
+    def inverse_transform(self, X):
+        return (np.asarray(X, dtype = np.float64) - self.min_) / self.scale_
+
+
+class XGBModel():
+    """XGBoost booster with its scalers, predicting from unscaled features"""
+
+    def __init__(self, booster, feature_scaler = None, label_scaler = None):
+        self.booster = booster
+        self.feature_scaler = feature_scaler
+        self.label_scaler = label_scaler
+
+    def predict(self, X):
+        X = np.asarray(X, dtype = np.float64)
+        if self.feature_scaler is not None:
+            X = self.feature_scaler.transform(X)
+        y = np.asarray(self.booster.inplace_predict(X), dtype = np.float64)
+        if self.label_scaler is not None:
+            #one column per label, e.g. Dir_cos and Dir_sin for the direction models
+            outputs = np.size(self.label_scaler.scale_)
+            y = self.label_scaler.inverse_transform(y.reshape(len(X), outputs))
+            if outputs == 1:
+                y = y.ravel()
+        return y
+
+
+class RegistryEntry():
+    """A loaded model version: predict from unscaled features in feature order"""
+
+    def __init__(self, name, version, manifest, model):
+        self.name = name
+        self.version = version
+        self.manifest = manifest
+        self.features = manifest['features']
+        self.model = model
+
+    def predict(self, X):
+        return self.model.predict(X)
+
+    def __repr__(self):
+        return "RegistryEntry("+self.name+", "+self.version+", "+self.manifest['kind']+")"
+
+
+def _write_atomic(path, text):
+    fd, tmp = tempfile.mkstemp(dir = os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class ModelRegistry():
+    """
+    Directory of versioned models with lazy, memoised loading
+    """
+
+    def __init__(self, path = '../models/registry'):
+        self.path = path
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def versions(self, name):
+        """Registered versions of a model, oldest first"""
+        folder = os.path.join(self.path, name)
+        if not os.path.isdir(folder):
+            return []
+        found = []
+        for version in os.listdir(folder):
+            manifest = os.path.join(folder, version, 'manifest.json')
+            if os.path.isfile(manifest):
+                with open(manifest) as f:
+                    found.append((json.load(f)['created'], version))
+        return [v for _, v in sorted(found)]
+
+    def current(self, name):
+        """The active version of a model"""
+        with open(os.path.join(self.path, name, 'CURRENT')) as f:
+            return f.read().strip()
+
+    def activate(self, name, version):
+        """Atomically make a registered version the active one"""
+        if not os.path.isfile(os.path.join(self.path, name, version, 'manifest.json')):
+            raise KeyError(name+" has no version "+version)
+        _write_atomic(os.path.join(self.path, name, 'CURRENT'), version)
+
+    def register(self, name, model, features, feature_scaler = None, label_scaler = None,
+                 activate = True, **metadata):
+        """
+        Store a fitted model in its native format
+
+        Parameters
+        ----------
+        name : string
+            Model name, e.g. 'twhds_xgbHs'
+        model : MLPRegressor, XGBRegressor or xgboost Booster
+            The fitted model
+        features : list
+            Training columns, in order (e.g. the Hs trainingColumns)
+        feature_scaler : MinMaxScaler, optional
+            Fitted feature scaler (norm_f). The default is None.
+        label_scaler : MinMaxScaler, optional
+            Fitted label scaler (norm_l). The default is None.
+        activate : bool, optional
+            Make this the active version. The default is True.
+        **metadata
+            Extra JSON serialisable entries for the manifest, e.g. target = 'Hsig'
+
+        Returns
+        -------
+        version : string
+            The version hash
+
+        """
+        feature_scaler = ScalerParams.from_scaler(feature_scaler)
+        label_scaler = ScalerParams.from_scaler(label_scaler)
+        manifest = {'name': name,
+                    'features': list(features),
+                    'feature_scaler': None if feature_scaler is None else feature_scaler.to_dict(),
+                    'label_scaler': None if label_scaler is None else label_scaler.to_dict(),
+                    'metadata': metadata}
+
+        os.makedirs(os.path.join(self.path, name), exist_ok = True)
+        staging = tempfile.mkdtemp(dir = os.path.join(self.path, name))
+        os.chmod(staging, 0o755)
+        if hasattr(model, 'coefs_'):
+            manifest['kind'] = 'mlp'
+            model_file = os.path.join(staging, 'weights.npz')
+            mlp_numpy.export_mlp(model, model_file)
+        else:
+            manifest['kind'] = 'xgboost'
+            model_file = os.path.join(staging, 'model.ubj')
+            booster = model.get_booster() if hasattr(model, 'get_booster') else model
+            booster.save_model(model_file)
+
+        digest = hashlib.sha256()
+        with open(model_file, 'rb') as f:
+            digest.update(f.read())
+        digest.update(json.dumps(manifest, sort_keys = True).encode())
+        version = digest.hexdigest()[:12]
+        manifest['version'] = version
+        manifest['created'] = dt.datetime.now().isoformat()
+        with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent = 1)
+
+        target = os.path.join(self.path, name, version)
+        if os.path.isdir(target):
+            #identical model already registered
+            for fname in os.listdir(staging):
+                os.remove(os.path.join(staging, fname))
+            os.rmdir(staging)
+        else:
+            os.replace(staging, target)
+        if activate:
+            self.activate(name, version)
+        return version
+
+    def import_sav(self, name, sav_path, features, feature_scaler = None, label_scaler = None, **metadata):
+        """Register a legacy pickled .sav model (unpickled once, here)"""
+        import inference
+
+        return self.register(name, inference.load_model(sav_path), features,
+                             feature_scaler, label_scaler, **metadata)
+
+    def get(self, name, version = None):
+        """
+        The model for a version (default: the active one), loaded once
+
+        Returns
+        -------
+        entry : RegistryEntry
+
+        """
+        if version is None:
+            version = self.current(name)
+        key = (name, version)
+        entry = self._cache.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self._cache.get(key)
+                if entry is None:
+                    entry = self._load(name, version)
+                    self._cache[key] = entry
+        return entry
+
+    def _load(self, name, version):
+        folder = os.path.join(self.path, name, version)
+        with open(os.path.join(folder, 'manifest.json')) as f:
+            manifest = json.load(f)
+        scalers = [None if manifest[k] is None else ScalerParams(**manifest[k])
+                   for k in ('feature_scaler', 'label_scaler')]
+        if manifest['kind'] == 'mlp':
+            mlp = mlp_numpy.NumpyMLP.load(os.path.join(folder, 'weights.npz'))
+            coefs, intercepts = mlp_numpy.fold_scalers(mlp.coefs, mlp.intercepts, *scalers)
+            model = mlp_numpy.NumpyMLP(coefs, intercepts, mlp.activation, mlp.out_activation)
+        else:
+            import xgboost
+
+            booster = xgboost.Booster()
+            booster.load_model(os.path.join(folder, 'model.ubj'))
+            model = XGBModel(booster, *scalers)
+        return RegistryEntry(name, version, manifest, model)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Location and switch of the binary .npz caches of parsed inputs (the fort.14
+meshes of read_mesh and the .sp2 spectra of SWAN_output).
+
+A cache sits next to its input, or under CACHE_DIR when the input's
+directory is not writable. Setting CACHE = False, or the SWAN_CACHE
+environment variable to 0, turns the caches off everywhere.
+"""
+
+import os
+import hashlib
+
+CACHE = os.environ.get('SWAN_CACHE', '1') != '0'
+CACHE_DIR = os.environ.get('SWAN_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'swan_npz'))
+
+
+def enabled(cache = None):
+    """Whether to cache, an explicit cache argument overriding CACHE"""
+    return CACHE if cache is None else bool(cache)
+
+
+def cache_path(path, suffix = '.npz'):
+    """
+    Cache file of an input
+
+    Parameters
+    ----------
+    path : string
+        The input file, e.g. a fort.14
+    suffix : string, optional
+        The default is '.npz'.
+
+    Returns
+    -------
+    string
+        path + suffix when it exists or the input's directory is writable,
+        otherwise a file in CACHE_DIR named after the input's absolute path
+
+    """
+    path = os.path.abspath(path)
+    local = path + suffix
+    if os.path.exists(local) or os.access(os.path.dirname(path), os.W_OK):
+        return local
+    digest = hashlib.sha1(path.encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, digest+'_'+os.path.basename(path)+suffix)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Sea and swell partitioning of WW3 spectra for the offshore model features
+(hs_sa_a, tm02_sw_b, dm_sa_c ... in data/offshorePartitions_23.csv).
+
+Wind sea is separated from swell with the WAM wave age criterion, energy
+whose celerity is below agefac times the wind component along its direction
+being wind sea. The mask and the integrated parameters are plain numpy over
+the whole (time, site, freq, dir) array, with the integration weights of
+wavespectra so totals agree with SWAN_toolbox.waveParams.
+"""
+
+import numpy as np
+import pandas as pd
+
+#WW3 output stations of the offshore sites used by the models
+OFFSHORE_SITES = {'a': 564.0, 'b': 563.0, 'c': 565.0}
+
+#partition suffixes of the feature names
+PARTITIONS = ('', '_sa', '_sw')
+
+#integrated parameters of every partition, tp and dpm are added for the total
+PARAMS = ('hs', 'hmax', 'tm01', 'tm02', 'dm', 'dspr')
+
+
+def wavenumber(freq, depth):
+    """Chen and Thomson approximation of the wavenumber (1/m), as wavespectra"""
+    ang_freq = 2 * np.pi * freq
+    k0h = 0.10194 * ang_freq * ang_freq * depth
+    a = 1.0 + k0h * (0.6522 + k0h * (0.4622 + k0h * k0h * (0.0864 + 0.0675 * k0h)))
+    return (k0h * (1 + 1.0 / (k0h * a)) ** 0.5) / depth
+
+
+def wind_sea_mask(freq, dirs, wspd, wdir, dpt = None, agefac = 1.7):
+    """
+    Wave age mask of the wind sea
+
+    Parameters
+    ----------
+    freq : Ndarray
+        Frequencies (Hz)
+    dirs : Ndarray
+        Directions (degrees, coming from)
+    wspd, wdir : Ndarray
+        Wind speed (m/s) and direction (degrees, coming from), any leading shape
+    dpt : Ndarray, optional
+        Water depth (m), deep water celerity if None. The default is None.
+    agefac : float, optional
+        Age factor. The default is 1.7.
+
+    Returns
+    -------
+    mask : Ndarray
+        bool array of shape wspd.shape + (freq, dir), True for wind sea
+
+    """
+    freq = np.asarray(freq, dtype = np.float64)
+    wspd = np.asarray(wspd, dtype = np.float64)[..., None, None]
+    wdir = np.asarray(wdir, dtype = np.float64)[..., None, None]
+    component = agefac * wspd * np.cos(np.deg2rad(np.asarray(dirs, dtype = np.float64) - wdir))
+    if dpt is None:
+        celerity = (1.56 / freq)[:, None]
+    else:
+        depth = np.asarray(dpt, dtype = np.float64)[..., None]
+        celerity = (2 * np.pi * freq / wavenumber(freq, depth))[..., None]
+    return celerity <= component
+
+
+def spectral_params(efth, freq, dirs, duration = None):
+    """
+    Integrated parameters of many spectra at once
+
+    Parameters
+    ----------
+    efth : Ndarray
+        (..., freq, dir) variance density in m2/Hz/deg
+    freq : Ndarray
+        Frequencies (Hz)
+    dirs : Ndarray
+        Directions (degrees, coming from), evenly spaced
+    duration : float, optional
+        Sea state duration (s) for hmax, as wavespectra the output interval.
+        The default is None, hmax = 1.86 hs.
+
+    Returns
+    -------
+    params : dictionary
+        hs, hmax, tm01, tm02, dm and dspr arrays over the leading dimensions
+
+    """
+    efth = np.asarray(efth, dtype = np.float64)
+    freq = np.asarray(freq, dtype = np.float64)
+    rad = np.deg2rad(np.asarray(dirs, dtype = np.float64))
+    df = np.gradient(freq) if len(freq) > 1 else np.ones(1)
+    dd = abs(float(dirs[1] - dirs[0])) if len(dirs) > 1 else 1.0
+
+    oned = efth.sum(axis = -1) * dd
+    m0 = (oned * df).sum(axis = -1)
+    m1 = (oned * df * freq).sum(axis = -1)
+    m2 = (oned * df * freq ** 2).sum(axis = -1)
+    #high frequency tail, as wavespectra hs
+    e_tail = m0 + (0.25 * oned[..., -1] * freq[-1] if freq[-1] > 0.333 else 0.)
+    s = ((efth * np.sin(rad)).sum(axis = -1) * dd * df).sum(axis = -1)
+    c = ((efth * np.cos(rad)).sum(axis = -1) * dd * df).sum(axis = -1)
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        params = {}
+        params['hs'] = 4 * np.sqrt(e_tail)
+        params['tm01'] = m0 / m1
+        params['tm02'] = np.sqrt(m0 / m2)
+        if duration is None:
+            k = 1.86
+        else:
+            k = np.sqrt(0.5 * np.log(np.round(duration / params['tm02'])))
+        params['hmax'] = k * params['hs']
+        #undefined, like the periods, for an empty partition
+        params['dm'] = np.where(m0 > 0, np.rad2deg(np.arctan2(s, c)) % 360., np.nan)
+        params['dspr'] = np.sqrt(2 * np.rad2deg(1) ** 2 * (1 - np.sqrt(s ** 2 + c ** 2) / np.where(m0 > 0, m0, np.nan)))
+    return {k: params[k] for k in PARAMS}
+
+
+def peak_params(efth, freq, dirs):
+    """
+    Smoothed peak period and peak direction of many spectra at once, as wavespectra
+
+    Parameters
+    ----------
+    efth : Ndarray
+        (..., freq, dir) variance density in m2/Hz/deg
+    freq : Ndarray
+        Frequencies (Hz)
+    dirs : Ndarray
+        Directions (degrees, coming from), evenly spaced
+
+    Returns
+    -------
+    params : dictionary
+        tp, from a parabolic fit around the highest true peak of the 1-D
+        spectrum, and dpm, the mean direction at that frequency, NaN when
+        the spectrum has no interior peak
+
+    """
+    efth = np.asarray(efth, dtype = np.float64)
+    freq = np.asarray(freq, dtype = np.float64)
+    rad = np.deg2rad(np.asarray(dirs, dtype = np.float64))
+
+    oned = efth.sum(axis = -1)
+    #a peak is strictly above both neighbours, so never the first or last frequency
+    ispeak = np.zeros(oned.shape, dtype = bool)
+    ispeak[..., 1:-1] = (oned[..., 1:-1] > oned[..., :-2]) & (oned[..., 1:-1] > oned[..., 2:])
+    ipeak = np.where(ispeak, oned, 0).argmax(axis = -1)
+    valid = ipeak > 0
+    ip = np.clip(ipeak, 1, max(len(freq) - 2, 1))[..., None]
+
+    e1, e2, e3 = (np.take_along_axis(oned, ip + k, axis = -1)[..., 0] for k in (-1, 0, 1))
+    f1, f2, f3 = freq[ip[..., 0] - 1], freq[ip[..., 0]], freq[ip[..., 0] + 1]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        q12 = (e1 - e2) / (f1 - f2)
+        q13 = (e1 - e3) / (f1 - f3)
+        fp = (f1 + f2 - q12 * (f3 - f2) / (q13 - q12)) / 2.
+        tp = np.where(valid, 1. / fp, np.nan)
+
+    at_peak = np.take_along_axis(efth, ip[..., None], axis = -2)[..., 0, :]
+    s = (at_peak * np.sin(rad)).sum(axis = -1)
+    c = (at_peak * np.cos(rad)).sum(axis = -1)
+    dpm = np.where(valid, np.rad2deg(np.arctan2(s, c)) % 360., np.nan)
+    return {'tp': tp, 'dpm': dpm}
+
+
+def partition_params(spec, agefac = 1.7):
+    """
+    Total, wind sea and swell parameters of a wavespectra dataset
+
+    Parameters
+    ----------
+    spec : Dataset
+        wavespectra dataset with efth (time, site, freq, dir), wspd, wdir and dpt
+    agefac : float, optional
+        Wave age factor. The default is 1.7.
+
+    Returns
+    -------
+    params : dictionary
+        '<param><partition>': (time, site) array for PARAMS and PARTITIONS,
+        plus tp and dpm of the total
+
+    """
+    spec = spec.transpose('time', 'site', 'freq', 'dir', ...)
+    efth = spec['efth'].values
+    freq, dirs = spec['freq'].values, spec['dir'].values
+    times = spec.indexes['time']
+    duration = float(np.mean(np.diff(times.values)) / np.timedelta64(1, 's')) if len(times) > 1 else None
+
+    dpt = spec['dpt'].transpose('time', 'site').values if 'dpt' in spec else None
+    sea = wind_sea_mask(freq, dirs, spec['wspd'].transpose('time', 'site').values,
+                        spec['wdir'].transpose('time', 'site').values, dpt, agefac)
+
+    #the three partitions stacked on a leading axis, integrated in one call
+    parts = np.stack([efth, np.where(sea, efth, 0.), np.where(sea, 0., efth)])
+    stats = spectral_params(parts, freq, dirs, duration)
+
+    params = {}
+    peak = peak_params(efth, freq, dirs)
+    for i, part in enumerate(PARTITIONS):
+        for name in PARAMS:
+            params[name+part] = stats[name][i]
+        if part == '':
+            params['tp'] = peak['tp']
+            params['dpm'] = peak['dpm']
+    return params
+
+
+def partition_table(dap, sites = OFFSHORE_SITES, chunks = None, agefac = 1.7):
+    """
+    The partitioned offshore feature table of a forecast cycle in one call
+
+    Parameters
+    ----------
+    dap : string or list
+        WW3 spectral file(s), path, url or glob, see SWAN_toolbox.open_spectra
+    sites : dictionary, optional
+        feature suffix: WW3 station. The default is OFFSHORE_SITES.
+    chunks : dictionary, optional
+        Open lazily with dask chunks. The default is None.
+    agefac : float, optional
+        Wave age factor. The default is 1.7.
+
+    Returns
+    -------
+    table : dataframe
+        Indexed by time, with <param><partition>_<suffix> columns (hs_a,
+        tp_a, hs_sa_b, dm_sw_c ...) in the order of offshorePartitions_23.csv
+
+    """
+    import SWAN_toolbox
+
+    spec = SWAN_toolbox.open_spectra(dap, station = list(sites.values()), chunks = chunks)
+    spec = spec.load()
+    params = partition_params(spec, agefac)
+    spec.close()
+
+    order = ['hs', 'hmax', 'tp', 'tm01', 'tm02', 'dpm', 'dm', 'dspr']
+    order += [name+part for part in PARTITIONS[1:] for name in PARAMS]
+    columns = {}
+    for j, suffix in enumerate(sites):
+        for name in order:
+            columns[name+'_'+suffix] = params[name][:, j]
+    return pd.DataFrame(columns, index = pd.DatetimeIndex(spec.indexes['time'], name = 'time'))
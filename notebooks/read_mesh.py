@@ -6,37 +6,141 @@ Created on Wed Oct  9 15:01:46 2019
 
 Excerpt from AdcricPy
 """
+import os
+import json
+from itertools import islice
+
 import numpy as np
 import matplotlib.pyplot as plt
 
+import npz_cache
+
+#keys of the parsed fort14 dictionary that hold boundary definitions
+BOUNDARY_KEYS = ['OceanBoundaries', 'LandBoundaries', 'InnerBoundaries',
+                 'InflowBoundaries', 'OutflowBoundaries', 'WeirBoundaries',
+                 'CulvertBoundaries']
+
 class Mesh():
-    def __init__(self, fort14):
-        fort14 = self.parse_fort14(fort14)
+    def __init__(self, fort14, cache = None, cache_path = None):
+        fort14 = self.load_fort14(fort14, cache = cache, cache_path = cache_path)
 
         self.x = np.asarray(fort14.pop('x'))
         self.y = np.asarray(fort14.pop('y'))
         self.xy = np.vstack([self.x, self.y]).T
         self.z = np.asarray(fort14.pop('z'))
         self.elements = np.asarray(fort14.pop('elements'))
+        self._triangulation = None
+        self._index = None
+
+    @property
+    def triangulation(self):
+        """matplotlib Triangulation of the mesh, built once and reused by every plot"""
+        if self._triangulation is None:
+            import matplotlib.tri as mtri
+
+            self._triangulation = mtri.Triangulation(self.x, self.y, self.elements)
+        return self._triangulation
+
+    @property
+    def index(self):
+        """KD-tree and element locator for point queries (mesh_index.MeshIndex), built once"""
+        if self._index is None:
+            import mesh_index
+
+            self._index = mesh_index.MeshIndex.from_mesh(self)
+        return self._index
+
+    def load_fort14(self, path, cache = None, cache_path = None):
+        """
+        Read in fort14 mesh file, using an on-disk binary cache when available
+
+        Parameters
+        ----------
+        path : string
+            Path to the fort.14 mesh file
+        cache : bool, optional
+            Read from and write to the binary cache. The default is
+            npz_cache.CACHE.
+        cache_path : string, optional
+            Location of the .npz cache. The default is the mesh path + '.npz',
+            or a file in npz_cache.CACHE_DIR for a read only mesh directory.
+
+        Returns
+        -------
+        fort14 : dictionary
+            The parsed mesh, as returned by parse_fort14
+
+        """
+        if not npz_cache.enabled(cache):
+            return self.parse_fort14(path)
+
+        if cache_path is None:
+            cache_path = npz_cache.cache_path(path)
+        stat = os.stat(path)
+        key = np.array([stat.st_mtime_ns, stat.st_size], dtype = np.int64)
+
+        if os.path.isfile(cache_path):
+            try:
+                with np.load(cache_path, allow_pickle = False) as cached:
+                    if np.array_equal(cached['key'], key):
+                        return self._from_cache(cached)
+            except (OSError, ValueError, KeyError):
+                #corrupt or outdated cache, fall through and rebuild it
+                pass
+
+        fort14 = self.parse_fort14(path)
+        try:
+            self._to_cache(fort14, cache_path, key)
+        except OSError:
+            #unwritable cache location, the cache is an optimisation only
+            pass
+        return fort14
+
+    @staticmethod
+    def _to_cache(fort14, cache_path, key):
+        """Write the parsed mesh arrays to an uncompressed .npz file"""
+        boundaries = {k: fort14[k] for k in BOUNDARY_KEYS}
+        tmp_path = cache_path + '.tmp'
+        os.makedirs(os.path.dirname(cache_path), exist_ok = True)
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, key = key,
+                         x = fort14['x'], y = fort14['y'], z = fort14['z'],
+                         node_id = fort14['node_id'],
+                         elements = fort14['elements'],
+                         element_id = fort14['element_id'],
+                         description = np.array(fort14['description']),
+                         boundaries = np.array(json.dumps(boundaries)))
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _from_cache(cached):
+        """Rebuild the fort14 dictionary from an open .npz cache"""
+        fort14 = dict()
+        for k in ['x', 'y', 'z', 'node_id', 'elements', 'element_id']:
+            fort14[k] = cached[k]
+        fort14['description'] = str(cached['description'])
+        fort14.update(json.loads(str(cached['boundaries'])))
+        return fort14
 
     def plot_mesh(self):
         fig = plt.figure()
         axes = fig.add_subplot(1,1,1)
-        axes.tricontourf(self.x, self.y, self.elements, self.z)
+        axes.tricontourf(self.triangulation, self.z)
 
         return axes
 
     def parse_fort14(self, path):
         """
         Read in fort14 mesh file
+
+        Nodes are returned as float64 arrays and the element connectivity as
+        an (NE, 3) int32 array of zero based node indexes.
         """
         fort14 = dict()
-        fort14['x'] = list()
-        fort14['y'] = list()
-        fort14['z'] = list()
-        fort14['node_id'] = list()
-        fort14['elements'] = list()
-        fort14['element_id'] = list()
         # fort14['numberOfConnectedElements'] = list()
         fort14['OceanBoundaries'] = list()
         fort14['LandBoundaries'] = list()
@@ -48,25 +152,28 @@ class Mesh():
         with open(path, 'r') as f:
             fort14['description'] = "{}".format(f.readline())
             NE, NP = map(int, f.readline().split())
-            _NP = len([])
-            while _NP < NP:
-                node_id, x, y, z = f.readline().split()
-                fort14['node_id'].append(int(node_id)-1)
-                fort14['x'].append(float(x))
-                fort14['y'].append(float(y))
-                fort14['z'].append(-float(z))
-                _NP += 1
-            _NE = len([])
-            while _NE < NE:
-                line = f.readline().split()
-                fort14['element_id'].append(float(line[0]))
-                # fort14['numberOfConnectedElements'].append(int(line[1]))
-                if int(line[1]) != 3:
-                    raise NotImplementedError('Package only supports '
-                                              + 'triangular meshes for the '
-                                              + 'time being.')
-                fort14['elements'].append([int(x)-1 for x in line[2:]])
-                _NE += 1
+            #node and element tables are parsed in a single numpy pass each
+            nodes = np.array(''.join(islice(f, NP)).split(), dtype = np.float64)
+            if nodes.size != NP * 4:
+                raise ValueError('Node table in fort.14 is malformed.')
+            nodes = nodes.reshape(NP, 4)
+            fort14['node_id'] = nodes[:, 0].astype(np.int32) - 1
+            fort14['x'] = nodes[:, 1].copy()
+            fort14['y'] = nodes[:, 2].copy()
+            fort14['z'] = -nodes[:, 3]
+            elements = ''.join(islice(f, NE)).split()
+            if len(elements) != NE * 5:
+                raise NotImplementedError('Package only supports '
+                                          + 'triangular meshes for the '
+                                          + 'time being.')
+            elements = np.array(elements, dtype = np.float64).reshape(NE, 5)
+            # fort14['numberOfConnectedElements'] = elements[:, 1]
+            if np.any(elements[:, 1] != 3):
+                raise NotImplementedError('Package only supports '
+                                          + 'triangular meshes for the '
+                                          + 'time being.')
+            fort14['element_id'] = elements[:, 0]
+            fort14['elements'] = elements[:, 2:].astype(np.int32) - 1
             # Assume EOF if NBOU is empty.
             try:
                 NOPE = int(f.readline().split()[0])
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Online skill scores for continuous verification against buoy observations.
+
+SkillAccumulator keeps the sufficient statistics of cal_stats.calc_stats
+(count, means, co-moments) and updates them one reading or batch at a time
+with Chan et al's parallel formulas, so accumulators from several workers
+can be merged. The Index of Agreement needs the final observation mean in
+every term of its denominator, so no fixed set of moments gives it; the
+readings are kept for it, which RollingSkill bounds to its window. With
+direction = True the accumulator also keeps circular sums for direction
+forecasts. RollingSkill keeps one accumulator per time bucket to report
+skill over a rolling window.
+"""
+
+import collections
+
+import numpy as np
+import pandas as pd
+
+import cal_stats
+from circular import wrap
+
+
+_MOMENTS = ['n', 'mean_s', 'mean_o', 'm2_s', 'm2_o', 'c']
+
+#sums kept for direction: sin/cos of s, o, their products and the wrapped error
+_CIRCULAR = ['ss', 'cs', 'so', 'co', 'ss_so', 'ss_co', 'cs_so', 'cs_co',
+             'ss2', 'so2', 'ss_cs', 'so_co', 'sin_d', 'cos_d', 'd2', 'abs_d']
+
+
+class SkillAccumulator():
+    """
+    Mergeable running skill statistics for arrays of series (e.g. sites)
+
+    The Index of Agreement denominator sums absolute deviations about the
+    final observation mean, which no fixed set of moments can re-centre, so
+    with agreement = True the readings are kept and it is computed exactly
+    from them when a result is asked for. With agreement = False memory
+    stays constant and it is NaN.
+    """
+
+    def __init__(self, shape = (), direction = False, agreement = True):
+        self.shape = tuple(shape)
+        self.direction = direction
+        for name in _MOMENTS:
+            setattr(self, name, np.zeros(self.shape))
+        self.circular = {k: np.zeros(self.shape) for k in _CIRCULAR} if direction else None
+        #(s, o) batches of readings, for the Index of Agreement
+        self.readings = [] if agreement else None
+
+    def update(self, s, o):
+        """
+        Add readings
+
+        Parameters
+        ----------
+        s : Ndarray or float
+            Simulations, of shape self.shape for one reading or
+            self.shape + (k,) for a batch of k readings
+        o : Ndarray or float
+            Observations, same shape as s. NaN pairs are skipped.
+
+        """
+        s = np.asarray(s, dtype = np.float64)
+        o = np.asarray(o, dtype = np.float64)
+        if s.shape == self.shape:
+            s, o = s[..., None], o[..., None]
+        m = cal_stats.stat_moments(s, o, axis = -1)
+        n = m['n'].astype(np.float64)
+        batch = SkillAccumulator(self.shape, agreement = False)
+        with np.errstate(invalid = 'ignore'):
+            batch.n = n
+            batch.mean_s = np.nan_to_num(m['mean_s'])
+            batch.mean_o = np.nan_to_num(m['mean_o'])
+            batch.m2_s = np.nan_to_num(m['var_s'] * n)
+            batch.m2_o = np.nan_to_num(m['var_o'] * n)
+            batch.c = np.nan_to_num(m['cov'] * n)
+        self._merge_moments(batch)
+        if self.readings is not None:
+            self.readings.append((s.copy(), o.copy()))
+        if self.direction:
+            self._update_circular(s, o)
+        return self
+
+    def _update_circular(self, s, o):
+        valid = ~(np.isnan(s) | np.isnan(o))
+        rs, ro = np.deg2rad(np.where(valid, s, 0.)), np.deg2rad(np.where(valid, o, 0.))
+        d = np.deg2rad(wrap(np.where(valid, s - o, 0.)))
+        ss, cs, so, co = np.sin(rs), np.cos(rs), np.sin(ro), np.cos(ro)
+        terms = {'ss': ss, 'cs': cs, 'so': so, 'co': co,
+                 'ss_so': ss * so, 'ss_co': ss * co, 'cs_so': cs * so, 'cs_co': cs * co,
+                 'ss2': ss * ss, 'so2': so * so, 'ss_cs': ss * cs, 'so_co': so * co,
+                 'sin_d': np.sin(d), 'cos_d': np.cos(d), 'd2': d * d, 'abs_d': np.abs(d)}
+        for k, v in terms.items():
+            self.circular[k] += np.where(valid, v, 0.).sum(axis = -1)
+
+    def _merge_moments(self, other):
+        n = self.n + other.n
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            ws = np.where(n > 0, other.n / n, 0.)
+            ds = other.mean_s - self.mean_s
+            do = other.mean_o - self.mean_o
+            cross = self.n * ws
+            self.m2_s = self.m2_s + other.m2_s + ds * ds * cross
+            self.m2_o = self.m2_o + other.m2_o + do * do * cross
+            self.c = self.c + other.c + ds * do * cross
+        self.mean_s = self.mean_s + ds * ws
+        self.mean_o = self.mean_o + do * ws
+        self.n = n
+
+    def merge(self, other):
+        """Combine another accumulator (e.g. from another worker) into this one"""
+        self._merge_moments(other)
+        if self.readings is not None:
+            if other.readings is None:
+                #the merged readings are incomplete
+                self.readings = None
+            else:
+                self.readings.extend(other.readings)
+        if self.direction and other.direction:
+            for k in _CIRCULAR:
+                self.circular[k] += other.circular[k]
+        return self
+
+    def copy(self):
+        new = SkillAccumulator(self.shape, self.direction, self.readings is not None)
+        return new.merge(self)
+
+    def result(self):
+        """
+        Skill over everything accumulated
+
+        Returns
+        -------
+        mystats : dictionary
+            The cal_stats.calc_stats suite (Index of Agreement NaN when the
+            readings are not kept), plus
+            circular bias, RMSE, absolute difference and correlation when
+            accumulating directions
+
+        """
+        n = self.n
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            var_s, var_o, cov = self.m2_s / n, self.m2_o / n, self.c / n
+            bias = self.mean_s - self.mean_o
+            var_d = var_s + var_o - 2 * cov
+            mse = var_d + bias ** 2
+            r = cov / np.sqrt(var_s * var_o)
+            mystats = {'Bias': bias,
+                       'Root Mean Squared Error': np.sqrt(mse),
+                       'Scatter Index': 100 * np.sqrt(var_d) / self.mean_o,
+                       'Coefficient of Determination': r ** 2,
+                       'Coefficient of Efficiency': 1 - mse / var_o,
+                       'Correlation Coefficient': r,
+                       'Index of Agreement': 1 - mse / self._agreement(),
+                       'n': n}
+            if self.direction:
+                mystats.update(self._circular_result())
+        return mystats
+
+    def _agreement(self):
+        """Mean of (|s - mean_o| + |o - mean_o|)**2 over the kept readings"""
+        if self.readings is None or not self.readings:
+            return np.full(self.shape, np.nan)
+        #joined once, later results start from the joined arrays
+        self.readings = [(np.concatenate([s for s, _ in self.readings], axis = -1),
+                          np.concatenate([o for _, o in self.readings], axis = -1))]
+        return cal_stats.stat_moments(*self.readings[0], axis = -1)['agree']
+
+    def _circular_result(self):
+        c = self.circular
+        n = self.n
+        #circular means of s and o
+        ms = np.arctan2(c['ss'], c['cs'])
+        mo = np.arctan2(c['so'], c['co'])
+        sms, cms, smo, cmo = np.sin(ms), np.cos(ms), np.sin(mo), np.cos(mo)
+        #sum sin(s - ms) sin(o - mo), expanded in the accumulated products
+        num = (c['ss_so'] * cms * cmo - c['ss_co'] * cms * smo
+               - c['cs_so'] * sms * cmo + c['cs_co'] * sms * smo)
+        cs2, co2 = n - c['ss2'], n - c['so2']
+        den_s = c['ss2'] * cms ** 2 - 2 * c['ss_cs'] * sms * cms + cs2 * sms ** 2
+        den_o = c['so2'] * cmo ** 2 - 2 * c['so_co'] * smo * cmo + co2 * smo ** 2
+        return {'Circular Bias': np.where(n > 0, np.rad2deg(np.arctan2(c['sin_d'], c['cos_d'])), np.nan),
+                'Circular RMSE': np.rad2deg(np.sqrt(c['d2'] / n)),
+                'Absolute Difference': np.rad2deg(c['abs_d'] / n),
+                'Circular Correlation': num / np.sqrt(den_s * den_o)}
+
+
+class RollingSkill():
+    """
+    Skill over a rolling time window, from one accumulator per time bucket
+
+    Updates touch a single bucket; a result merges the buckets in the
+    window, so its cost depends on window / bucket, not on the readings.
+    With agreement = True the buckets keep their readings for the Index of
+    Agreement, so memory is bounded by the readings in the window.
+    """
+
+    def __init__(self, window = '30D', bucket = '1h', shape = (), direction = False, agreement = True):
+        self.window = pd.Timedelta(window)
+        self.bucket = pd.Timedelta(bucket)
+        self.shape = tuple(shape)
+        self.direction = direction
+        self.agreement = agreement
+        self.buckets = collections.OrderedDict()
+
+    def update(self, time, s, o):
+        """Add readings valid at time (a single timestamp for the batch)"""
+        key = pd.Timestamp(time).floor(self.bucket)
+        acc = self.buckets.get(key)
+        if acc is None:
+            last = next(reversed(self.buckets)) if self.buckets else None
+            acc = SkillAccumulator(self.shape, self.direction, self.agreement)
+            self.buckets[key] = acc
+            #a late reading, keep the buckets in time order for _evict
+            if last is not None and key < last:
+                self.buckets = collections.OrderedDict(sorted(self.buckets.items()))
+        acc.update(s, o)
+        self._evict(max(self.buckets))
+        return self
+
+    def _evict(self, latest):
+        start = latest - self.window
+        while self.buckets and next(iter(self.buckets)) <= start:
+            self.buckets.popitem(last = False)
+
+    def result(self, end = None):
+        """Skill over the window ending at end (default: the latest bucket)"""
+        if not self.buckets:
+            return SkillAccumulator(self.shape, self.direction, self.agreement).result()
+        end = max(self.buckets) if end is None else pd.Timestamp(end).floor(self.bucket)
+        total = SkillAccumulator(self.shape, self.direction, self.agreement)
+        for key, acc in self.buckets.items():
+            if end - self.window < key <= end:
+                total.merge(acc)
+        return total.result()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for skill_online
+"""
+
+import numpy as np
+import pandas as pd
+
+import cal_stats
+import skill_online
+
+
+def test_rolling_out_of_order_reading():
+    rolling = skill_online.RollingSkill(window = '3h', bucket = '1h')
+    for hour in (5, 1, 6):
+        rolling.update(pd.Timestamp('2021-06-20') + pd.Timedelta(hours = hour), 1., 1.)
+    keys = list(rolling.buckets)
+    assert keys == sorted(keys)
+    #01:00 is outside the window ending 06:00 and is evicted
+    assert keys == [pd.Timestamp('2021-06-20 05:00'), pd.Timestamp('2021-06-20 06:00')]
+
+
+def test_streamed_matches_batch():
+    rng = np.random.default_rng(0)
+    o = rng.gamma(2., 0.5, 500)
+    s = o + rng.normal(0, 0.2, 500)
+    acc = skill_online.SkillAccumulator()
+    for si, oi in zip(s, o):
+        acc.update(si, oi)
+    streamed = acc.result()
+    batch = cal_stats.calc_stats(s, o)
+    for name in ['Bias', 'Root Mean Squared Error', 'Correlation Coefficient', 'Coefficient of Efficiency',
+                 'Index of Agreement']:
+        assert np.isclose(streamed[name], batch[name])
+    assert np.isnan(skill_online.SkillAccumulator(agreement = False).update(s, o).result()['Index of Agreement'])
+
+
+def test_merged_and_rolling_agreement_match_batch():
+    rng = np.random.default_rng(1)
+    o = rng.gamma(2., 0.5, (3, 48))
+    s = o + rng.normal(0.1, 0.3, (3, 48))
+    s[0, :5] = np.nan
+    workers = [skill_online.SkillAccumulator((3,)).update(s[:, i::2], o[:, i::2]) for i in range(2)]
+    merged = workers[0].merge(workers[1]).result()
+    assert np.allclose(merged['Index of Agreement'], cal_stats.calc_stats(s, o)['Index of Agreement'])
+
+    rolling = skill_online.RollingSkill(window = '12h', bucket = '1h', shape = (3,))
+    times = pd.date_range('2021-06-20', periods = 48, freq = 'h')
+    for i, t in enumerate(times):
+        rolling.update(t, s[:, i], o[:, i])
+    batch = cal_stats.calc_stats(s[:, -12:], o[:, -12:])
+    assert np.allclose(rolling.result()['Index of Agreement'], batch['Index of Agreement'])
+    assert np.allclose(rolling.result()['Root Mean Squared Error'], batch['Root Mean Squared Error'])
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for SWAN_runner, running the stub in place of SWAN
+"""
+
+import os
+
+import SWAN_archive
+import SWAN_runner
+
+
+def _run_dir(root, run):
+    """A run directory with the output sections SWAN_config_params writes"""
+    os.makedirs(os.path.join(root, run, 'inputs', 'PointFiles'))
+    with open(os.path.join(root, run, SWAN_runner.POINTS_INPUT), 'w') as f:
+        f.write("153.50 -28.00 $ Tweed\n153.45 -27.95 $ GoldCoast\n")
+    with open(os.path.join(root, run, 'swan_mod_'+run+'.swn'), 'w') as f:
+        f.write("POINTS 'OutPts' FILE './"+run+"/inputs/PointFiles/gc_OutPts.txt' & \n \n"
+                "TABLE 'OutPts' HEAD './"+run+"/results/gc_OutPtsIP.tbl' & \n"
+                "TIME HSign HSWELL TPS TM02 DIR PDIR WATLev OUTput "+run.replace('_', '.')+"00 1 HR\n")
+
+
+def test_run_jobs_done_retried_failed(tmp_path):
+    root = str(tmp_path / 'runs')
+    runs = ['20230727_0000', '20230727_0600', '20230727_1200']
+    for run in runs:
+        _run_dir(root, run)
+    open(os.path.join(root, runs[1], 'STUB_FAIL_ONCE'), 'w').close()
+    open(os.path.join(root, runs[2], 'STUB_FAIL'), 'w').close()
+    stub = SWAN_runner.write_stub(str(tmp_path / 'stub_swan.py'))
+    dbpath = str(tmp_path / 'jobs.db')
+    archive = str(tmp_path / 'archive')
+
+    counts = SWAN_runner.run_jobs(runs, executable = stub, dbpath = dbpath, root = root, workers = 2,
+                                  archive_path = archive, retries = 1)
+    assert counts == {'done': 2, 'failed': 1}
+
+    queue = SWAN_runner.JobQueue(dbpath)
+    status = queue.status()
+    queue.close()
+    assert status.loc[runs[0], ['state', 'attempts', 'rows']].tolist() == ['done', 1, 98]
+    assert status.loc[runs[1], ['state', 'attempts']].tolist() == ['done', 2]
+    assert status.loc[runs[2], ['state', 'attempts']].tolist() == ['failed', 2]
+    assert 'stub failure' in status.loc[runs[2], 'error']
+
+    #each run wrote into its own directory
+    for run in runs[:2]:
+        assert os.path.isfile(os.path.join(root, run, SWAN_runner.TABLE_OUTPUT))
+    assert not os.path.exists(os.path.join(root, 'results'))
+
+    stored = SWAN_archive.query(archive)
+    assert sorted(stored['run'].unique()) == runs[:2]
+    assert len(stored) == 2 * 98
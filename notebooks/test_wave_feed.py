@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for toolBOX.sync_latest_obs against local_wave_feed
+"""
+
+import pandas as pd
+
+import toolBOX
+from local_wave_feed import LocalWaveFeed
+
+
+def _records(site, start, hours):
+    times = pd.date_range(start, periods = hours, freq = 'h')
+    return [{'Site': site, 'DateTime': t.strftime('%Y-%m-%dT%H:%M:%S'), 'Hsig': '1.5', 'Tz': '6.0'}
+            for t in times]
+
+
+def test_sync_stores_sqlite_times(tmp_path):
+    dbpath = str(tmp_path / 'wave_obs.db')
+    with LocalWaveFeed(_records('A', '2023-07-27 00:00', 10)) as feed:
+        toolBOX.sync_latest_obs(dbpath, url = feed.url, page_size = 4)
+    try:
+        assert len(toolBOX.query_waveDB(dbpath, start = '2023-07-27 05:00', end = '2023-07-27 07:00')) == 3
+        assert len(toolBOX.query_waveDB(dbpath, end = '2023-07-27 03:00')) == 4
+    finally:
+        toolBOX.close_waveDB(dbpath)
+
+
+def test_sync_pages_back_for_new_site(tmp_path):
+    dbpath = str(tmp_path / 'wave_obs.db')
+    records = _records('A', '2023-07-27 00:00', 10) + _records('B', '2023-07-27 00:00', 10)
+    with LocalWaveFeed(records) as feed:
+        toolBOX.sync_latest_obs(dbpath, url = feed.url, page_size = 5)
+        #a new site, with one record on the first page and one on a page the known sites do not reach
+        feed.add_records(_records('A', '2023-07-27 10:00', 1) + _records('B', '2023-07-27 10:00', 1)
+                         + _records('C', '2023-07-27 10:00', 1) + _records('C', '2023-07-27 05:00', 1))
+        new = toolBOX.sync_latest_obs(dbpath, url = feed.url, page_size = 5)
+        again = toolBOX.sync_latest_obs(dbpath, url = feed.url, page_size = 5)
+    try:
+        assert new.groupby('Site').size().to_dict() == {'A': 1, 'B': 1, 'C': 2}
+        assert len(again) == 0
+        stored = toolBOX.query_waveDB(dbpath)
+        assert stored.groupby('Site').size().to_dict() == {'A': 11, 'B': 11, 'C': 2}
+    finally:
+        toolBOX.close_waveDB(dbpath)
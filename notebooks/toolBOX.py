@@ -18,34 +18,269 @@ def convDirection(series):
     return np.sin(rads), np.cos(rads)
 
 
-def get_latest_obs():
+QLD_WAVE_RESOURCE = "2bbef99e-9974-49b9-a316-57402b00609c"
+QLD_DATASTORE_URL = "https://www.data.qld.gov.au/api/3/action/datastore_search"
+
+#typed columns of the QLD wave feed, as stored in the wave_obs table
+OBS_DTYPES = {'DateTime': str, 'Site': str, 'SiteNumber': float, 'Seconds': float,
+              'Latitude': float, 'Longitude': float, 'Hsig': float, 'Hmax': float,
+              'Tp': float, 'Tz': float, 'SST': float, 'Direction': float,
+              'CurrentSpeed': float, 'CurrentDirection': float}
+
+#DateTime format of the wave_obs table
+OBS_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_SESSION = None
+
+def _get_session():
+    """Shared requests session, so the connection is reused between calls"""
+    global _SESSION
     import requests
 
-    path = "https://www.data.qld.gov.au/datastore/dump/2bbef99e-9974-49b9-a316-57402b00609c?format=json"
+    if _SESSION is None:
+        _SESSION = requests.Session()
+    return _SESSION
+
+def get_latest_obs():
+    path = "https://www.data.qld.gov.au/datastore/dump/"+QLD_WAVE_RESOURCE+"?format=json"
     #extract data from the opendata data portal
-    s = requests.session()
-    r = requests.get(path).json()
+    r = _get_session().get(path).json()
 
     fields = [f['id'] for f in r['fields']]
     data = pd.DataFrame(r['records'], columns = fields)
-    s.close()
 
     #append to database
     data.index = pd.to_datetime(data.DateTime)
-    data = data.drop('DateTime', 1)
+    data = data.drop(columns = 'DateTime')
+    return data
+
+def parse_obs_records(records):
+    """Convert feed records (list of dicts) to a typed observation dataframe"""
+
+    data = pd.DataFrame.from_records(records)
+    data.columns = data.columns.str.replace(' ', '')
+    data = data[[c for c in OBS_DTYPES if c in data.columns]]
+    for col in data.columns:
+        if OBS_DTYPES[col] is float:
+            data[col] = pd.to_numeric(data[col], errors = 'coerce').astype(np.float64)
+        else:
+            data[col] = data[col].astype(str)
+    if 'DateTime' in data.columns:
+        #the feed sends ISO 'T' separated times, stored as the sqlite DATETIME format query_waveDB compares against
+        data['DateTime'] = pd.to_datetime(data['DateTime']).dt.strftime(OBS_TIME_FORMAT)
     return data
 
-def get_waveDB_xday_obs(dbpath = 'F:/SWAN/wave_obs.db', days = 7):
+def _sync_state(conn, key, value = None):
+    """Read, or write when a value is given, a key of the sync state table"""
+    conn.execute("CREATE TABLE IF NOT EXISTS wave_obs_sync (key TEXT PRIMARY KEY, value TEXT)")
+    if value is None:
+        row = conn.execute("SELECT value FROM wave_obs_sync WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+    conn.execute("INSERT OR REPLACE INTO wave_obs_sync (key, value) VALUES (?, ?)", (key, value))
+
+def sync_latest_obs(dbpath = 'F:/SWAN/wave_obs.db', url = QLD_DATASTORE_URL,
+                    resource_id = QLD_WAVE_RESOURCE, page_size = 1000):
+    """
+    Incrementally ingest the QLD wave feed into the wave_obs table
+
+    Records are paged newest first from the CKAN datastore_search endpoint
+    until the last ingested timestamp of every site is reached, and only
+    records newer than their site's last timestamp are inserted. A site not
+    yet in the table is ingested in full, paging back to the feed's oldest
+    record. The first page is a conditional request, so an unchanged feed
+    costs one 304.
+
+    Parameters
+    ----------
+    dbpath : string, optional
+        Path to the sqlite database. The default is 'F:/SWAN/wave_obs.db'.
+    url : string, optional
+        datastore_search endpoint. The default is QLD_DATASTORE_URL.
+    resource_id : string, optional
+        Datastore resource of the wave feed. The default is QLD_WAVE_RESOURCE.
+    page_size : int, optional
+        Records requested per page. The default is 1000.
+
+    Returns
+    -------
+    new : dataframe
+        The records inserted, indexed by DateTime
+
+    """
+
+    conn = get_waveDB_connection(dbpath)
+    table_exists = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='wave_obs'").fetchone()
+    if table_exists:
+        #compared as times, rows stored by older versions may be 'T' separated
+        last = pd.read_sql_query("SELECT Site, DATETIME(MAX(JULIANDAY(DateTime))) AS last FROM wave_obs "
+                                 "GROUP BY Site", conn)
+        last = pd.Series(pd.to_datetime(last['last']).values, index = last['Site'])
+    else:
+        last = pd.Series(dtype = 'datetime64[ns]')
+
+    session = _get_session()
+    headers = {}
+    etag = _sync_state(conn, url+'|etag')
+    if etag is not None:
+        headers['If-None-Match'] = etag
+
+    pages = []
+    offset = 0
+    unknown = False
+    while True:
+        r = session.get(url, params = {'resource_id': resource_id, 'sort': 'DateTime desc',
+                                       'limit': page_size, 'offset': offset},
+                        headers = headers if offset == 0 else {})
+        if r.status_code == 304:
+            break
+        r.raise_for_status()
+        if offset == 0 and r.headers.get('ETag'):
+            etag = r.headers['ETag']
+        records = r.json()['result']['records']
+        if not records:
+            break
+        page = parse_obs_records(records)
+        pages.append(page)
+        oldest = pd.to_datetime(page['DateTime']).min()
+        #a new site has no last timestamp, its records are read to the end of the feed
+        unknown = unknown or not set(page['Site']) <= set(last.index)
+        if len(records) < page_size or (not unknown and oldest <= last.min()):
+            break
+        offset += page_size
+
+    if not pages:
+        return parse_obs_records([]).set_index(pd.DatetimeIndex([], name = 'DateTime'))
+
+    new = pd.concat(pages, ignore_index = True)
+    times = pd.to_datetime(new['DateTime'])
+    site_last = last.reindex(new['Site']).values
+    new = new[pd.isna(site_last) | (times.values > site_last)]
+    new = new.drop_duplicates(subset = ['Site', 'DateTime']).sort_values('DateTime')
+
+    if table_exists:
+        table_cols = [row[1] for row in conn.execute("PRAGMA table_info(wave_obs)")]
+        new = new[[c for c in new.columns if c in table_cols]]
+    new.to_sql('wave_obs', conn, if_exists = 'append', index = False)
+    if etag is not None:
+        _sync_state(conn, url+'|etag', etag)
+    conn.commit()
+    if not table_exists:
+        _ensure_obs_index(conn)
+
+    new.index = pd.to_datetime(new.DateTime)
+    return new
+
+#open sqlite connections, keyed on database path
+_DB_CONNECTIONS = {}
+
+#observation columns averaged when hourly aggregation is pushed into sqlite
+HOURLY_COLUMNS = ['Hsig', 'Hmax', 'Tp', 'Tz', 'SST', 'Direction']
+
+def get_waveDB_connection(dbpath = 'F:/SWAN/wave_obs.db'):
+    """Pooled connection to the wave observation database
+
+    The (Site, DateTime) index used by query_waveDB is created on first use.
+    """
     import sqlite3
-    wb_db = dbpath
-    conn = sqlite3.connect(wb_db)
-    wb_data = pd.read_sql_query("SELECT * FROM wave_obs WHERE DateTime > (SELECT DATETIME('now', '-"+str(days)+" day'))", conn)
-    conn.close()
-    
-    wb_data.index = pd.to_datetime(wb_data.DateTime)
-    wb_data = wb_data.sort_index()
-    
-    return wb_data
+
+    conn = _DB_CONNECTIONS.get(dbpath)
+    if conn is None:
+        conn = sqlite3.connect(dbpath, check_same_thread = False)
+        _ensure_obs_index(conn)
+        _DB_CONNECTIONS[dbpath] = conn
+    return conn
+
+def _ensure_obs_index(conn):
+    """Create the (Site, DateTime) index if the wave_obs table exists"""
+    if conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='wave_obs'").fetchone():
+        conn.execute("CREATE INDEX IF NOT EXISTS wave_obs_site_datetime ON wave_obs (Site, DateTime)")
+        conn.commit()
+
+def close_waveDB(dbpath = None):
+    """Close pooled database connections, all of them if no path is given"""
+    for path in [dbpath] if dbpath is not None else list(_DB_CONNECTIONS):
+        conn = _DB_CONNECTIONS.pop(path, None)
+        if conn is not None:
+            conn.close()
+
+def _obs_frame(data):
+    data.index = pd.to_datetime(data.DateTime)
+    return data.sort_index()
+
+def query_waveDB(dbpath = 'F:/SWAN/wave_obs.db', sites = None, columns = None, start = None,
+                 end = None, days = None, hourly = False, min_hsig = None, chunksize = None):
+    """
+    Query the wave observation database, filtering and aggregating in sqlite
+
+    Parameters
+    ----------
+    dbpath : string, optional
+        Path to the sqlite database. The default is 'F:/SWAN/wave_obs.db'.
+    sites : string or list, optional
+        Site names to return, e.g. 'Tweed Heads Mk4'. The default is all sites.
+    columns : list, optional
+        Columns to return, DateTime and Site are always included.
+        The default is all columns, or HOURLY_COLUMNS when hourly.
+    start, end : string or datetime, optional
+        DateTime bounds (inclusive). The default is no bound.
+    days : int, optional
+        Return only the last number of days, as get_waveDB_xday_obs.
+    hourly : bool, optional
+        Average each site to hourly values in sqlite. The default is False.
+    min_hsig : float, optional
+        Drop records with Hsig at or below this value (missing data flags).
+    chunksize : int, optional
+        Return a generator of dataframes of this many rows. The default is None.
+
+    Returns
+    -------
+    data : dataframe or generator of dataframes
+        Observations indexed by DateTime
+
+    """
+
+    where = []
+    params = []
+    if sites is not None:
+        sites = [sites] if isinstance(sites, str) else list(sites)
+        where.append("Site IN (" + ",".join("?" * len(sites)) + ")")
+        params.extend(sites)
+    if days is not None:
+        where.append("DateTime > (SELECT DATETIME('now', ?))")
+        params.append('-'+str(int(days))+' day')
+    if start is not None:
+        where.append("DateTime >= ?")
+        params.append(pd.Timestamp(start).strftime("%Y-%m-%d %H:%M:%S"))
+    if end is not None:
+        where.append("DateTime <= ?")
+        params.append(pd.Timestamp(end).strftime("%Y-%m-%d %H:%M:%S"))
+    if min_hsig is not None:
+        where.append("Hsig > ?")
+        params.append(min_hsig)
+    where = (" WHERE " + " AND ".join(where)) if where else ""
+
+    if hourly:
+        columns = HOURLY_COLUMNS if columns is None else columns
+        hour = "strftime('%Y-%m-%d %H:00:00', DateTime)"
+        select = ", ".join('AVG("'+c+'") AS "'+c+'"' for c in columns if c not in ('DateTime', 'Site'))
+        sql = ("SELECT "+hour+" AS DateTime, Site, "+select+" FROM wave_obs"+where
+               +" GROUP BY Site, "+hour+" ORDER BY DateTime")
+    else:
+        if columns is None:
+            select = "*"
+        else:
+            select = ", ".join('"'+c+'"' for c in ['DateTime', 'Site'] + [c for c in columns if c not in ('DateTime', 'Site')])
+        sql = "SELECT "+select+" FROM wave_obs"+where+" ORDER BY DateTime"
+
+    conn = get_waveDB_connection(dbpath)
+    if chunksize is None:
+        return _obs_frame(pd.read_sql_query(sql, conn, params = params))
+    return (_obs_frame(chunk) for chunk in pd.read_sql_query(sql, conn, params = params, chunksize = chunksize))
+
+def get_waveDB_xday_obs(dbpath = 'F:/SWAN/wave_obs.db', days = 7, **kwargs):
+    """All observations from the last number of days, see query_waveDB for filters"""
+
+    return query_waveDB(dbpath, days = days, **kwargs)
 
 def getLocations(df):
     grpby = df.groupby('Site')
@@ -57,29 +292,46 @@ def getLocations(df):
     locations.columns = ['name','lat','lon']
     return locations
 
+def _siteWide(df, params, sites = None):
+    """
+    Scatter observations into a dense (time, site, param) array in one pass
+
+    Only timestamps observed at every site are kept, as the per site merges
+    did. Duplicate (time, site) records keep the first.
+
+    Returns
+    -------
+    times : DatetimeIndex
+        Sorted timestamps observed at every site
+    sites : list
+        Site names, sorted unless given
+    values : Ndarray
+        (time, site, param) float64 array
+
+    """
+
+    if sites is None:
+        sites = sorted(df['Site'].unique())
+    site_codes = pd.Categorical(df['Site'], categories = sites).codes
+    keep = site_codes >= 0
+    time_codes, times = pd.factorize(df.index[keep], sort = True)
+    site_codes = site_codes[keep]
+    obs = df[params].to_numpy(dtype = np.float64)[keep]
+
+    values = np.full((len(times), len(sites), len(params)), np.nan)
+    present = np.zeros((len(times), len(sites)), dtype = bool)
+    #reversed so the first of any duplicate records is written last
+    values[time_codes[::-1], site_codes[::-1]] = obs[::-1]
+    present[time_codes, site_codes] = True
+
+    complete = present.all(axis = 1)
+    return pd.DatetimeIndex(times[complete], name = df.index.name), list(sites), values[complete]
+
 def paramsDFList(df):
     """Refactors data for interactive plotting"""
-    grpby = df.groupby('Site')
-    Hsig = []
-    Tz = []
-    direction = []
-    siteName=  []
-    for name, site in grpby:
-        Hsig.append(site.sort_index()[['Hsig']])
-        Tz.append(site.sort_index()[['Tz']])
-        direction.append(site.sort_index()[['Direction']])
-        siteName.append(name)
-    from functools import reduce
-    HsigDF = reduce(lambda left, right: pd.merge(left, right, left_index = True, right_index = True), Hsig)
-    TzDF = reduce(lambda left, right: pd.merge(left, right, left_index = True, right_index = True), Tz)
-    directionDF = reduce(lambda left, right: pd.merge(left, right, left_index = True, right_index = True), direction)
-    HsigDF.columns = siteName
-    HsigDF.index.rename('datetime')
-    TzDF.columns = siteName
-    TzDF.index.rename('datetime')
-    directionDF.columns = siteName
-    directionDF.index.rename('datetime')
-    return [HsigDF, TzDF,directionDF]
+    params = ['Hsig', 'Tz', 'Direction']
+    times, sites, values = _siteWide(df, params)
+    return [pd.DataFrame(values[:, :, i], index = times, columns = sites) for i in range(len(params))]
 
 def processObs(df, siteList = ['Brisbane Mk4','Tweed Heads Mk4']):
     """
@@ -97,18 +349,15 @@ def processObs(df, siteList = ['Brisbane Mk4','Tweed Heads Mk4']):
 
     """
     
-    dfList = []
-    for site in siteList:
-        sitedf = df[df['Site'] == site][['Hsig','Hmax','Tz','Tp','Direction']]
-        colNames = []
-        for col in sitedf.columns:
-            colNames.append(col+('_'+site[:4]))
-        sitedf.columns = colNames
-        
-        sitedf['dir_sin'+site[:4]], sitedf['dir_cos'+site[:4]] = convDirection(sitedf[colNames[0]])
-        dfList.append(sitedf)
-    from functools import reduce
+    params = ['Hsig','Hmax','Tz','Tp']
+    times, sites, values = _siteWide(df, params + ['Direction'], list(siteList))
+    dir_sin, dir_cos = convDirection(values[:, :, -1])
 
-    data = reduce(lambda left, right: pd.merge(left, right, left_index = True, right_index = True), dfList)
-    data = data[data.columns.drop(list(data.filter(regex='Direction')))]
-    return data
\ No newline at end of file
+    #one block of [params, dir_sin, dir_cos] per site, in siteList order
+    data = np.concatenate([values[:, :, :-1], dir_sin[:, :, None], dir_cos[:, :, None]], axis = 2)
+    columns = []
+    for site in sites:
+        columns.extend([param+'_'+site[:4] for param in params])
+        columns.extend(['dir_sin'+site[:4], 'dir_cos'+site[:4]])
+    data = pd.DataFrame(data.reshape(len(times), -1), index = times, columns = columns)
+    return data
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Lead time verification of the SWAN runs and ML predictions.
+
+The stacked point series of many runs (SWAN_archive.query, or the results
+csv files) are scattered into a dense (run, lead, site, variable) cube,
+keeping every lead time rather than the first 12 hours of each run. The
+observations are gathered onto the cube's valid times in one indexed take,
+and cal_stats / circular metrics are computed for every lead time at once.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import cal_stats
+import circular
+
+#run directory names, as SWAN_archive.RUN_FORMAT
+RUN_FORMAT = "%Y%m%d_%H%M"
+
+#forecast variable: wave_obs column it is verified against
+OBS_MATCH = {'Hsig': 'Hsig', 'Tm02': 'Tz', 'Tp_smoothed': 'Tp', 'Dir': 'Direction',
+             'PkDir': 'Direction'}
+
+#variables verified with circular statistics
+DIRECTIONS = ('Dir', 'PkDir', 'Direction')
+
+
+def _run_times(runs):
+    return pd.to_datetime(pd.Index(runs).astype(str), format = RUN_FORMAT)
+
+
+def _leads(data, run_codes, run_times):
+    if 'lead' in data.columns:
+        return data['lead'].to_numpy(dtype = np.float64)
+    valid = pd.DatetimeIndex(data.index).values
+    return (valid - run_times.values[run_codes]) / np.timedelta64(1, 'h')
+
+
+def _scatter(data, variables, run_column, site_column, max_lead, sites = None):
+    """Factorize runs and sites and scatter values into a (run, lead, site, variable) array"""
+
+    run_codes, runs = pd.factorize(data[run_column], sort = True)
+    run_times = _run_times(runs)
+    if sites is None:
+        site_codes, sites = pd.factorize(data[site_column], sort = True)
+    else:
+        site_codes = pd.Index(sites).get_indexer(data[site_column])
+    leads = np.rint(_leads(data, run_codes, run_times)).astype(np.int64)
+
+    keep = (site_codes >= 0) & (leads >= 0)
+    if max_lead is not None:
+        keep &= leads <= max_lead
+    n_lead = int(leads[keep].max()) + 1 if keep.any() else 0
+    values = np.full((len(runs), n_lead, len(sites), len(variables)), np.nan, dtype = np.float32)
+    values[run_codes[keep], leads[keep], site_codes[keep]] = data[variables].to_numpy(dtype = np.float32)[keep]
+    return runs, run_times, np.arange(n_lead), list(sites), values
+
+
+def _cube(runs, run_times, leads, sites, variables, values):
+    cube = xr.DataArray(values, dims = ('run', 'lead', 'site', 'variable'),
+                        coords = {'run': np.asarray(runs).astype(str), 'lead': leads,
+                                  'site': sites, 'variable': list(variables)})
+    valid = run_times.values[:, None] + leads[None, :].astype('timedelta64[h]')
+    return cube.assign_coords(run_time = ('run', run_times.values), time = (('run', 'lead'), valid))
+
+
+def build_cube(data, variables = ('Hsig', 'Tm02', 'Dir', 'Tp_smoothed'), run_column = 'run',
+               site_column = 'site', max_lead = None):
+    """
+    Scatter stacked SWAN point series into a dense verification cube
+
+
+    Parameters
+    ----------
+    data : DataFrame
+        Stacked point series indexed by valid time with a run column in the
+        "%Y%m%d_%H%M" format, as returned by SWAN_archive.query or read from
+        the stacked results csv files. A lead column (hours) is used if present.
+    variables : tuple, optional
+        Columns to include. The default is ('Hsig', 'Tm02', 'Dir', 'Tp_smoothed').
+    run_column : string, optional
+        The default is 'run'.
+    site_column : string, optional
+        Site identifier, e.g. 'site' or 'site_name'. The default is 'site'.
+    max_lead : int, optional
+        Drop lead times beyond this many hours. The default is None.
+
+    Returns
+    -------
+    cube : DataArray
+        float32 (run, lead, site, variable) array, NaN where a run has no
+        output, with run_time (run) and valid time (run, lead) coordinates
+
+    """
+
+    variables = list(variables)
+    runs, run_times, leads, sites, values = _scatter(data, variables, run_column, site_column, max_lead)
+    return _cube(runs, run_times, leads, sites, variables, values)
+
+
+def prediction_cube(predictions, target = 'Hsig', run_column = 'run', site_column = 'site',
+                    model_column = 'model', max_lead = None):
+    """
+    Scatter ML predictions into a cube, one variable per model
+
+    Parameters
+    ----------
+    predictions : DataFrame
+        Tidy predictions as returned by inference.ForecastModels.predict, with
+        the run of each forecast horizon added as a run column
+    target : string, optional
+        Predicted column. The default is 'Hsig'.
+    model_column : string, optional
+        The default is 'model'.
+
+    Returns
+    -------
+    cube : DataArray
+        (run, lead, site, variable) cube with variables named <target>_<model>
+
+    """
+
+    wide = predictions.set_index([run_column, site_column, model_column], append = True)[target]
+    wide = wide.unstack(model_column)
+    variables = [target+'_'+str(m) for m in wide.columns]
+    wide.columns = variables
+    wide = wide.reset_index([run_column, site_column])
+    return build_cube(wide, variables, run_column, site_column, max_lead)
+
+
+def combine(*cubes):
+    """Join cubes (e.g. SWAN and ML predictions) along the variable dimension"""
+
+    cubes = [c.drop_vars(['run_time', 'time']) for c in cubes]
+    cube = xr.concat(cubes, dim = 'variable', join = 'outer')
+    run_times = _run_times(cube['run'].values)
+    return _cube(cube['run'].values, run_times, cube['lead'].values, list(cube['site'].values),
+                 list(cube['variable'].values), cube.values.astype(np.float32))
+
+
+def observation_cube(cube, obs, site_map = None, variable_map = None):
+    """
+    Observations at the cube's valid times, in one indexed take
+
+    Parameters
+    ----------
+    cube : DataArray
+        Verification cube from build_cube, prediction_cube or combine
+    obs : DataFrame
+        Hourly wave_obs records indexed by time with a Site column, as
+        returned by toolBOX.query_waveDB
+    site_map : dictionary, optional
+        cube site: obs Site name. The default matches the names directly.
+    variable_map : dictionary, optional
+        cube variable: obs column. The default uses OBS_MATCH, and models
+        named <target>_<model> are matched by their target.
+
+    Returns
+    -------
+    observed : DataArray
+        float32 array shaped like cube, NaN where nothing was observed
+
+    """
+
+    sites = [str(s) for s in cube['site'].values]
+    site_map = {} if site_map is None else {str(k): v for k, v in site_map.items()}
+    obs_sites = [site_map.get(s, s) for s in sites]
+
+    match = dict(OBS_MATCH)
+    if variable_map is not None:
+        match.update(variable_map)
+    columns = []
+    for var in cube['variable'].values:
+        column = match.get(var, match.get(var.split('_')[0], var))
+        columns.append(column if column in obs.columns else None)
+    used = sorted(set(c for c in columns if c is not None))
+    if not used:
+        #nothing in the cube is observed
+        return cube.copy(data = np.full(cube.shape, np.nan, dtype = np.float32))
+
+    #dense (time, site, column) observations, first of duplicate records kept
+    site_codes = pd.Index(obs_sites).get_indexer(obs['Site'])
+    keep = site_codes >= 0
+    time_codes, times = pd.factorize(pd.DatetimeIndex(obs.index)[keep], sort = True)
+    dense = np.full((len(times) + 1, len(sites), len(used)), np.nan, dtype = np.float32)
+    values = obs[used].to_numpy(dtype = np.float32)[keep]
+    dense[time_codes[::-1], site_codes[keep][::-1]] = values[::-1]
+
+    #the last row of dense stays NaN and catches valid times not observed
+    rows = pd.DatetimeIndex(times).get_indexer(cube['time'].values.ravel())
+    rows = np.where(rows < 0, len(times), rows).reshape(cube['time'].shape)
+    cols = np.array([used.index(c) if c is not None else -1 for c in columns])
+    gathered = dense[rows][..., np.maximum(cols, 0)]
+    gathered[..., cols < 0] = np.nan
+    return cube.copy(data = gathered)
+
+
+def lead_stats(cube, observed, by_site = False, directions = DIRECTIONS):
+    """
+    Skill for every lead time, pooling runs (and sites)
+
+    Parameters
+    ----------
+    cube : DataArray
+        Forecast cube
+    observed : DataArray
+        Observations from observation_cube
+    by_site : bool, optional
+        Keep sites separate rather than pooling them. The default is False.
+    directions : tuple, optional
+        Variables verified with circular.circ_stats. The default is DIRECTIONS.
+
+    Returns
+    -------
+    stats : DataFrame
+        One row per variable, (site) and lead time with the cal_stats.calc_stats
+        suite, or the circular suite for directions
+
+    """
+
+    keep = ['variable', 'site', 'lead'] if by_site else ['variable', 'lead']
+    pooled = [d for d in cube.dims if d not in keep]
+    s = cube.transpose(*keep, *pooled).values
+    o = observed.transpose(*keep, *pooled).values
+    s = s.reshape(s.shape[:len(keep)] + (-1,))
+    o = o.reshape(o.shape[:len(keep)] + (-1,))
+
+    index = pd.MultiIndex.from_product([cube[k].values for k in keep], names = keep)
+    frames = []
+    variables = list(cube['variable'].values)
+    is_dir = np.array([v in directions or v.split('_')[0] in directions for v in variables])
+    for flag, func in ((False, cal_stats.calc_stats), (True, circular.circ_stats)):
+        sel = np.flatnonzero(is_dir == flag)
+        if len(sel) == 0:
+            continue
+        stats = func(s[sel], o[sel], axis = -1)
+        sub = index[np.isin(index.get_level_values('variable'), [variables[i] for i in sel])]
+        frames.append(pd.DataFrame({k: np.ravel(v) for k, v in stats.items()}, index = sub))
+    return pd.concat(frames).reindex(index).dropna(how = 'all')
+
+
+def verify_archive(archive_path, obs, variables = ('Hsig', 'Tm02', 'Dir'), site = None,
+                   start = None, end = None, max_lead = None, site_column = 'site_name',
+                   site_map = None, by_site = False):
+    """
+    Lead time skill of the archived SWAN runs against observations
+
+    Parameters
+    ----------
+    archive_path : string
+        Root directory of the SWAN_archive Parquet dataset
+    obs : DataFrame
+        Hourly wave_obs records (toolBOX.query_waveDB)
+    variables : tuple, optional
+        The default is ('Hsig', 'Tm02', 'Dir').
+    site, start, end : optional
+        Archive filters, see SWAN_archive.query
+    max_lead : int, optional
+        Last lead time (hours) to verify. The default is all.
+    site_column : string, optional
+        Archive column naming the sites. The default is 'site_name'.
+    site_map : dictionary, optional
+        Archive site name: obs Site name. The default matches directly.
+    by_site : bool, optional
+        Report each site separately. The default is False.
+
+    Returns
+    -------
+    stats : DataFrame
+        See lead_stats
+
+    """
+    import SWAN_archive
+
+    columns = list(variables) + ['lead'] + ([site_column] if site_column != 'site' else [])
+    data = SWAN_archive.query(archive_path, site = site, start = start, end = end,
+                              hours = None if max_lead is None else max_lead + 1, columns = columns)
+    if site_column in data.columns:
+        data[site_column] = data[site_column].astype(str).str.strip()
+    cube = build_cube(data, variables, site_column = site_column, max_lead = max_lead)
+    observed = observation_cube(cube, obs, site_map)
+    return lead_stats(cube, observed, by_site)